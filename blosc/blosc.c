@@ -161,8 +161,9 @@ int32_t rc = 0;
 #endif
 
 
-/* A function for aligned malloc that is portable */
-uint8_t *my_malloc(size_t size)
+/* A function for aligned malloc that is portable.  Returns NULL if
+   there is not enough memory. */
+static uint8_t *try_malloc(size_t size)
 {
   void *block = NULL;
   int res = 0;
@@ -180,12 +181,24 @@ uint8_t *my_malloc(size_t size)
   block = malloc(size);
 #endif  /* _WIN32 */
 
-  if (block == NULL || res != 0) {
+  if (res != 0) {
+    return NULL;
+  }
+  return (uint8_t *)block;
+}
+
+
+/* A function for aligned malloc that is portable (exits on errors) */
+uint8_t *my_malloc(size_t size)
+{
+  uint8_t *block = try_malloc(size);
+
+  if (block == NULL) {
     printf("Error allocating memory!");
     exit(1);
   }
 
-  return (uint8_t *)block;
+  return block;
 }
 
 
@@ -226,7 +239,8 @@ int32_t sw32(int32_t a)
 
 
 /* Shuffle & compress a single block */
-static int blosc_c(uint32_t blocksize, int32_t leftoverblock,
+static int blosc_c(const struct thread_data *p,
+                   uint32_t blocksize, int32_t leftoverblock,
                    uint32_t ntbytes, uint32_t maxbytes,
                    uint8_t *src, uint8_t *dest, uint8_t *tmp)
 {
@@ -234,10 +248,10 @@ static int blosc_c(uint32_t blocksize, int32_t leftoverblock,
   int32_t cbytes;                   /* number of compressed bytes in split */
   int32_t ctbytes = 0;              /* number of compressed bytes in block */
   int32_t maxout;
-  uint32_t typesize = params.typesize;
+  uint32_t typesize = p->typesize;
   uint8_t *_tmp;
 
-  if ((params.flags & BLOSC_DOSHUFFLE) && (typesize > 1)) {
+  if ((p->flags & BLOSC_DOSHUFFLE) && (typesize > 1)) {
     /* Shuffle this block (this makes sense only if typesize > 1) */
     shuffle(typesize, blocksize, src, tmp);
     _tmp = tmp;
@@ -268,7 +282,7 @@ static int blosc_c(uint32_t blocksize, int32_t leftoverblock,
         return 0;                  /* non-compressible block */
       }
     }
-    cbytes = blosclz_compress(params.clevel, _tmp+j*neblock, neblock,
+    cbytes = blosclz_compress(p->clevel, _tmp+j*neblock, neblock,
                               dest, maxout);
     if (cbytes >= maxout) {
       /* Buffer overrun caused by blosclz_compress (should never happen) */
@@ -299,7 +313,8 @@ static int blosc_c(uint32_t blocksize, int32_t leftoverblock,
 
 
 /* Decompress & unshuffle a single block */
-static int blosc_d(uint32_t blocksize, int32_t leftoverblock,
+static int blosc_d(const struct thread_data *p,
+                   uint32_t blocksize, int32_t leftoverblock,
                    uint8_t *src, uint8_t *dest, uint8_t *tmp, uint8_t *tmp2)
 {
   int32_t j, neblock, nsplits;
@@ -308,9 +323,9 @@ static int blosc_d(uint32_t blocksize, int32_t leftoverblock,
   int32_t ctbytes = 0;           /* number of compressed bytes in block */
   int32_t ntbytes = 0;           /* number of uncompressed bytes in block */
   uint8_t *_tmp;
-  uint32_t typesize = params.typesize;
+  uint32_t typesize = p->typesize;
 
-  if ((params.flags & BLOSC_DOSHUFFLE) && (typesize > 1)) {
+  if ((p->flags & BLOSC_DOSHUFFLE) && (typesize > 1)) {
     _tmp = tmp;
   }
   else {
@@ -347,7 +362,7 @@ static int blosc_d(uint32_t blocksize, int32_t leftoverblock,
     ntbytes += nbytes;
   } /* Closes j < nsplits */
 
-  if ((params.flags & BLOSC_DOSHUFFLE) && (typesize > 1)) {
+  if ((p->flags & BLOSC_DOSHUFFLE) && (typesize > 1)) {
     if ((uintptr_t)dest % 16 == 0) {
       /* 16-bytes aligned dest.  SSE2 unshuffle will work. */
       unshuffle(typesize, blocksize, tmp, dest);
@@ -403,7 +418,7 @@ int serial_blosc(void)
       }
       else {
         /* Regular compression */
-        cbytes = blosc_c(bsize, leftoverblock, ntbytes, maxbytes,
+        cbytes = blosc_c(&params, bsize, leftoverblock, ntbytes, maxbytes,
                          src+j*blocksize, dest+ntbytes, tmp);
         if (cbytes == 0) {
           ntbytes = 0;              /* uncompressible data */
@@ -419,7 +434,7 @@ int serial_blosc(void)
       }
       else {
         /* Regular decompression */
-        cbytes = blosc_d(bsize, leftoverblock,
+        cbytes = blosc_d(&params, bsize, leftoverblock,
                          src+sw32(bstarts[j]), dest+j*blocksize, tmp, tmp2);
       }
     }
@@ -724,6 +739,462 @@ int blosc_compress(int clevel, int doshuffle, size_t typesize, size_t nbytes,
 }
 
 
+/* The context for the re-entrant API */
+struct blosc_context {
+  int32_t nthreads;              /* number of threads for each call */
+  uint32_t tmpsize;              /* size of the temporaries */
+  uint8_t *tmp[BLOSC_MAX_THREADS];
+  uint8_t *tmp2[BLOSC_MAX_THREADS];
+};
+
+/* The state shared by the threads working on a buffer of a context */
+struct context_job {
+  struct thread_data p;          /* only typesize, flags & clevel used */
+  blosc_context *ctx;
+  int32_t compress;
+  uint32_t blocksize;
+  uint32_t nblocks;
+  uint32_t leftover;
+  uint32_t maxbytes;
+  uint32_t *bstarts;
+  uint8_t *src;
+  uint8_t *dest;
+  pthread_mutex_t mutex;
+  uint32_t nblock;               /* next block to be processed */
+  int32_t ntbytes;               /* compressed bytes so far */
+  int32_t error;                 /* 1 if not compressible, <0 if error */
+};
+
+/* The arguments for every thread working on a job */
+struct context_worker {
+  struct context_job *job;
+  int32_t tid;
+};
+
+/* Threads are only used when each one gets at least this many blocks */
+#define MIN_BLOCKS_PER_THREAD 4
+
+
+/* Create a context.  See blosc.h for docstrings. */
+blosc_context *blosc_create_context(int nthreads)
+{
+  blosc_context *ctx;
+
+  ctx = (blosc_context *)calloc(1, sizeof(blosc_context));
+  if (ctx != NULL) {
+    blosc_set_context_nthreads(ctx, nthreads);
+  }
+  return ctx;
+}
+
+
+/* Release the temporaries of a context */
+static void release_context_temps(blosc_context *ctx)
+{
+  int32_t tid;
+
+  for (tid = 0; tid < BLOSC_MAX_THREADS; tid++) {
+    if (ctx->tmp[tid] != NULL) {
+      my_free(ctx->tmp[tid]);
+      ctx->tmp[tid] = NULL;
+    }
+    if (ctx->tmp2[tid] != NULL) {
+      my_free(ctx->tmp2[tid]);
+      ctx->tmp2[tid] = NULL;
+    }
+  }
+  ctx->tmpsize = 0;
+}
+
+
+/* Make room for `size` bytes in the temporaries of the first
+   `nthreads` threads of a context.  Returns 0 on success or
+   BLOSC_ENOMEM if there is not enough memory. */
+static int ensure_context_temps(blosc_context *ctx, uint32_t size,
+                                int32_t nthreads)
+{
+  int32_t tid;
+
+  if (size > ctx->tmpsize) {
+    release_context_temps(ctx);
+    ctx->tmpsize = size;
+  }
+  for (tid = 0; tid < nthreads; tid++) {
+    if (ctx->tmp[tid] == NULL) {
+      ctx->tmp[tid] = try_malloc(ctx->tmpsize);
+      ctx->tmp2[tid] = try_malloc(ctx->tmpsize);
+      if (ctx->tmp[tid] == NULL || ctx->tmp2[tid] == NULL) {
+        release_context_temps(ctx);
+        return BLOSC_ENOMEM;
+      }
+    }
+  }
+  return 0;
+}
+
+
+/* Set the number of threads of a context.  See blosc.h for docstrings. */
+int blosc_set_context_nthreads(blosc_context *ctx, int nthreads)
+{
+  int32_t nthreads_old = ctx->nthreads;
+
+  if (nthreads < 1) {
+    nthreads = 1;
+  }
+  if (nthreads > BLOSC_MAX_THREADS) {
+    nthreads = BLOSC_MAX_THREADS;
+  }
+  ctx->nthreads = nthreads;
+  return nthreads_old;
+}
+
+
+/* Release a context.  See blosc.h for docstrings. */
+void blosc_free_context(blosc_context *ctx)
+{
+  if (ctx != NULL) {
+    release_context_temps(ctx);
+    free(ctx);
+  }
+}
+
+
+/* Process the blocks of a job until none is left */
+static void *context_work(void *arg)
+{
+  struct context_worker *worker = (struct context_worker *)arg;
+  struct context_job *job = worker->job;
+  uint8_t *tmp = job->ctx->tmp[worker->tid];
+  uint8_t *tmp2 = job->ctx->tmp2[worker->tid];
+  uint32_t j, bsize, leftoverblock;
+  int32_t cbytes, offset;
+
+  while (1) {
+    pthread_mutex_lock(&job->mutex);
+    if (job->error || job->nblock >= job->nblocks) {
+      pthread_mutex_unlock(&job->mutex);
+      break;
+    }
+    j = job->nblock++;
+    pthread_mutex_unlock(&job->mutex);
+
+    bsize = job->blocksize;
+    leftoverblock = 0;
+    if ((j == job->nblocks - 1) && (job->leftover > 0)) {
+      bsize = job->leftover;
+      leftoverblock = 1;
+    }
+    if (job->compress) {
+      /* Compress in tmp2 and then reserve room for the block in dest */
+      cbytes = blosc_c(&job->p, bsize, leftoverblock, 0, job->ctx->tmpsize,
+                       job->src+j*job->blocksize, tmp2, tmp);
+      offset = -1;
+      pthread_mutex_lock(&job->mutex);
+      if (cbytes < 0) {
+        job->error = cbytes;
+      }
+      else if (cbytes == 0 || job->ntbytes + cbytes > (int32_t)job->maxbytes) {
+        job->error = 1;             /* not compressible */
+      }
+      else {
+        offset = job->ntbytes;
+        job->ntbytes += cbytes;
+      }
+      pthread_mutex_unlock(&job->mutex);
+      if (offset >= 0) {
+        job->bstarts[j] = sw32(offset);
+        memcpy(job->dest+offset, tmp2, cbytes);
+      }
+    }
+    else {
+      cbytes = blosc_d(&job->p, bsize, leftoverblock,
+                       job->src+sw32(job->bstarts[j]),
+                       job->dest+j*job->blocksize, tmp, tmp2);
+      if (cbytes < 0) {
+        pthread_mutex_lock(&job->mutex);
+        job->error = cbytes;
+        pthread_mutex_unlock(&job->mutex);
+      }
+    }
+  }
+  return NULL;
+}
+
+
+/* Run a job with the threads of its context */
+static void run_context_job(struct context_job *job)
+{
+  struct context_worker workers[BLOSC_MAX_THREADS];
+  pthread_t threads_[BLOSC_MAX_THREADS];
+  int32_t tid, nthreads_ = job->ctx->nthreads;
+
+  if (nthreads_ > (int32_t)(job->nblocks / MIN_BLOCKS_PER_THREAD)) {
+    nthreads_ = job->nblocks / MIN_BLOCKS_PER_THREAD;
+  }
+  if (nthreads_ < 1) {
+    nthreads_ = 1;
+  }
+  job->error = ensure_context_temps(job->ctx,
+                                    job->blocksize +
+                                    job->p.typesize*sizeof(int32_t),
+                                    nthreads_);
+  if (job->error < 0) {
+    return;
+  }
+  pthread_mutex_init(&job->mutex, NULL);
+  job->nblock = 0;
+
+  for (tid = 0; tid < nthreads_; tid++) {
+    workers[tid].job = job;
+    workers[tid].tid = tid;
+  }
+  /* The calling thread works too */
+  for (tid = 1; tid < nthreads_; tid++) {
+    if (pthread_create(&threads_[tid], NULL, context_work,
+                       (void *)&workers[tid]) != 0) {
+      break;
+    }
+  }
+  nthreads_ = tid;
+  context_work((void *)&workers[0]);
+  for (tid = 1; tid < nthreads_; tid++) {
+    pthread_join(threads_[tid], NULL);
+  }
+  pthread_mutex_destroy(&job->mutex);
+}
+
+
+/* The re-entrant routine for compression.  See blosc.h for docstrings. */
+int blosc_compress_ctx(blosc_context *ctx, int clevel, int doshuffle,
+                       size_t typesize, size_t nbytes, const void *src,
+                       void *dest, size_t destsize)
+{
+  struct context_job job;
+  uint8_t *_dest = (uint8_t *)dest;
+  uint8_t flags = 0;             /* flags for header */
+  uint32_t nbytes_;              /* number of bytes in source buffer */
+  uint32_t nblocks;              /* number of total blocks in buffer */
+  uint32_t blocksize;            /* length of the block in bytes */
+  uint32_t ntbytes;              /* the number of compressed bytes */
+  uint32_t maxbytes = (uint32_t)destsize;  /* maximum size for dest buffer */
+
+  if (nbytes > BLOSC_MAX_BUFFERSIZE) {
+    fprintf(stderr, "Input buffer size cannot exceed %d MB\n",
+            BLOSC_MAX_BUFFERSIZE / MB);
+    return -1;
+  }
+  nbytes_ = (uint32_t)nbytes;
+  if (clevel < 0 || clevel > 9) {
+    fprintf(stderr, "`clevel` parameter must be between 0 and 9!\n");
+    return -10;
+  }
+  if (doshuffle != 0 && doshuffle != 1) {
+    fprintf(stderr, "`shuffle` parameter must be either 0 or 1!\n");
+    return -10;
+  }
+  if (typesize > BLOSC_MAX_TYPESIZE) {
+    typesize = 1;
+  }
+
+  blocksize = compute_blocksize(clevel, (uint32_t)typesize, nbytes_);
+  nblocks = nbytes_ / blocksize;
+  job.leftover = nbytes_ % blocksize;
+  nblocks = (job.leftover>0)? nblocks+1: nblocks;
+
+  if (clevel == 0 || nbytes_ < MIN_BUFFERSIZE) {
+    flags |= BLOSC_MEMCPYED;
+  }
+  if (doshuffle == 1) {
+    flags |= BLOSC_DOSHUFFLE;
+  }
+  if (16 + sizeof(int32_t)*nblocks > maxbytes) {
+    return 0;
+  }
+
+  /* Write the header (same layout than in blosc_compress()) */
+  _dest[0] = BLOSC_VERSION_FORMAT;
+  _dest[1] = BLOSCLZ_VERSION_FORMAT;
+  _dest[3] = (uint8_t)typesize;
+  ((uint32_t *)(_dest+4))[0] = sw32(nbytes_);
+  ((uint32_t *)(_dest+4))[1] = sw32(blocksize);
+  ntbytes = 16 + sizeof(int32_t)*nblocks;
+
+  if (!(flags & BLOSC_MEMCPYED)) {
+    job.p.typesize = (uint32_t)typesize;
+    job.p.flags = flags;
+    job.p.clevel = clevel;
+    job.ctx = ctx;
+    job.compress = 1;
+    job.blocksize = blocksize;
+    job.nblocks = nblocks;
+    job.maxbytes = maxbytes;
+    job.bstarts = (uint32_t *)(_dest+16);
+    job.src = (uint8_t *)src;
+    job.dest = _dest;
+    job.ntbytes = ntbytes;
+    run_context_job(&job);
+    if (job.error < 0) {
+      return job.error;
+    }
+    if (job.error) {
+      /* Uncompressible data.  Try memcpy'ing. */
+      flags |= BLOSC_MEMCPYED;
+    }
+    ntbytes = job.ntbytes;
+  }
+
+  if (flags & BLOSC_MEMCPYED) {
+    if (nbytes_+BLOSC_MAX_OVERHEAD > maxbytes) {
+      return 0;
+    }
+    memcpy(_dest+BLOSC_MAX_OVERHEAD, src, nbytes_);
+    ntbytes = nbytes_ + BLOSC_MAX_OVERHEAD;
+  }
+
+  _dest[2] = flags;
+  ((uint32_t *)(_dest+4))[2] = sw32(ntbytes);
+  return ntbytes;
+}
+
+
+/* The re-entrant routine for decompression.  See blosc.h for docstrings. */
+int blosc_decompress_ctx(blosc_context *ctx, const void *src, void *dest,
+                         size_t destsize)
+{
+  struct context_job job;
+  uint8_t *_src = (uint8_t *)src;
+  uint8_t flags;
+  uint32_t typesize, blocksize, nbytes, nblocks;
+
+  /* Read the header block */
+  flags = _src[2];
+  typesize = (uint32_t)_src[3];
+  nbytes = sw32(((uint32_t *)(_src+4))[0]);
+  blocksize = sw32(((uint32_t *)(_src+4))[1]);
+  nblocks = nbytes / blocksize;
+  job.leftover = nbytes % blocksize;
+  nblocks = (job.leftover>0)? nblocks+1: nblocks;
+
+  /* Check that we have enough space to decompress */
+  if (nbytes > destsize) {
+    return -1;
+  }
+
+  if (flags & BLOSC_MEMCPYED) {
+    memcpy(dest, _src+BLOSC_MAX_OVERHEAD, nbytes);
+    return nbytes;
+  }
+
+  job.p.typesize = typesize;
+  job.p.flags = flags;
+  job.p.clevel = 0;
+  job.ctx = ctx;
+  job.compress = 0;
+  job.blocksize = blocksize;
+  job.nblocks = nblocks;
+  job.maxbytes = 0;
+  job.bstarts = (uint32_t *)(_src+16);
+  job.src = _src;
+  job.dest = (uint8_t *)dest;
+  job.ntbytes = 0;
+  run_context_job(&job);
+  if (job.error < 0) {
+    return job.error;
+  }
+  return nbytes;
+}
+
+
+/* The re-entrant routine for getting items.  See blosc.h for docstrings. */
+int blosc_getitem_ctx(blosc_context *ctx, const void *src, int start,
+                      int nitems, void *dest)
+{
+  struct thread_data p;
+  uint8_t *_src = (uint8_t *)src;
+  uint8_t flags;
+  int32_t ntbytes = 0;
+  uint32_t nblocks, leftover;
+  uint32_t *bstarts;
+  uint8_t *tmp, *tmp2;
+  uint32_t typesize, blocksize, nbytes;
+  uint32_t j, bsize, bsize2, leftoverblock;
+  int32_t cbytes, startb, stopb;
+  int stop = start + nitems;
+
+  /* Read the header block */
+  flags = _src[2];
+  typesize = (uint32_t)_src[3];
+  nbytes = sw32(((uint32_t *)(_src+4))[0]);
+  blocksize = sw32(((uint32_t *)(_src+4))[1]);
+  bstarts = (uint32_t *)(_src+16);
+  nblocks = nbytes / blocksize;
+  leftover = nbytes % blocksize;
+  nblocks = (leftover>0)? nblocks+1: nblocks;
+
+  /* Check region boundaries */
+  if ((start < 0) || (start*typesize > nbytes)) {
+    fprintf(stderr, "`start` out of bounds");
+    return (-1);
+  }
+  if ((stop < 0) || (stop*typesize > nbytes)) {
+    fprintf(stderr, "`start`+`nitems` out of bounds");
+    return (-1);
+  }
+
+  p.typesize = typesize;
+  p.flags = flags;
+  p.clevel = 0;
+  if (ensure_context_temps(ctx, blocksize, 1) < 0) {
+    return BLOSC_ENOMEM;
+  }
+  tmp = ctx->tmp[0];
+  tmp2 = ctx->tmp2[0];
+
+  for (j = 0; j < nblocks; j++) {
+    bsize = blocksize;
+    leftoverblock = 0;
+    if ((j == nblocks - 1) && (leftover > 0)) {
+      bsize = leftover;
+      leftoverblock = 1;
+    }
+
+    /* Compute start & stop for each block */
+    startb = start * typesize - j * blocksize;
+    stopb = stop * typesize - j * blocksize;
+    if ((startb >= (int)blocksize) || (stopb <= 0)) {
+      continue;
+    }
+    if (startb < 0) {
+      startb = 0;
+    }
+    if (stopb > (int)blocksize) {
+      stopb = blocksize;
+    }
+    bsize2 = stopb - startb;
+
+    if (flags & BLOSC_MEMCPYED) {
+      memcpy((uint8_t *)dest + ntbytes,
+             _src + BLOSC_MAX_OVERHEAD + j*blocksize + startb, bsize2);
+      cbytes = bsize2;
+    }
+    else {
+      /* Regular decompression.  Put results in tmp2. */
+      cbytes = blosc_d(&p, bsize, leftoverblock, _src+sw32(bstarts[j]),
+                       tmp2, tmp, tmp2);
+      if (cbytes < 0) {
+        ntbytes = cbytes;
+        break;
+      }
+      memcpy((uint8_t *)dest + ntbytes, tmp2 + startb, bsize2);
+      cbytes = bsize2;
+    }
+    ntbytes += cbytes;
+  }
+
+  return ntbytes;
+}
+
+
 /* The public routine for decompression.  See blosc.h for docstrings. */
 int blosc_decompress(const void *src, void *dest, size_t destsize)
 {
@@ -895,7 +1366,7 @@ int blosc_getitem(const void *src, int start, int nitems, void *dest)
     }
     else {
       /* Regular decompression.  Put results in tmp2. */
-      cbytes = blosc_d(bsize, leftoverblock,
+      cbytes = blosc_d(&params, bsize, leftoverblock,
                        (uint8_t *)src+sw32(bstarts[j]), tmp2, tmp, tmp2);
       if (cbytes < 0) {
         ntbytes = cbytes;
@@ -917,6 +1388,200 @@ int blosc_getitem(const void *src, int start, int nitems, void *dest)
 }
 
 
+/* Return the number of compressed bytes in a block starting at `src` */
+static int32_t block_cbytes(uint8_t *src, uint32_t typesize,
+                            uint32_t blocksize, int32_t leftoverblock)
+{
+  int32_t j, nsplits;
+  int32_t ctbytes = 0;
+
+  /* The same splitting than in blosc_c() and blosc_d() */
+  if ((typesize <= MAX_SPLITS) && (blocksize/typesize) >= MIN_BUFFERSIZE &&
+      (!leftoverblock)) {
+    nsplits = typesize;
+  }
+  else {
+    nsplits = 1;
+  }
+  for (j = 0; j < nsplits; j++) {
+    ctbytes += sizeof(int32_t) + sw32(((uint32_t *)(src+ctbytes))[0]);
+  }
+  return ctbytes;
+}
+
+
+/* The public routine for trial compression.  See blosc.h for docstrings. */
+int blosc_trial(int clevel, int doshuffle, size_t typesize, size_t nbytes,
+                const void *src, size_t *sbytes)
+{
+  uint32_t blocksize, nblocks;
+  int32_t cbytes;
+  uint8_t *sample, *dest, *tmp;
+
+  if (nbytes > BLOSC_MAX_BUFFERSIZE) {
+    fprintf(stderr, "Input buffer size cannot exceed %d MB\n",
+            BLOSC_MAX_BUFFERSIZE / MB);
+    return -1;
+  }
+  if (clevel < 0 || clevel > 9) {
+    fprintf(stderr, "`clevel` parameter must be between 0 and 9!\n");
+    return -10;
+  }
+  if (typesize > BLOSC_MAX_TYPESIZE) {
+    typesize = 1;
+  }
+
+  blocksize = compute_blocksize(clevel, (uint32_t)typesize, (int32_t)nbytes);
+  nblocks = (uint32_t)nbytes / blocksize;
+  *sbytes = blocksize;
+  if (nblocks == 0 || clevel == 0) {
+    /* Nothing worth sampling */
+    return blocksize;
+  }
+  /* The middle block is never a leftover one */
+  sample = (uint8_t *)src + (nblocks / 2) * blocksize;
+
+  /* Parameters needed by blosc_c */
+  params.typesize = (uint32_t)typesize;
+  params.flags = doshuffle? BLOSC_DOSHUFFLE: 0;
+  params.clevel = clevel;
+
+  dest = my_malloc(blocksize);
+  tmp = my_malloc(blocksize);
+  cbytes = blosc_c(&params, blocksize, 0, 0, blocksize, sample, dest, tmp);
+  my_free(dest);
+  my_free(tmp);
+
+  if (cbytes == 0) {
+    /* Not compressible */
+    cbytes = blocksize;
+  }
+  return cbytes;
+}
+
+
+/* The public routine for splicing.  See blosc.h for docstrings. */
+int blosc_splice(const void *src, size_t offset, size_t nbytes,
+                 const void *data, int clevel, void *dest, size_t destsize)
+{
+  uint8_t *_src = (uint8_t *)src;
+  uint8_t *_dest = (uint8_t *)dest;
+  uint8_t flags;                    /* flags for header */
+  uint32_t typesize, blocksize, nbytes_, ctbytes;
+  uint32_t nblocks;                 /* number of total blocks in buffer */
+  uint32_t leftover;                /* extra bytes at end of buffer */
+  uint32_t *bstarts, *dbstarts;     /* start pointers for each block */
+  uint32_t j, bsize, leftoverblock, startb, stopb;
+  uint32_t ntbytes;                 /* the number of compressed bytes */
+  int32_t cbytes = 0;
+  uint8_t *block, *tmp, *tmp2;
+
+  /* Read the header block */
+  flags = _src[2];
+  typesize = (uint32_t)_src[3];
+  nbytes_ = sw32(((uint32_t *)(_src+4))[0]);
+  blocksize = sw32(((uint32_t *)(_src+4))[1]);
+  ctbytes = sw32(((uint32_t *)(_src+4))[2]);
+  bstarts = (uint32_t *)(_src+16);
+  nblocks = nbytes_ / blocksize;
+  leftover = nbytes_ % blocksize;
+  nblocks = (leftover>0)? nblocks+1: nblocks;
+
+  /* Check region boundaries */
+  if (offset + nbytes > nbytes_) {
+    fprintf(stderr, "`offset`+`nbytes` out of bounds");
+    return -1;
+  }
+  if (clevel < 0 || clevel > 9) {
+    fprintf(stderr, "`clevel` parameter must be between 0 and 9!\n");
+    return -10;
+  }
+
+  if (flags & BLOSC_MEMCPYED) {
+    /* Data is stored verbatim.  Just copy and patch it. */
+    if (ctbytes > destsize) {
+      return 0;
+    }
+    memcpy(_dest, _src, ctbytes);
+    memcpy(_dest+BLOSC_MAX_OVERHEAD+offset, data, nbytes);
+    return ctbytes;
+  }
+
+  /* The header and the block starts */
+  ntbytes = 16 + sizeof(int32_t)*nblocks;
+  if (ntbytes > destsize) {
+    return 0;
+  }
+  memcpy(_dest, _src, 16);
+  dbstarts = (uint32_t *)(_dest+16);
+
+  /* Parameters needed by blosc_c and blosc_d */
+  params.typesize = typesize;
+  params.flags = flags;
+  params.clevel = clevel;
+
+  block = my_malloc(blocksize);
+  tmp = my_malloc(blocksize);
+  tmp2 = my_malloc(blocksize);
+
+  for (j = 0; j < nblocks; j++) {
+    bsize = blocksize;
+    leftoverblock = 0;
+    if ((j == nblocks - 1) && (leftover > 0)) {
+      bsize = leftover;
+      leftoverblock = 1;
+    }
+    dbstarts[j] = sw32(ntbytes);
+    startb = j * blocksize;
+    stopb = startb + bsize;
+    if (nbytes > 0 && offset < stopb && offset + nbytes > startb) {
+      /* Block overlapping the region.  Patch and compress it again. */
+      cbytes = blosc_d(&params, bsize, leftoverblock, _src+sw32(bstarts[j]),
+                       block, tmp, tmp2);
+      if (cbytes < 0) {
+        break;
+      }
+      if (offset > startb) {
+        startb = offset;
+      }
+      if (offset + nbytes < stopb) {
+        stopb = offset + nbytes;
+      }
+      memcpy(block + startb - j*blocksize, (uint8_t *)data + startb - offset,
+             stopb - startb);
+      cbytes = blosc_c(&params, bsize, leftoverblock, ntbytes, destsize,
+                       block, _dest+ntbytes, tmp);
+    }
+    else {
+      /* Untouched block.  Copy it as is. */
+      cbytes = block_cbytes(_src+sw32(bstarts[j]), typesize, bsize,
+                            leftoverblock);
+      if (ntbytes + cbytes > destsize) {
+        cbytes = 0;
+      }
+      else {
+        memcpy(_dest+ntbytes, _src+sw32(bstarts[j]), cbytes);
+      }
+    }
+    if (cbytes <= 0) {
+      break;      /* error or not fitting in dest */
+    }
+    ntbytes += cbytes;
+  }
+
+  my_free(block);
+  my_free(tmp);
+  my_free(tmp2);
+
+  if (j < nblocks) {
+    return cbytes;
+  }
+  /* Set the number of compressed bytes in header */
+  ((uint32_t *)(_dest+4))[2] = sw32(ntbytes);
+  return ntbytes;
+}
+
+
 /* Decompress & unshuffle several blocks in a single thread */
 void *t_blosc(void *tids)
 {
@@ -1020,7 +1685,7 @@ void *t_blosc(void *tids)
         }
         else {
           /* Regular compression */
-          cbytes = blosc_c(bsize, leftoverblock, 0, ebsize,
+          cbytes = blosc_c(&params, bsize, leftoverblock, 0, ebsize,
                            src+nblock_*blocksize, tmp2, tmp);
         }
       }
@@ -1032,7 +1697,7 @@ void *t_blosc(void *tids)
           cbytes = bsize;
         }
         else {
-          cbytes = blosc_d(bsize, leftoverblock,
+          cbytes = blosc_d(&params, bsize, leftoverblock,
                            src+sw32(bstarts[nblock_]), dest+nblock_*blocksize,
                            tmp, tmp2);
         }
@@ -89,6 +89,58 @@ int blosc_compress(int clevel, int doshuffle, size_t typesize, size_t nbytes,
 		   const void *src, void *dest, size_t destsize);
 
 
+/**
+  The context-based API.  A context holds its own temporaries and
+  number of threads, so that different threads can compress and
+  decompress at the same time as long as each one uses its own context.
+  None of these functions touch the global state of Blosc.
+
+  When a context has more than one thread, these are started for each
+  call (only if every thread gets at least a few blocks) and joined
+  before returning.
+ */
+
+typedef struct blosc_context blosc_context;
+
+/**
+  Create a context using `nthreads` threads.  Returns NULL if there is
+  not enough memory.
+ */
+
+blosc_context *blosc_create_context(int nthreads);
+
+/**
+  Set the number of threads of `ctx`.  Returns the previous setting.
+ */
+
+int blosc_set_context_nthreads(blosc_context *ctx, int nthreads);
+
+/**
+  Release `ctx` and its temporaries.
+ */
+
+void blosc_free_context(blosc_context *ctx);
+
+/**
+  Same than `blosc_compress`, `blosc_decompress` and `blosc_getitem`,
+  but using the temporaries and threads of `ctx`.  A context must not
+  be used from different threads at the same time.  BLOSC_ENOMEM is
+  returned if the temporaries cannot be allocated.
+ */
+
+#define BLOSC_ENOMEM (-20)
+
+int blosc_compress_ctx(blosc_context *ctx, int clevel, int doshuffle,
+                       size_t typesize, size_t nbytes, const void *src,
+                       void *dest, size_t destsize);
+
+int blosc_decompress_ctx(blosc_context *ctx, const void *src, void *dest,
+                         size_t destsize);
+
+int blosc_getitem_ctx(blosc_context *ctx, const void *src, int start,
+                      int nitems, void *dest);
+
+
 /**
   Decompress a block of compressed data in `src`, put the result in
   `dest` and returns the size of the decompressed block. If error
@@ -117,6 +169,44 @@ int blosc_decompress(const void *src, void *dest, size_t destsize);
 int blosc_getitem(const void *src, int start, int nitems, void *dest);
 
 
+/**
+  Replace `nbytes` of the uncompressed data in `src`, starting at byte
+  `offset`, by the bytes in `data`, and put the resulting compressed
+  buffer in `dest`.  Only the blocks overlapping the replaced region
+  are decompressed and compressed again (with `clevel`); the rest are
+  copied verbatim.
+
+  The `dest` buffer must have at least the size of `destsize`.  If the
+  outcome does not fit in there (e.g. because the new data cannot be
+  compressed), the return value is zero and you should compress the
+  whole buffer again instead.  On success, the size of the new
+  compressed buffer is returned.  A negative return value means that
+  an error happened (e.g. the region is out of bounds).
+
+  The `src` buffer and the `dest` buffer can not overlap.  Like the
+  rest of Blosc functions, this is not re-entrant and not thread-safe.
+ */
+
+int blosc_splice(const void *src, size_t offset, size_t nbytes,
+                 const void *data, int clevel, void *dest, size_t destsize);
+
+
+/**
+  Estimate how well the `nbytes` in `src` compress by compressing a
+  single sample block (the one in the middle of the buffer, with the
+  blocksize that `blosc_compress` would use for `clevel`).
+
+  The size of the sample block is put in `sbytes` and the size of its
+  compressed version is returned.  If the block cannot be compressed,
+  `sbytes` itself is returned.  A negative return value means that an
+  error happened.  Like the rest of Blosc functions, this is not
+  re-entrant and not thread-safe.
+ */
+
+int blosc_trial(int clevel, int doshuffle, size_t typesize, size_t nbytes,
+                const void *src, size_t *sbytes);
+
+
 /**
   Initialize a pool of threads for compression/decompression.  If
   `nthreads` is 1, then the serial version is chosen and a possible
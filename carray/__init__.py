@@ -18,6 +18,10 @@ Public variables
 ----------------
 
 * __version__ : the version of carray package
+* chunk_arena : the allocator for the compressed data of chunks
+* chunk_cache : the cache of decompressed chunks for disk-based carrays
+* chunk_compressor : the pool of threads compressing chunks in bulk loads
+* chunk_tierer : the thread compressing again the cold chunks of carrays
 * default_vm : the virtual machine to be used in computations
 * min_numexpr_version : the minimum version of numexpr needed
 * ncores : the number of detected cores
@@ -29,7 +33,10 @@ Public functions
 * blosc_set_nthreads
 * blosc_version
 * detect_number_of_cores
+* fromfile
 * fromiter
+* load
+* open
 * set_nthreads
 
 Public classes
@@ -52,11 +59,13 @@ else:
         numexpr_here = True
 
 from carray.carrayExtension import (
-    carray, blosc_version, _blosc_set_nthreads as blosc_set_nthreads )
+    carray, blosc_version, _blosc_set_nthreads as blosc_set_nthreads,
+    chunk_cache, block_cache, chunk_arena, chunk_tierer, chunk_compressor,
+    chunk_decompressor )
 from carray.ctable import ctable
 from carray.toplevel import (
     detect_number_of_cores, set_nthreads,
-    fromiter, arange, zeros, ones, fill,
+    fromiter, fromfile, arange, zeros, ones, fill, open, load,
     cparams, eval )
 from carray.version import __version__
 from carray.tests import test
@@ -7,7 +7,17 @@
 ########################################################################
 
 
-import sys
+import sys, os, os.path, shutil, tempfile
+import struct
+import mmap
+import base64
+import json
+import itertools
+import bisect
+import threading
+import collections
+import weakref
+from cStringIO import StringIO
 import numpy as np
 import carray as ca
 from carray import utils
@@ -15,6 +25,29 @@ from carray import utils
 _KB = 1024
 _MB = 1024*_KB
 
+# The names of the files and directories for persistent carrays
+META_FILE = "meta"
+DATA_DIR = "data"
+# The magic string and the trailer format (index offset) for packed carrays
+PACK_MAGIC = "CARRAYPK"
+PACK_TRAILER = "<Q"
+
+# After a chunk is found incompressible, the number of chunks to be
+# stored verbatim without trying them (see `trial`).  Smaller chunks are
+# not tracked.
+TRIAL_SKIP = 16
+TRIAL_MINBYTES = 16*_KB
+
+# The minimum number of chunks in a range read for decompressing them
+# in the `chunk_decompressor` threads
+PARALLEL_MINCHUNKS = 4
+
+# The global Blosc functions keep their state in global variables, so
+# calls to them coming from different threads have to be serialized.
+# Compression and decompression use a Blosc context per thread instead
+# (see `get_context()`), so this is only needed for splicing and trials.
+blosc_lock = threading.Lock()
+
 # The type used for size values: indexes, coordinates, dimension
 # lengths, row numbers, shapes, chunk shapes, byte counts...
 SizeType = np.int64
@@ -26,11 +59,12 @@ IntType = np.dtype(np.int_)
 
 # numpy functions & objects
 from definitions cimport import_array, ndarray, dtype, \
-     malloc, realloc, free, memcpy, memset, strdup, strcmp, \
-     PyString_AsString, PyString_FromString, \
+     malloc, realloc, free, memcpy, memcmp, memset, strdup, strcmp, \
+     PyString_AsString, PyString_FromString, PyString_FromStringAndSize, \
+     PyObject_AsReadBuffer, Py_ssize_t, Py_INCREF, Py_DECREF, \
      Py_BEGIN_ALLOW_THREADS, Py_END_ALLOW_THREADS, \
      PyArray_GETITEM, PyArray_SETITEM, \
-     npy_intp
+     npy_intp, time_t, time
 
 #-----------------------------------------------------------------
 
@@ -40,6 +74,7 @@ cdef extern from "blosc.h":
 
   cdef enum:
     BLOSC_MAX_OVERHEAD,
+    BLOSC_ENOMEM,
     BLOSC_VERSION_STRING,
     BLOSC_VERSION_DATE
 
@@ -50,6 +85,22 @@ cdef extern from "blosc.h":
                      size_t destsize) nogil
   int blosc_decompress(void *src, void *dest, size_t destsize) nogil
   int blosc_getitem(void *src, int start, int nitems, void *dest) nogil
+  ctypedef struct blosc_context:
+    pass
+  blosc_context *blosc_create_context(int nthreads)
+  int blosc_set_context_nthreads(blosc_context *ctx, int nthreads)
+  void blosc_free_context(blosc_context *ctx)
+  int blosc_compress_ctx(blosc_context *ctx, int clevel, int doshuffle,
+                         size_t typesize, size_t nbytes, void *src,
+                         void *dest, size_t destsize) nogil
+  int blosc_decompress_ctx(blosc_context *ctx, void *src, void *dest,
+                           size_t destsize) nogil
+  int blosc_getitem_ctx(blosc_context *ctx, void *src, int start,
+                        int nitems, void *dest) nogil
+  int blosc_splice(void *src, size_t offset, size_t nbytes, void *data,
+                   int clevel, void *dest, size_t destsize) nogil
+  int blosc_trial(int clevel, int doshuffle, size_t typesize, size_t nbytes,
+                  void *src, size_t *sbytes) nogil
   void blosc_free_resources()
   void blosc_cbuffer_sizes(void *cbuffer, size_t *nbytes,
                            size_t *cbytes, size_t *blocksize)
@@ -86,7 +137,10 @@ def _blosc_set_nthreads(nthreads):
       The previous setting for the number of threads.
 
   """
-  return blosc_set_nthreads(nthreads)
+  global ctx_nthreads
+  with blosc_lock:
+    ctx_nthreads = nthreads
+    return blosc_set_nthreads(nthreads)
 
 
 def blosc_version():
@@ -164,6 +218,14 @@ cdef int check_zeros(char *data, int nbytes):
   return iszero
 
 
+cdef int check_constant(char *data, int nbytes, int atomsize):
+  """Check whether all the atoms in [data, data+nbytes] are equal."""
+  if nbytes <= atomsize:
+    return 1
+  # Comparing data with itself shifted by one atom does the trick
+  return memcmp(data, data + atomsize, nbytes - atomsize) == 0
+
+
 cdef int true_count(char *data, int nbytes):
   """Count the number of true values in data (boolean)."""
   cdef int i, count
@@ -175,26 +237,545 @@ cdef int true_count(char *data, int nbytes):
   return count
 
 
+cdef object compute_stats(ndarray array):
+  """Return the (min, max, nancount) stats of `array` (its zone map).
+
+  NaNs are not taken into account for the min and max values, which are
+  None if there are only NaNs.  For non-numerical types, None is
+  returned.
+  """
+  cdef npy_intp nancount
+
+  if array.dtype.kind not in ('i', 'u', 'f') or array.size == 0:
+    return None
+  nancount = 0
+  minval = array.min()
+  if minval != minval:
+    # There are NaNs around; leave them out
+    isnan = np.isnan(array)
+    nancount = isnan.sum()
+    if nancount == array.size:
+      return (None, None, nancount)
+    array = array[~isnan]
+    minval = array.min()
+  maxval = array.max()
+  return (minval.item(), maxval.item(), nancount)
+
+
+cdef class context:
+  """
+  context(nthreads=1)
+
+  A Blosc context, i.e. the temporaries and threads used by the
+  re-entrant Blosc functions.
+
+  A context must only be used by one thread at a time.  Use
+  `get_context()` for getting the one of the calling thread.
+
+  Parameters
+  ----------
+  nthreads : int
+      The number of threads that Blosc can use with this context.
+
+  """
+
+  cdef blosc_context *ctx
+  cdef int _nthreads
+  # Whether this context keeps a single thread (see `pool`)
+  cdef int serial
+  # The buffer where data is compressed before being copied into its
+  # final place
+  cdef char *scratch
+  cdef size_t scratchsize
+
+  property nthreads:
+    "The number of threads that Blosc can use with this context."
+    def __get__(self):
+      return self._nthreads
+
+  def __cinit__(self, int nthreads=1):
+    self.ctx = blosc_create_context(nthreads)
+    if self.ctx == NULL:
+      raise MemoryError, "cannot allocate the Blosc context"
+    self._nthreads = nthreads
+
+
+  cdef set_nthreads(self, int nthreads):
+    """Set the number of threads of this context."""
+    blosc_set_context_nthreads(self.ctx, nthreads)
+    self._nthreads = nthreads
+
+
+  cdef char *get_scratch(self, size_t size) except NULL:
+    """Return the scratch buffer, making room for `size` bytes in it."""
+    cdef char *newscratch
+
+    if size > self.scratchsize:
+      newscratch = <char *>realloc(self.scratch, size)
+      if newscratch == NULL:
+        raise MemoryError, "cannot allocate the compression scratch buffer"
+      self.scratch = newscratch
+      self.scratchsize = size
+    return self.scratch
+
+
+  def __dealloc__(self):
+    blosc_free_context(self.ctx)
+    free(self.scratch)
+
+
+  def __repr__(self):
+    return "context(%d)" % self._nthreads
+
+
+# The Blosc contexts of the different threads, and the number of
+# threads they use (set via `_blosc_set_nthreads()`)
+contexts = threading.local()
+cdef int ctx_nthreads = 1
+
+cdef context get_context():
+  """Return the Blosc context of the calling thread."""
+  cdef context ctx
+
+  ctx = getattr(contexts, "ctx", None)
+  if ctx is None:
+    ctx = context(ctx_nthreads)
+    contexts.ctx = ctx
+  elif ctx._nthreads != ctx_nthreads and not ctx.serial:
+    ctx.set_nthreads(ctx_nthreads)
+  return ctx
+
+
+cdef class trial:
+  """
+  trial()
+
+  Track whether the chunks of a carray are worth compressing.
+
+  When a chunk compresses worse than `defaults.min_cratio`, the next
+  `TRIAL_SKIP` chunks are stored verbatim (memcpy'ed) straight away.
+  Then, a sample block of the next chunk is compressed first (see
+  `blosc_trial()`), and the chunk is only compressed if the sample does
+  better than `defaults.min_cratio`.  So incompressible data is stored
+  close to memcpy speed, and compressible data does not pay for trials.
+
+  When chunks are compressed in parallel, every one of them gets a copy
+  of the state at the start of the batch (see `copy()`), and the
+  outcome is merged back in after the batch (see `merge()`), so the
+  result does not depend on the scheduling of the threads.
+
+  This class is meant to be used only by the `chunk` class.
+
+  """
+
+  cdef int skip, suspect
+
+  cdef int worth(self, int clevel, int shuffle, size_t typesize,
+                 size_t nbytes, char *data) except -1:
+    """Return 1 if the `nbytes` of `data` are worth compressing, else 0."""
+    cdef int cbytes
+    cdef size_t sbytes
+
+    if nbytes < TRIAL_MINBYTES:
+      return 1
+    if self.skip > 0:
+      self.skip -= 1
+      return 0
+    if not self.suspect:
+      return 1
+    with blosc_lock:
+      with nogil:
+        cbytes = blosc_trial(clevel, shuffle, typesize, nbytes, data,
+                             &sbytes)
+    if cbytes > 0 and sbytes < ca.defaults.min_cratio * cbytes:
+      self.skip = TRIAL_SKIP
+      return 0
+    self.suspect = 0
+    return 1
+
+
+  cdef record(self, size_t nbytes, size_t cbytes):
+    """Record that a chunk with `nbytes` has been compressed to `cbytes`."""
+    if nbytes >= TRIAL_MINBYTES and nbytes < ca.defaults.min_cratio * cbytes:
+      self.suspect = 1
+      self.skip = TRIAL_SKIP
+
+
+  def copy(self):
+    """Return a copy of self."""
+    cdef trial other
+
+    other = trial()
+    other.skip = self.skip
+    other.suspect = self.suspect
+    return other
+
+
+  def merge(self, trials):
+    """Merge the `trials` copied from self for a batch of chunks."""
+    cdef trial other
+
+    if not trials:
+      return
+    if self.skip > 0:
+      # None of the chunks has been tried
+      self.skip = max(self.skip - len(trials), 0)
+      return
+    for other in trials:
+      if other.skip > 0:
+        # Some chunk was not worth compressing
+        self.skip = TRIAL_SKIP
+        self.suspect = 1
+        return
+    for other in trials:
+      if not other.suspect:
+        self.suspect = 0
+
+
+cdef class arena
+
+cdef class slab:
+  """
+  slab(owner, size, shared=True)
+
+  A memory block of `size` bytes where `owner` (an `arena`) carves the
+  compressed data of chunks out.  Chunks using it keep a reference to
+  it, so that it is released when all of them are gone.
+
+  The space released by chunks is kept in a list of free extents
+  (merging the adjacent ones) and handed out again.  As readers may
+  still be working on released data without the GIL (or through chunk
+  views), they pin the slab meanwhile, and the space released while
+  the slab is pinned is not reused until it is unpinned.  Slabs that
+  are not `shared` hold a single chunk, and its space is not reused.
+
+  """
+
+  cdef char *data
+  cdef readonly npy_intp size, used, live
+  cdef arena owner
+  cdef int shared
+  # The free extents ([offset, size] lists, sorted by offset) and the
+  # size of the largest one
+  cdef object extents
+  cdef npy_intp maxextent
+  # The number of pins and the extents released while pinned
+  cdef int pins
+  cdef object pending
+  # The size class where the owner keeps self (-1 if none)
+  cdef int sclass
+  cdef object __weakref__
+
+  def __cinit__(self, arena owner, npy_intp size, int shared=True):
+    self.data = <char *>malloc(size)
+    if self.data == NULL:
+      raise MemoryError, "cannot allocate a slab of %d bytes" % size
+    self.size = size
+    self.owner = owner
+    self.shared = shared
+    self.extents = []
+    self.pending = []
+    self.sclass = -1
+    owner.nslabs += 1
+    owner.nbytes += size
+    if shared:
+      owner.classify(self, size)
+
+
+  property room:
+    "The size of the largest allocation that fits in self."
+    def __get__(self):
+      if self.size - self.used > self.maxextent:
+        return self.size - self.used
+      return self.maxextent
+
+
+  cdef char *alloc(self, npy_intp size):
+    """Return a pointer to `size` bytes in self (there must be room)."""
+    cdef char *data
+    cdef npy_intp i, offset
+
+    # Keep the next pointer aligned to 8 bytes
+    size = (size + 7) & ~7
+    if self.maxextent >= size:
+      # Reuse released space (first fit)
+      for i from 0 <= i < len(self.extents):
+        extent = self.extents[i]
+        if extent[1] >= size:
+          break
+      offset = extent[0]
+      if extent[1] == size:
+        del self.extents[i]
+      else:
+        extent[0] += size
+        extent[1] -= size
+      self.live += size
+      self.owner.live += size
+      self.update_room()
+      return self.data + offset
+    data = self.data + self.used
+    if self.used + size > self.size:
+      size = self.size - self.used
+    self.used += size
+    self.live += size
+    self.owner.used += size
+    self.owner.live += size
+    if self.shared:
+      self.update_room()
+    return data
+
+
+  cdef release(self, char *data, npy_intp size):
+    """Release the `size` bytes at `data` obtained by `alloc()`."""
+    cdef npy_intp offset
+
+    offset = data - self.data
+    size = (size + 7) & ~7
+    if offset + size > self.size:
+      size = self.size - offset
+    if size > self.live:
+      size = self.live
+    self.live -= size
+    if self.owner is not None:
+      self.owner.live -= size
+    if not self.shared:
+      return
+    if self.pins > 0:
+      self.pending.append((offset, size))
+    else:
+      self.free_extent(offset, size)
+      self.update_room()
+
+
+  cdef free_extent(self, npy_intp offset, npy_intp size):
+    """Put the extent at `offset` with `size` bytes in the free list."""
+    cdef npy_intp i
+
+    i = bisect.bisect(self.extents, [offset, size])
+    # Merge with the previous and the next extents if adjacent
+    if i > 0 and self.extents[i-1][0] + self.extents[i-1][1] == offset:
+      i -= 1
+      offset = self.extents[i][0]
+      size += self.extents[i][1]
+      del self.extents[i]
+    if (i < len(self.extents) and offset + size == self.extents[i][0]):
+      size += self.extents[i][1]
+      del self.extents[i]
+    if offset + size == self.used:
+      # Give it back to the room at the end
+      self.used -= size
+      self.owner.used -= size
+    else:
+      self.extents.insert(i, [offset, size])
+
+
+  cdef update_room(self):
+    """Recompute the largest free extent and tell the owner."""
+    self.maxextent = 0
+    for extent in self.extents:
+      if extent[1] > self.maxextent:
+        self.maxextent = extent[1]
+    self.owner.classify(self, self.room)
+
+
+  cdef pin(self):
+    """Keep the released space from being reused until `unpin()`."""
+    self.pins += 1
+
+
+  cdef unpin(self):
+    """Undo a `pin()`, making the space released meanwhile reusable."""
+    self.pins -= 1
+    if self.pins == 0 and self.pending:
+      for offset, size in self.pending:
+        self.free_extent(offset, size)
+      self.pending = []
+      self.update_room()
+
+
+  def __dealloc__(self):
+    free(self.data)
+    if self.owner is not None:
+      self.owner.nslabs -= 1
+      self.owner.nbytes -= self.size
+      self.owner.used -= self.used
+      self.owner.live -= self.live
+      if self.sclass >= 0:
+        self.owner.classes[self.sclass].pop(id(self), None)
+
+
+cdef class arena:
+  """
+  arena(slabsize)
+
+  An allocator for the compressed data of chunks.
+
+  Chunk data is carved out of slabs of `slabsize` bytes, so there is no
+  need for an allocation per chunk and the heap is not fragmented by
+  millions of small blocks.  The space released by chunks is reused
+  for new ones: slabs are kept in size classes (powers of 2) after the
+  largest allocation that fits in them, and new data goes to the first
+  slab found with room for it.  Data larger than a quarter of
+  `slabsize` gets a slab of its own.  A slab is released as soon as all
+  the chunks using it are gone.
+
+  Besides the `nslabs`, `nbytes` (in slabs), `used` (handed out) and
+  `live` (used by existing chunks) counters, the `slack` (room at the
+  end of slabs) and `fragmentation` (room of deleted chunks not reused
+  yet) properties can be used to assess the overhead.
+
+  """
+
+  cdef readonly npy_intp slabsize, nslabs, nbytes, used, live
+  cdef slab current
+  # The slabs with room (weakly referenced by id), by size class
+  cdef object classes
+
+  property slack:
+    "The bytes not handed out yet in slabs."
+    def __get__(self):
+      return self.nbytes - self.used
+
+  property fragmentation:
+    "The bytes handed out in slabs that are not used anymore."
+    def __get__(self):
+      return self.used - self.live
+
+  def __cinit__(self, npy_intp slabsize=0):
+    self.classes = [{} for i in range(64)]
+    self.set_slabsize(slabsize)
+
+
+  def set_slabsize(self, npy_intp slabsize):
+    """Set the size of new slabs (0 means a slab per chunk)."""
+    if slabsize < 0:
+      raise ValueError, "`slabsize` cannot be negative"
+    self.slabsize = slabsize
+    self.current = None
+
+
+  cdef classify(self, slab slab_, npy_intp room):
+    """Put `slab_` in the size class for `room` free bytes."""
+    cdef int sclass
+
+    sclass = -1
+    while room > 0:
+      room >>= 1
+      sclass += 1
+    if sclass == slab_.sclass:
+      return
+    if slab_.sclass >= 0:
+      self.classes[slab_.sclass].pop(id(slab_), None)
+    if sclass >= 0:
+      self.classes[sclass][id(slab_)] = weakref.ref(slab_)
+    slab_.sclass = sclass
+
+
+  cdef slab get_slab(self, npy_intp size):
+    """Return a slab with room for `size` bytes."""
+    cdef int sclass
+    cdef npy_intp asize
+
+    if size > self.slabsize // 4:
+      return slab(self, size, False)
+    # Any slab in a class above the size of the data has room for it
+    asize = (size + 7) & ~7
+    sclass = 0
+    while (<npy_intp>1 << sclass) < asize:
+      sclass += 1
+    while sclass < len(self.classes):
+      slabs = self.classes[sclass]
+      while slabs:
+        key, ref = slabs.popitem()
+        slab_ = ref()
+        if slab_ is not None:
+          slabs[key] = ref
+          return slab_
+      sclass += 1
+    self.current = slab(self, self.slabsize)
+    return self.current
+
+
+  def __repr__(self):
+    return "arena(%s)  nslabs: %d; nbytes: %s; live: %s; slack: %s; " \
+           "fragmentation: %s" % \
+           (self.slabsize, self.nslabs, self.nbytes, self.live,
+            self.slack, self.fragmentation)
+
+
+# The allocator for the compressed data of chunks.  Its slab size is set
+# via `defaults.slab_size`.
+chunk_arena = arena(0)
+
+
+cdef int blosc_error(int ret, char *what) except -1:
+  """Raise the exception for the error `ret` of a Blosc `what`."""
+  if ret == BLOSC_ENOMEM:
+    raise MemoryError, "cannot allocate the Blosc temporaries"
+  raise RuntimeError, "fatal error during Blosc %s: %d" % (what, ret)
+
+
+cdef object compress_data(char *data, size_t nbytes, size_t typesize,
+                          int clevel, int shuffle):
+  """Compress `nbytes` of `data` and return the outcome as a string."""
+  cdef int cbytes
+  cdef char *dest
+  cdef context ctx = get_context()
+
+  dest = ctx.get_scratch(nbytes+BLOSC_MAX_OVERHEAD)
+  with nogil:
+    cbytes = blosc_compress_ctx(ctx.ctx, clevel, shuffle, typesize, nbytes,
+                                data, dest, nbytes+BLOSC_MAX_OVERHEAD)
+  if cbytes <= 0:
+    blosc_error(cbytes, "compression")
+  return PyString_FromStringAndSize(dest, cbytes)
+
+
 #-------------------------------------------------------------
 
 
 cdef class chunk:
   """
-  chunk(array, cparams)
+  chunk(array, atom, cparams, dflt=None, _compr=False, _stats=None, _trial=None)
 
   Compressed in-memory container for a data chunk.
 
+  If `dflt` is passed and most of the atoms in `array` are equal to it,
+  the chunk may be kept in sparse form, i.e. only the atoms different
+  from `dflt` are stored, together with their positions.  This is done
+  whenever it takes less space than compressing the data.  Note that
+  `getdata()` always returns a regular Blosc buffer.
+
+  If `_compr` is true, `array` must be an object exposing a read buffer
+  (e.g. a string) that holds a Blosc compressed buffer.  The buffer is
+  used as-is, without recompressing it.  As the stats of the data cannot
+  be computed without decompressing it, they can be passed in `_stats`.
+
+  If a `trial` instance is passed in `_trial`, it decides whether the
+  data is worth compressing; if not, it is stored verbatim.
+
+  If `array` is None, an empty shell is returned, which is meant to be
+  filled with data already compressed in the `chunk_arena` (see
+  `wrap_data()`).
+
   This class is meant to be used only by the `carray` class.
 
   """
 
   # To save space, keep these variables under a minimum
-  cdef char typekind, isconstant
+  cdef char typekind, isconstant, issparse
+  # Whether the data in the arena is owned by a chunk table
+  cdef char isview
   cdef int atomsize, itemsize, blocksize
   cdef int nbytes, cbytes
   cdef int true_count
   cdef char *data
-  cdef object atom, constant
+  cdef object atom, constant, dobject
+  # For sparse chunks: the positions and values of the atoms different
+  # from the default value (a string), plus the compression params
+  cdef object spidx, spvals, dflt, cparams
+  # The (min, max, nancount) zone map for numerical data (or None)
+  cdef readonly object stats
 
   property dtype:
     "The NumPy dtype for this chunk."
@@ -202,59 +783,127 @@ cdef class chunk:
       return self.atom
 
 
-  def __cinit__(self, ndarray array, object atom, object cparams):
-    cdef int itemsize, footprint
+  def __cinit__(self, object array, object atom, object cparams,
+                object dflt=None, object _compr=False, object _stats=None,
+                object _trial=None):
+    cdef int itemsize, footprint, ret, nthreads
     cdef size_t nbytes, cbytes, blocksize
     cdef int clevel, shuffle
     cdef dtype dtype_
+    cdef ndarray array_, tmparr
+    cdef slab slab_
+    cdef context ctx
     cdef char *dest
+    cdef void *vbuf
+    cdef Py_ssize_t buflen
 
     self.atom = atom
     self.atomsize = atom.itemsize
-    dtype_ = array.dtype
+    footprint = 128  # the (aprox) footprint of this instance in bytes
+
+    if array is None:
+      # An empty shell
+      self.typekind = atom.base.kind
+      self.itemsize = atom.base.itemsize
+      return
+
+    if _compr:
+      # The data is already compressed.  Just point to it and keep a
+      # reference to its container, so that it is not released.
+      if PyObject_AsReadBuffer(array, &vbuf, &buflen) < 0:
+        raise TypeError, "compressed data must support the buffer interface"
+      self.data = <char *>vbuf
+      self.dobject = array
+      self.typekind = atom.base.kind
+      self.itemsize = atom.base.itemsize
+      blosc_cbuffer_sizes(self.data, &nbytes, &cbytes, &blocksize)
+      if <Py_ssize_t>cbytes > buflen:
+        raise ValueError, "compressed data is truncated"
+      if self.typekind == 'b':
+        # The true count is not kept in Blosc buffers, so compute it
+        tmparr = np.empty(nbytes, dtype=np.bool_)
+        ctx = get_context()
+        with nogil:
+          ret = blosc_decompress_ctx(ctx.ctx, self.data, tmparr.data, nbytes)
+        if ret < 0:
+          blosc_error(ret, "decompression")
+        self.true_count = true_count(tmparr.data, nbytes)
+      if _stats is not None:
+        self.stats = tuple(_stats)
+      self.nbytes = nbytes
+      self.cbytes = cbytes + footprint
+      self.blocksize = blocksize
+      return
+
+    array_ = array
+    dtype_ = array_.dtype
     self.itemsize = itemsize = dtype_.elsize
     self.typekind = dtype_.kind
     # Compute the total number of bytes in this array
-    nbytes = itemsize * array.size
-    footprint = 128  # the (aprox) footprint of this instance in bytes
+    nbytes = itemsize * array_.size
 
     # Check whether incoming data is constant
-    if array.strides[0] == 0 or check_zeros(array.data, nbytes):
+    if (array_.strides[0] == 0 or
+        check_constant(array_.data, nbytes, self.atomsize)):
       self.isconstant = 1
-      self.constant = constant = array[0]
+      self.constant = constant = array_[0]
       # Add overhead (64 bytes for the overhead of the numpy container)
       footprint += 64 + constant.size * constant.itemsize
+      if self.typekind == 'b':
+        self.true_count = np.asarray(constant).sum() * len(array_)
+      stats = compute_stats(array_[:1])
+      if stats is not None:
+        self.stats = (stats[0], stats[1], stats[2] * len(array_))
+    else:
+      self.stats = compute_stats(array_)
     if self.isconstant:
       cbytes = 0
-      blocksize = 4*1024  # use 4 KB as a cache for blocks
-      # Make blocksize a multiple of itemsize
-      if blocksize % itemsize > 0:
-        blocksize = (blocksize // itemsize) * itemsize
-      # Correct in case we have a large itemsize
-      if blocksize == 0:
-        blocksize = itemsize
     else:
       if self.typekind == 'b':
-        self.true_count = true_count(array.data, nbytes)
-      # Data is not constant, compress it
-      dest = <char *>malloc(nbytes+BLOSC_MAX_OVERHEAD)
-      # Compress data
+        self.true_count = true_count(array_.data, nbytes)
+      # Data is not constant, compress it (in the scratch buffer)
       clevel = cparams.clevel
       shuffle = cparams.shuffle
+      if clevel > 0 and _trial is not None:
+        if not (<trial>_trial).worth(clevel, shuffle, itemsize, nbytes,
+                                     array_.data):
+          clevel = 0
+      ctx = get_context()
+      dest = ctx.get_scratch(nbytes+BLOSC_MAX_OVERHEAD)
+      if cparams.dedup:
+        # Blosc threads lay out the blocks in the order they are done,
+        # so equal data would not always give equal bytes to be matched
+        # (see `chunklist.share()`).  Compress serially then.
+        nthreads = blosc_set_context_nthreads(ctx.ctx, 1)
       with nogil:
-        cbytes = blosc_compress(clevel, shuffle, itemsize, nbytes, array.data,
-                                dest, nbytes+BLOSC_MAX_OVERHEAD)
+        cbytes = blosc_compress_ctx(ctx.ctx, clevel, shuffle, itemsize,
+                                    nbytes, array_.data, dest,
+                                    nbytes+BLOSC_MAX_OVERHEAD)
+      if cparams.dedup:
+        blosc_set_context_nthreads(ctx.ctx, nthreads)
       if cbytes <= 0:
-        raise RuntimeError, "fatal error during Blosc compression: %d" % cbytes
-      # Free the unused data
-      # self.data = <char *>realloc(dest, cbytes)
-      # I think the next is safer (and the speed is barely the same)
-      # Copy the compressed data on a new tailored buffer
-      self.data = <char *>malloc(cbytes)
-      memcpy(self.data, dest, cbytes)
-      free(dest)
+        blosc_error(cbytes, "compression")
+      self.store_data(dest, cbytes)
+      if clevel > 0 and _trial is not None:
+        (<trial>_trial).record(nbytes, cbytes)
       # Set size info for the instance
       blosc_cbuffer_sizes(self.data, &nbytes, &cbytes, &blocksize)
+      # Mostly default data can take less space in sparse form
+      if dflt is not None and self.make_sparse(array_, dflt, cbytes):
+        self.release_data()
+        self.cparams = cparams
+        cbytes = 0
+        # Add overhead (64 bytes for each numpy container)
+        footprint += 128 + self.spidx.nbytes + self.spvals.nbytes
+
+    if self.isconstant or self.issparse:
+      blocksize = 4*1024  # use 4 KB as a cache for blocks
+      # Make blocksize a multiple of itemsize
+      if blocksize % itemsize > 0:
+        blocksize = (blocksize // itemsize) * itemsize
+      # Correct in case we have a large itemsize
+      if blocksize == 0:
+        blocksize = itemsize
 
     # Fill instance data
     self.nbytes = nbytes
@@ -262,10 +911,54 @@ cdef class chunk:
     self.blocksize = blocksize
 
 
+  cdef store_data(self, char *data, size_t cbytes):
+    """Copy the compressed `data` on its final place in the arena."""
+    cdef slab slab_
+
+    slab_ = chunk_arena.get_slab(cbytes)
+    self.data = slab_.alloc(cbytes)
+    self.dobject = slab_
+    memcpy(self.data, data, cbytes)
+
+
+  cdef int make_sparse(self, ndarray array, object dflt, size_t cbytes):
+    """Turn self into a sparse chunk if this takes less than `cbytes`.
+
+    Atoms are compared with `dflt` bitwise.  Return 1 if the chunk has
+    become sparse, else 0.
+    """
+    cdef npy_intp natoms
+
+    # Each exception costs its position (int32) and its value
+    if cbytes <= 4 + self.atomsize:
+      return 0
+    dflt = np.asarray(dflt, dtype=self.atom.base).tostring()
+    if len(dflt) != self.atomsize:
+      return 0
+    natoms = len(array)
+    if self.atomsize in (1, 2, 4, 8):
+      vtype = np.dtype('u%d' % self.atomsize)
+      atoms = np.ndarray(shape=(natoms,), dtype=vtype, buffer=array)
+      mask = atoms != np.fromstring(dflt, dtype=vtype)[0]
+    else:
+      atoms = np.ndarray(shape=(natoms, self.atomsize), dtype=np.uint8,
+                         buffer=array)
+      mask = (atoms != np.fromstring(dflt, dtype=np.uint8)).any(axis=1)
+    spidx = mask.nonzero()[0]
+    if len(spidx) * (4 + self.atomsize) >= cbytes:
+      return 0
+    self.spidx = spidx.astype(np.int32)
+    self.spvals = array[spidx]
+    self.dflt = dflt
+    self.issparse = 1
+    return 1
+
+
   cdef void _getitem(self, int start, int stop, char *dest):
     """Read data from `start` to `stop` and return it as a numpy array."""
     cdef int ret, bsize, blen
-    cdef ndarray constants
+    cdef context ctx
+    cdef ndarray constants, values
 
     blen = stop - start
     bsize = blen * self.atomsize
@@ -277,14 +970,77 @@ cdef class chunk:
       memcpy(dest, constants.data, bsize)
       return
 
+    if self.issparse:
+      # Fill with defaults and then put the exceptions in place.  Only
+      # the exceptions in the range are visited.
+      values = np.ndarray(shape=(blen,), dtype=self.dtype,
+                          buffer=self.dflt, strides=(0,)).copy()
+      lo, hi = self.spidx.searchsorted([start, stop])
+      values[self.spidx[lo:hi] - start] = self.spvals[lo:hi]
+      memcpy(dest, values.data, bsize)
+      return
+
     # Fill dest with uncompressed data
+    ctx = get_context()
     with nogil:
       if bsize == self.nbytes:
-        ret = blosc_decompress(self.data, dest, bsize)
+        ret = blosc_decompress_ctx(ctx.ctx, self.data, dest, bsize)
       else:
-        ret = blosc_getitem(self.data, start, blen, dest)
+        ret = blosc_getitem_ctx(ctx.ctx, self.data, start, blen, dest)
     if ret < 0:
-      raise RuntimeError, "fatal error during Blosc decompression: %d" % ret
+      blosc_error(ret, "decompression")
+
+
+  cdef object splice(self, int start, ndarray values, object cparams):
+    """Return a new chunk with `values` put from the `start` atom on.
+
+    Only the Blosc blocks overlapping `values` are decompressed and
+    compressed again.  If this is not possible (constant, sparse or
+    boolean chunks, or new data not compressing well), None is returned
+    and the chunk has to be built from scratch.
+
+    The zone map of the new chunk is widened so as to cover `values`,
+    but it is never shrunk, as this would require the whole chunk.
+    """
+    cdef int ret, offset, nbytes, destsize, clevel
+    cdef char *dest
+    cdef char *data
+    cdef slab slab_
+
+    if self.isconstant or self.issparse or self.typekind == 'b':
+      return None
+    clevel = cparams.clevel
+    values = np.ascontiguousarray(values, dtype=self.atom.base)
+    offset = start * self.atomsize
+    nbytes = values.size * self.itemsize
+    if offset + nbytes > self.nbytes:
+      raise IndexError, "values do not fit in chunk"
+    destsize = self.nbytes + BLOSC_MAX_OVERHEAD
+    dest = get_context().get_scratch(destsize)
+    with blosc_lock:
+      with nogil:
+        ret = blosc_splice(self.data, offset, nbytes, values.data,
+                           clevel, dest, destsize)
+      if ret > 0:
+        slab_ = chunk_arena.get_slab(ret)
+        data = slab_.alloc(ret)
+        memcpy(data, dest, ret)
+    if ret <= 0:
+      if ret < 0:
+        raise RuntimeError, "fatal error during Blosc splicing: %d" % ret
+      return None
+
+    stats = self.stats
+    if stats is not None:
+      vstats = compute_stats(values)
+      minval, maxval = stats[0], stats[1]
+      if vstats[0] is not None:
+        if minval is None or vstats[0] < minval:
+          minval = vstats[0]
+        if maxval is None or vstats[1] > maxval:
+          maxval = vstats[1]
+      stats = (minval, maxval, stats[2] + vstats[2])
+    return wrap_data(data, slab_, self.atom, cparams, stats, 0)
 
 
   def __getitem__(self, object key):
@@ -346,213 +1102,1974 @@ cdef class chunk:
     return fullrepr
 
 
+  def getdata(self):
+    """
+    getdata()
+
+    Return the Blosc compressed buffer of this chunk as a string.
+
+    For constant chunks, the buffer only keeps one atom of data.
+
+    """
+    cdef size_t nbytes, cbytes, blocksize
+    cdef ndarray constant, dense
+
+    if self.isconstant:
+      constant = np.array(self.constant, dtype=self.atom.base)
+      return compress_data(constant.data, self.atomsize, self.itemsize, 0, 0)
+    if self.issparse:
+      dense = self[:]
+      return compress_data(dense.data, self.nbytes, self.itemsize,
+                           self.cparams.clevel, self.cparams.shuffle)
+    blosc_cbuffer_sizes(self.data, &nbytes, &cbytes, &blocksize)
+    return PyString_FromStringAndSize(self.data, cbytes)
+
+
+  cdef release_data(self):
+    """Release the compressed data buffer of self."""
+    cdef size_t nbytes, cbytes, blocksize
+
+    if self.dobject is None:
+      # The data buffer is ours
+      free(self.data)
+    elif isinstance(self.dobject, slab):
+      if self.isview:
+        (<slab>self.dobject).unpin()
+      else:
+        # The data buffer comes from the arena
+        blosc_cbuffer_sizes(self.data, &nbytes, &cbytes, &blocksize)
+        (<slab>self.dobject).release(self.data, cbytes)
+    self.data = NULL
+    self.dobject = None
+
+
+  cdef set_view(self, char isview):
+    """Make self a view of data owned by a chunk table (or not)."""
+    if isview == self.isview:
+      return
+    # Views pin their slab, so that their data is not reused
+    if isinstance(self.dobject, slab):
+      if isview:
+        (<slab>self.dobject).pin()
+      else:
+        (<slab>self.dobject).unpin()
+    self.isview = isview
+
+
   def __dealloc__(self):
     """Release C resources before destruction."""
-    free(self.data)
+    self.release_data()
 
 
+cdef chunk decode_chunk(object data, object atom, object cparams,
+                        npy_intp nbytes, object stats=None):
+  """Build a chunk with `nbytes` out of `data` (see `chunk.getdata()`).
 
-cdef class carray:
+  `stats` is the zone map of the chunk, if known.
   """
-  carray(array, cparams=None, dtype=None, dflt=None, expectedlen=None, chunklen=None)
+  cdef size_t nbytes_, cbytes, blocksize
+  cdef int ret
+  cdef context ctx
+  cdef void *vbuf
+  cdef Py_ssize_t buflen
+  cdef ndarray constant
+
+  if PyObject_AsReadBuffer(data, &vbuf, &buflen) < 0:
+    raise TypeError, "compressed data must support the buffer interface"
+  blosc_cbuffer_sizes(vbuf, &nbytes_, &cbytes, &blocksize)
+  if <npy_intp>nbytes_ != nbytes and <npy_intp>nbytes_ == atom.itemsize:
+    # A constant chunk.  Only one atom has been stored.
+    constant = np.empty(1, dtype=atom)
+    ctx = get_context()
+    with nogil:
+      ret = blosc_decompress_ctx(ctx.ctx, vbuf, constant.data, nbytes_)
+    if ret < 0:
+      blosc_error(ret, "decompression")
+    array = np.ndarray(nbytes // atom.itemsize, dtype=atom,
+                       buffer=constant, strides=(0,))
+    return chunk(array, atom, cparams)
+  return chunk(data, atom, cparams, _compr=True, _stats=stats)
 
-  A compressed and enlargeable in-memory data container.
 
-  `carray` exposes a series of methods for dealing with the compressed
-  container in a NumPy-like way.
+cdef unsigned int hash_data(char *data, size_t nbytes) nogil:
+  """Return the (32-bit FNV-1a) hash of `nbytes` of `data`."""
+  cdef unsigned int h
+  cdef size_t i
 
-  Parameters
-  ----------
-  array : a NumPy-like object
-      This is taken as the input to create the carray.  It can be any Python
-      object that can be converted into a NumPy object.  The data type of
-      the resulting carray will be the same as this NumPy object.
-  cparams : instance of the `cparams` class, optional
-      Parameters to the internal Blosc compressor.
-  dtype : NumPy dtype
-      Force this `dtype` for the carray (rather than the `array` one).
-  dflt : Python or NumPy scalar
-      The value to be used when enlarging the carray.  If None, the default is
-      filling with zeros.
-  expectedlen : int, optional
-      A guess on the expected length of this object.  This will serve to
-      decide the best `chunklen` used for compression and memory I/O
-      purposes.
-  chunklen : int, optional
-      The number of rows that fits into a chunk.  By specifying it you can
-      explicitely set the chunk size used for compression and memory I/O.
-      Only use it if you know what are you doing.
+  h = 2166136261U
+  for i from 0 <= i < nbytes:
+    h = (h ^ <unsigned char>data[i]) * 16777619U
+  return h
 
+
+cdef chunk wrap_data(char *data, slab slab_, object atom, object cparams,
+                     object stats, int true_count):
+  """Build a chunk out of the compressed `data` allocated in `slab_`.
+
+  The new chunk takes charge of releasing `data`.
   """
+  cdef chunk chunk_
+  cdef size_t nbytes, cbytes, blocksize
+
+  chunk_ = chunk(None, atom, cparams)
+  blosc_cbuffer_sizes(data, &nbytes, &cbytes, &blocksize)
+  chunk_.data = data
+  chunk_.dobject = slab_
+  chunk_.nbytes = nbytes
+  chunk_.cbytes = cbytes + 128
+  chunk_.blocksize = blocksize
+  chunk_.true_count = true_count
+  chunk_.stats = stats
+  return chunk_
+
+
+cdef class chunklist(object):
+  """
+  chunklist(atom, cparams, chunksize)
 
-  cdef int itemsize, atomsize, _chunksize, _chunklen, leftover
-  cdef int nrowsinbuf, _row
-  cdef int sss_mode, wheretrue_mode, where_mode
-  cdef npy_intp startb, stopb
-  cdef npy_intp start, stop, step, nextelement
-  cdef npy_intp _nrow, nrowsread
-  cdef npy_intp _nbytes, _cbytes
-  cdef npy_intp nhits, limit, skip
-  cdef char *lastchunk
-  cdef object lastchunkarr, where_arr, arr1
-  cdef object _cparams, _dflt
-  cdef object _dtype, chunks
-  cdef ndarray iobuf, where_buf
-  # For block cache
-  cdef int blocksize, idxcache
-  cdef ndarray blockcache
-  cdef char *datacache
+  The table of chunks of in-memory carrays.
+
+  Regular chunks are not kept as `chunk` objects, but as entries in
+  contiguous C arrays (data pointer, slab, sizes and true count), with
+  their data in the `chunk_arena`.  `chunk` objects pointing to these
+  entries are only built on demand (e.g. in `__getitem__()`).  Constant
+  and sparse chunks are kept as objects.  Zone maps are kept in the
+  `stats` list, like in the `chunks` class.
+
+  If `cparams.dedup` is true, entries with the same compressed data
+  (compared byte by byte after matching their hashes) share a single
+  copy of it, which is released when the last entry using it is gone.
+  Only the first entry accounts for the size of the shared data.
+
+  The time of the last access, the number of accesses and the
+  compression level of every entry are kept as well, so that cold
+  entries can be compressed again (see `carray.tier()`).
+
+  This class is meant to be used only by the `carray` class.
+
+  """
+
+  cdef npy_intp nchunks, allocated
+  cdef int chunksize, atomsize
+  cdef object atom, cparams
+  cdef char **data
+  # The slab of each entry (or the chunk object itself, see `isobject`)
+  cdef void **owners
+  cdef int *cbytes
+  cdef int *blocksize
+  cdef int *true_count
+  cdef char *isobject
+  # Access stats and compression level of every entry
+  cdef time_t *stamps
+  cdef unsigned int *hits
+  cdef char *clevels
+  cdef public object stats
+  # For deduplication: address -> [refcount, hash, slab] for shared
+  # data, and hash -> list of addresses
+  cdef int dedup
+  cdef object shared, hashes
+
+  def __cinit__(self, object atom, object cparams, int chunksize):
+    self.atom = atom
+    self.cparams = cparams
+    self.chunksize = chunksize
+    self.atomsize = atom.itemsize
+    self.nchunks = self.allocated = 0
+    self.data = NULL
+    self.owners = NULL
+    self.cbytes = self.blocksize = self.true_count = NULL
+    self.isobject = NULL
+    self.stamps = NULL
+    self.hits = NULL
+    self.clevels = NULL
+    self.stats = []
+    self.dedup = cparams.dedup
+    self.shared = {}
+    self.hashes = {}
+
+
+  cdef set_cparams(self, object cparams):
+    """Use `cparams` for the entries set from now on."""
+    self.cparams = cparams
+    self.dedup = cparams.dedup
+
+
+  cdef grow(self):
+    """Make room for more entries in the table."""
+    cdef npy_intp allocated
+
+    allocated = self.allocated * 2
+    if allocated < 16:
+      allocated = 16
+    self.data = <char **>self.resize(self.data, allocated*sizeof(char *))
+    self.owners = <void **>self.resize(self.owners, allocated*sizeof(void *))
+    self.cbytes = <int *>self.resize(self.cbytes, allocated*sizeof(int))
+    self.blocksize = <int *>self.resize(self.blocksize, allocated*sizeof(int))
+    self.true_count = <int *>self.resize(self.true_count,
+                                         allocated*sizeof(int))
+    self.isobject = <char *>self.resize(self.isobject, allocated)
+    self.stamps = <time_t *>self.resize(self.stamps,
+                                        allocated*sizeof(time_t))
+    self.hits = <unsigned int *>self.resize(self.hits,
+                                            allocated*sizeof(unsigned int))
+    self.clevels = <char *>self.resize(self.clevels, allocated)
+    self.allocated = allocated
+
+
+  cdef void *resize(self, void *ptr, size_t size) except NULL:
+    ptr = realloc(ptr, size)
+    if ptr == NULL:
+      raise MemoryError, "cannot grow the chunk table"
+    return ptr
+
+
+  cdef set_entry(self, npy_intp nchunk, chunk chunk_):
+    """Put `chunk_` in the (empty) entry `nchunk`."""
+    cdef size_t nbytes, cbytes, blocksize
+    cdef slab slab_
+
+    self.stamps[nchunk] = time(NULL)
+    self.hits[nchunk] = 0
+    self.clevels[nchunk] = self.cparams.clevel
+    if chunk_.isconstant or chunk_.issparse or chunk_.data == NULL:
+      owner = chunk_
+      self.isobject[nchunk] = 1
+      Py_INCREF(owner)
+      self.owners[nchunk] = <void *>owner
+      return
+    blosc_cbuffer_sizes(chunk_.data, &nbytes, &cbytes, &blocksize)
+    if self.dedup:
+      key = hash_data(chunk_.data, cbytes)
+      if self.share(nchunk, chunk_, key, cbytes):
+        return
+    if isinstance(chunk_.dobject, slab) and not chunk_.isview:
+      # Take charge of the data in the arena.  The chunk becomes a view.
+      slab_ = chunk_.dobject
+      self.data[nchunk] = chunk_.data
+      chunk_.set_view(1)
+    else:
+      # The data lives somewhere else (e.g. it comes from `load()`), so
+      # put a copy of it in the arena
+      slab_ = chunk_arena.get_slab(cbytes)
+      self.data[nchunk] = slab_.alloc(cbytes)
+      memcpy(self.data[nchunk], chunk_.data, cbytes)
+    self.cbytes[nchunk] = chunk_.cbytes
+    self.blocksize[nchunk] = chunk_.blocksize
+    self.true_count[nchunk] = chunk_.true_count
+    self.isobject[nchunk] = 0
+    Py_INCREF(slab_)
+    self.owners[nchunk] = <void *>slab_
+    if self.dedup:
+      # Make the data available for next entries
+      addr = <npy_intp>self.data[nchunk]
+      self.shared[addr] = [1, key, slab_]
+      self.hashes.setdefault(key, []).append(addr)
+
+
+  cdef int share(self, npy_intp nchunk, chunk chunk_, object key,
+                 size_t cbytes):
+    """Make entry `nchunk` share the data of an entry equal to `chunk_`.
+
+    `key` is the hash of the `cbytes` of compressed data in `chunk_`.
+    Return 1 if such an entry has been found, else 0.
+    """
+    cdef size_t nbytes2, cbytes2, blocksize2
+    cdef char *data
+
+    for addr in self.hashes.get(key, ()):
+      data = <char *><npy_intp>addr
+      blosc_cbuffer_sizes(data, &nbytes2, &cbytes2, &blocksize2)
+      if cbytes2 != cbytes or memcmp(data, chunk_.data, cbytes) != 0:
+        continue
+      entry = self.shared[addr]
+      entry[0] += 1
+      slab_ = entry[2]
+      self.data[nchunk] = data
+      # The data is shared, so only the footprint of the entry counts
+      chunk_.cbytes = chunk_.cbytes - cbytes
+      self.cbytes[nchunk] = chunk_.cbytes
+      self.blocksize[nchunk] = blocksize2
+      self.true_count[nchunk] = chunk_.true_count
+      self.isobject[nchunk] = 0
+      Py_INCREF(slab_)
+      self.owners[nchunk] = <void *>slab_
+      return 1
+    return 0
+
+
+  cdef int unshare(self, npy_intp nchunk):
+    """Drop the reference of entry `nchunk` to its (maybe shared) data.
+
+    Return 1 if the entry was the last one using the data, else 0.
+    """
+    addr = <npy_intp>self.data[nchunk]
+    # Entries set before disabling `dedup` may still share data
+    entry = self.shared.get(addr)
+    if entry is None:
+      return 1
+    entry[0] -= 1
+    if entry[0] > 0:
+      return 0
+    del self.shared[addr]
+    addrs = self.hashes[entry[1]]
+    addrs.remove(addr)
+    if not addrs:
+      del self.hashes[entry[1]]
+    return 1
+
+
+  cdef clear_entry(self, npy_intp nchunk, int release):
+    """Empty the entry `nchunk`, releasing its data if `release`."""
+    cdef size_t nbytes, cbytes, blocksize
+
+    owner = <object>self.owners[nchunk]
+    if release and not self.isobject[nchunk] and self.unshare(nchunk):
+      blosc_cbuffer_sizes(self.data[nchunk], &nbytes, &cbytes, &blocksize)
+      (<slab>owner).release(self.data[nchunk], cbytes)
+    Py_DECREF(owner)
+    self.owners[nchunk] = NULL
+
+
+  cdef chunk get_chunk(self, npy_intp nchunk):
+    """Return entry `nchunk` as a chunk object."""
+    cdef chunk chunk_
+
+    owner = <object>self.owners[nchunk]
+    if self.isobject[nchunk]:
+      return owner
+    chunk_ = wrap_data(self.data[nchunk], owner, self.atom, self.cparams,
+                       self.stats[nchunk], self.true_count[nchunk])
+    chunk_.cbytes = self.cbytes[nchunk]
+    chunk_.set_view(1)
+    return chunk_
+
+
+  cdef inline touch(self, npy_intp nchunk):
+    """Record an access to entry `nchunk`."""
+    self.stamps[nchunk] = time(NULL)
+    self.hits[nchunk] += 1
+
+
+  cdef int replace(self, npy_intp nchunk, char *data, chunk chunk_,
+                   int clevel) except -1:
+    """Put `chunk_` (compressed with `clevel`) in entry `nchunk`.
+
+    This is only done if the data of the entry is still at `data`, i.e.
+    the entry has not been modified since it was read.  The access stats
+    of the entry are kept.  Return 1 if the entry was replaced, else 0.
+    """
+    cdef time_t stamp
+    cdef unsigned int hits
+
+    if (nchunk >= self.nchunks or self.isobject[nchunk] or
+        self.data[nchunk] != data):
+      return 0
+    stamp = self.stamps[nchunk]
+    hits = self.hits[nchunk]
+    self.clear_entry(nchunk, 1)
+    self.set_entry(nchunk, chunk_)
+    self.stats[nchunk] = chunk_.stats
+    self.stamps[nchunk] = stamp
+    self.hits[nchunk] = hits
+    self.clevels[nchunk] = clevel
+    return 1
+
+
+  cdef int _getitem(self, npy_intp nchunk, int start, int stop,
+                    char *dest) except -1:
+    """Decompress the atoms in [start, stop) of `nchunk` into `dest`."""
+    cdef int ret, blen, bsize
+    cdef context ctx
+    cdef char *data
+
+    self.touch(nchunk)
+    # Keep the owner alive (and its released space unused) while
+    # decompressing, as the entry may be replaced from another thread
+    # (see `carray.tier()`)
+    owner = <object>self.owners[nchunk]
+    if self.isobject[nchunk]:
+      (<chunk>owner)._getitem(start, stop, dest)
+      return 0
+    data = self.data[nchunk]
+    blen = stop - start
+    bsize = blen * self.atomsize
+    ctx = get_context()
+    (<slab>owner).pin()
+    try:
+      with nogil:
+        if bsize == self.chunksize:
+          ret = blosc_decompress_ctx(ctx.ctx, data, dest, bsize)
+        else:
+          ret = blosc_getitem_ctx(ctx.ctx, data, start, blen, dest)
+    finally:
+      (<slab>owner).unpin()
+    if ret < 0:
+      blosc_error(ret, "decompression")
+    return 0
+
+
+  def __len__(self):
+    return self.nchunks
+
+
+  def __getitem__(self, object nchunk):
+    if nchunk < 0:
+      nchunk += self.nchunks
+    if nchunk < 0 or nchunk >= self.nchunks:
+      raise IndexError, "index out of range"
+    self.touch(nchunk)
+    return self.get_chunk(nchunk)
+
+
+  def __setitem__(self, object nchunk, chunk chunk_):
+    if nchunk < 0:
+      nchunk += self.nchunks
+    if nchunk < 0 or nchunk >= self.nchunks:
+      raise IndexError, "index out of range"
+    self.clear_entry(nchunk, 1)
+    self.set_entry(nchunk, chunk_)
+    self.stats[nchunk] = chunk_.stats
+
+
+  def append(self, chunk chunk_):
+    """Append `chunk_` to the end of the chunk list."""
+    if self.nchunks == self.allocated:
+      self.grow()
+    self.set_entry(self.nchunks, chunk_)
+    self.stats.append(chunk_.stats)
+    self.nchunks += 1
+
+
+  def pop(self):
+    """Remove the last chunk and return it."""
+    cdef chunk chunk_
+
+    if self.nchunks == 0:
+      raise IndexError, "pop from empty chunk list"
+    self.nchunks -= 1
+    chunk_ = self.get_chunk(self.nchunks)
+    if not self.isobject[self.nchunks] and self.unshare(self.nchunks):
+      # The returned chunk takes charge of the data again
+      chunk_.set_view(0)
+    self.clear_entry(self.nchunks, 0)
+    self.stats.pop()
+    return chunk_
+
+
+  def __dealloc__(self):
+    cdef npy_intp nchunk
+
+    for nchunk from 0 <= nchunk < self.nchunks:
+      self.clear_entry(nchunk, 1)
+    free(self.data)
+    free(self.owners)
+    free(self.cbytes)
+    free(self.blocksize)
+    free(self.true_count)
+    free(self.isobject)
+    free(self.stamps)
+    free(self.hits)
+    free(self.clevels)
+
+
+cdef class chunks(object):
+  """
+  chunks(rootdir, atom, cparams, chunklen, nchunks=0, mode='a')
+
+  Store the different carray chunks in a directory on-disk.
+
+  Every chunk lives in its own file, which holds its Blosc compressed
+  buffer verbatim.  Chunks are only read from disk when accessed.
+
+  This class is meant to be used only by the `carray` class.
+
+  """
+
+  cdef object _rootdir, _mode
+  cdef object atom, cparams
+  cdef npy_intp chunksize, nchunks, nchunk_cached
+  cdef object chunk_cached
+  # The zone maps of the chunks (so as to not read them for getting these)
+  cdef public object stats
+  # Whether the zone maps in the metadata on disk are up to date
+  cdef public int stats_saved
+
+  property datadir:
+    "The directory where the chunk files are stored."
+    def __get__(self):
+      return os.path.join(self._rootdir, DATA_DIR)
+
+  def __cinit__(self, object rootdir, object atom, object cparams,
+                npy_intp chunklen, npy_intp nchunks=0, object mode='a'):
+    self._rootdir = rootdir
+    self._mode = mode
+    self.atom = atom
+    self.cparams = cparams
+    self.chunksize = chunklen * atom.itemsize
+    self.nchunks = nchunks
+    # Keep the last accessed chunk at hand.  This avoids re-reading it
+    # for consecutive accesses to the same chunk.
+    self.nchunk_cached = -1
+    self.chunk_cached = None
+    self.stats = [None] * nchunks
+    self.stats_saved = True
+
+
+  def chunkpath(self, npy_intp nchunk):
+    """Return the path for the file of chunk `nchunk`."""
+    return os.path.join(self.datadir, "__%d.blosc" % nchunk)
+
+
+  def read_chunk(self, npy_intp nchunk, npy_intp nbytes=-1):
+    """Read chunk `nchunk` (having `nbytes`) from disk."""
+    if nbytes < 0:
+      nbytes = self.chunksize
+    with open(self.chunkpath(nchunk), 'rb') as f:
+      data = f.read()
+    stats = None
+    if nchunk < self.nchunks:
+      stats = self.stats[nchunk]
+    return decode_chunk(data, self.atom, self.cparams, nbytes, stats)
+
+
+  cdef invalidate_stats(self):
+    """Remove the zone maps from the metadata on disk.
+
+    Zone maps are only saved on `carray.flush()`, so they would be stale
+    after the first modification of chunks following it.  This is done
+    before the modification, so chunks without zone maps (which are
+    always visited) are found after a reopen until the next flush.
+    """
+    if self._mode == 'r':
+      raise IOError, "cannot modify data in read-only mode"
+    if not self.stats_saved:
+      return
+    metapath = os.path.join(self._rootdir, META_FILE)
+    if os.path.exists(metapath):
+      with open(metapath, 'rb') as f:
+        meta = json.loads(f.read())
+      if meta.pop('stats', None) is not None:
+        with open(metapath + ".tmp", 'wb') as f:
+          f.write(json.dumps(meta))
+        os.rename(metapath + ".tmp", metapath)
+    self.stats_saved = False
+
+
+  def write_chunk(self, npy_intp nchunk, chunk chunk_):
+    """Write `chunk_` as chunk `nchunk` on disk."""
+    if self._mode == 'r':
+      raise IOError, "cannot modify data in read-only mode"
+    with open(self.chunkpath(nchunk), 'wb') as f:
+      f.write(chunk_.getdata())
+
+
+  def __len__(self):
+    return self.nchunks
+
+
+  def __getitem__(self, object nchunk):
+    if nchunk < 0:
+      nchunk += self.nchunks
+    if nchunk < 0 or nchunk >= self.nchunks:
+      raise IndexError, "index out of range"
+    if nchunk != self.nchunk_cached:
+      self.chunk_cached = self.read_chunk(nchunk)
+      self.nchunk_cached = nchunk
+    return self.chunk_cached
+
+
+  def __setitem__(self, object nchunk, chunk chunk_):
+    if nchunk < 0:
+      nchunk += self.nchunks
+    if nchunk < 0 or nchunk >= self.nchunks:
+      raise IndexError, "index out of range"
+    self.invalidate_stats()
+    self.write_chunk(nchunk, chunk_)
+    self.stats[nchunk] = chunk_.stats
+    self.chunk_cached = chunk_
+    self.nchunk_cached = nchunk
+
+
+  def append(self, chunk chunk_):
+    """Append `chunk_` to the end of the chunk list."""
+    self.invalidate_stats()
+    self.write_chunk(self.nchunks, chunk_)
+    self.stats.append(chunk_.stats)
+    self.nchunks += 1
+
+
+  def pop(self):
+    """Remove the last chunk and return it."""
+    if self._mode == 'r':
+      raise IOError, "cannot modify data in read-only mode"
+    chunk_ = self[-1]
+    self.invalidate_stats()
+    self.nchunks -= 1
+    self.stats.pop()
+    os.remove(self.chunkpath(self.nchunks))
+    if self.nchunk_cached == self.nchunks:
+      self.nchunk_cached = -1
+      self.chunk_cached = None
+    return chunk_
+
+
+def write_pack_index(object fileobj, object meta, npy_intp offset):
+  """
+  write_pack_index(fileobj, meta, offset)
+
+  Write the `meta` index of a pack into `fileobj` and close the pack.
+
+  `offset` is the position of the index relative to the start of the
+  pack.  Return the number of bytes written.
+
+  """
+  index = json.dumps(meta)
+  fileobj.write(index)
+  fileobj.write(struct.pack(PACK_TRAILER, offset))
+  fileobj.write(PACK_MAGIC)
+  return len(index) + struct.calcsize(PACK_TRAILER) + len(PACK_MAGIC)
+
+
+def read_pack_meta(object fileobj, npy_intp start, npy_intp end):
+  """
+  read_pack_meta(fileobj, start, end)
+
+  Return the metadata of the pack stored in `fileobj` between the
+  `start` and `end` positions.
+
+  """
+  cdef npy_intp trailer, index
+
+  trailer = struct.calcsize(PACK_TRAILER) + len(PACK_MAGIC)
+  if end - start < len(PACK_MAGIC) + trailer:
+    raise IOError, "data is not in carray pack format"
+  fileobj.seek(start)
+  magic = fileobj.read(len(PACK_MAGIC))
+  fileobj.seek(end - trailer)
+  tail = fileobj.read(trailer)
+  if magic != PACK_MAGIC or tail[-len(PACK_MAGIC):] != PACK_MAGIC:
+    raise IOError, "data is not in carray pack format"
+  index = struct.unpack(PACK_TRAILER, tail[:-len(PACK_MAGIC)])[0]
+  fileobj.seek(start + index)
+  return json.loads(fileobj.read(end - trailer - start - index))
+
+
+def read_stats(object meta, npy_intp nchunks):
+  """
+  read_stats(meta, nchunks)
+
+  Return the list of zone maps for the `nchunks` chunks in `meta`.
+
+  Metadata coming from older versions does not have them, so they are
+  unknown (None) in this case.
+
+  """
+  stats = meta.get('stats')
+  if stats is None or len(stats) != nchunks:
+    return [None] * nchunks
+  return [s if s is None else tuple(s) for s in stats]
+
+
+def load_carray(object fileobj, npy_intp start, object meta):
+  """
+  load_carray(fileobj, start, meta)
+
+  Load the carray saved (see `carray.save()`) at position `start` of
+  `fileobj`.  `meta` is the metadata of the pack.
+
+  Chunks are not recompressed, but kept as they come in `fileobj`.
+
+  """
+  cdef carray obj
+  cdef chunk chunk_
+  cdef npy_intp nchunk, nchunks
+
+  obj = carray([], dtype=utils.decode_dtype(meta['dtype']),
+               chunklen=meta['chunklen'])
+  obj.set_meta(meta)
+  atom, cparams = obj._dtype, obj._cparams
+  offsets, sizes = meta['offsets'], meta['sizes']
+  nchunks = obj._nbytes // <npy_intp>obj._chunksize
+  stats = read_stats(meta, nchunks)
+  for nchunk from 0 <= nchunk < nchunks:
+    fileobj.seek(start + offsets[nchunk])
+    data = fileobj.read(sizes[nchunk])
+    obj.chunks.append(decode_chunk(data, atom, cparams, obj._chunksize,
+                                   stats[nchunk]))
+  if obj.leftover:
+    fileobj.seek(start + offsets[nchunks])
+    data = fileobj.read(sizes[nchunks])
+    chunk_ = decode_chunk(data, atom, cparams, obj.leftover)
+    chunk_._getitem(0, obj.leftover // obj.atomsize, obj.lastchunk)
+  return obj
+
+
+def _unpickle_carray(object data):
+  """Rebuild a carray out of the `data` produced by `carray.__reduce__()`."""
+  fileobj = StringIO(data)
+  return load_carray(fileobj, 0, read_pack_meta(fileobj, 0, len(data)))
+
+
+cdef class packed_chunks(object):
+  """
+  packed_chunks(filename)
+
+  Access the chunks of a carray packed in a single file (see
+  `carray.pack()`).
+
+  The file is memory mapped in read-only mode and the chunks are
+  decompressed straight from the mapped pages, without any intermediate
+  copy.
+
+  This class is meant to be used only by the `carray` class.
+
+  """
+
+  cdef object mm, atom, cparams, offsets, sizes
+  cdef npy_intp chunksize, nchunks
+  cdef public object meta, stats
+
+  def __cinit__(self, object filename):
+    with open(filename, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      self.meta = read_pack_meta(self.mm, 0, len(self.mm))
+    except IOError:
+      raise IOError, "'%s' does not hold a packed carray" % filename
+    if 'names' in self.meta:
+      raise IOError, "'%s' holds a ctable; use `load()` instead" % filename
+    self.offsets = self.meta.pop('offsets')
+    self.sizes = self.meta.pop('sizes')
+
+
+  def setup(self, object atom, object cparams, npy_intp chunklen):
+    """Set the properties of the chunks to be read."""
+    self.atom = atom
+    self.cparams = cparams
+    self.chunksize = chunklen * atom.itemsize
+    # The leftover (if any) is not considered a regular chunk
+    self.nchunks = (self.meta['len'] * atom.itemsize) // self.chunksize
+    self.stats = read_stats(self.meta, self.nchunks)
+
+
+  def read_chunk(self, npy_intp nchunk, npy_intp nbytes=-1):
+    """Return chunk `nchunk` (having `nbytes`) out of the mapped file."""
+    if nbytes < 0:
+      nbytes = self.chunksize
+    data = buffer(self.mm, self.offsets[nchunk], self.sizes[nchunk])
+    stats = None
+    if nchunk < self.nchunks:
+      stats = self.stats[nchunk]
+    return decode_chunk(data, self.atom, self.cparams, nbytes, stats)
+
+
+  def __len__(self):
+    return self.nchunks
+
+
+  def __getitem__(self, object nchunk):
+    if nchunk < 0:
+      nchunk += self.nchunks
+    if nchunk < 0 or nchunk >= self.nchunks:
+      raise IndexError, "index out of range"
+    return self.read_chunk(nchunk)
+
+
+
+cdef class chunkcache(object):
+  """
+  chunkcache(maxbytes)
+
+  A process-wide cache of decompressed chunks with a budget of `maxbytes`.
+
+  Entries are NumPy arrays keyed by any hashable object.  When the budget
+  is exceeded, entries are evicted following the CLOCK algorithm (a cheap
+  approximation of LRU): every entry has a reference bit that is set when
+  it is hit, and the clock hand evicts the first entry having it unset
+  (clearing the bits of the entries it passes by).
+
+  The `hits` and `misses` counters can be used to size the cache.  The
+  cache can be safely used from different threads.
+
+  """
+
+  cdef readonly npy_intp maxbytes, nbytes, hits, misses
+  cdef object entries, ring, free, lock
+  cdef npy_intp hand
+
+  property nentries:
+    "The number of entries in the cache."
+    def __get__(self):
+      return len(self.entries)
+
+  def __cinit__(self, npy_intp maxbytes=0):
+    self.maxbytes = maxbytes
+    self.hits = self.misses = 0
+    self.lock = threading.Lock()
+    self.clear()
+
+
+  def clear(self):
+    """Remove all the entries in the cache (counters are kept)."""
+    with self.lock:
+      # key -> [slot in ring, value, reference bit]
+      self.entries = {}
+      self.ring = []    # the keys in the clock (None for free slots)
+      self.free = []    # the free slots in the ring
+      self.hand = 0
+      self.nbytes = 0
+
+
+  def reset_stats(self):
+    """Reset the `hits` and `misses` counters."""
+    self.hits = self.misses = 0
+
+
+  def set_maxbytes(self, npy_intp maxbytes):
+    """Set the budget for the cache (evicting entries if necessary)."""
+    if maxbytes < 0:
+      raise ValueError, "`maxbytes` cannot be negative"
+    with self.lock:
+      self.maxbytes = maxbytes
+      while self.nbytes > maxbytes:
+        self.evict()
+
+
+  def __contains__(self, object key):
+    return key in self.entries
+
+
+  def get(self, object key):
+    """Return the value for `key` or None if it is not in the cache."""
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      entry[2] = True
+      return entry[1]
+
+
+  def put(self, object key, ndarray value):
+    """Put `value` in the cache with `key`."""
+    cdef npy_intp nbytes, slot
+
+    nbytes = value.nbytes
+    with self.lock:
+      if nbytes > self.maxbytes:
+        return
+      if key in self.entries:
+        self._remove(key)
+      while self.nbytes + nbytes > self.maxbytes:
+        self.evict()
+      if self.free:
+        slot = self.free.pop()
+        self.ring[slot] = key
+      else:
+        slot = len(self.ring)
+        self.ring.append(key)
+      self.entries[key] = [slot, value, False]
+      self.nbytes += nbytes
+
+
+  def remove(self, object key):
+    """Remove `key` from the cache."""
+    with self.lock:
+      self._remove(key)
+
+
+  cdef _remove(self, object key):
+    slot, value, refbit = self.entries.pop(key)
+    self.ring[slot] = None
+    self.free.append(slot)
+    self.nbytes -= value.nbytes
+
+
+  cdef evict(self):
+    """Evict one entry following the CLOCK algorithm."""
+    cdef npy_intp nslots
+
+    nslots = len(self.ring)
+    while True:
+      if self.hand >= nslots:
+        self.hand = 0
+      key = self.ring[self.hand]
+      self.hand += 1
+      if key is None:
+        continue
+      entry = self.entries[key]
+      if entry[2]:
+        # Give it a second chance
+        entry[2] = False
+      else:
+        self._remove(key)
+        return
+
+
+  def __repr__(self):
+    return "chunkcache(%s)  nentries: %d; nbytes: %s; hits: %d; misses: %d" % \
+           (self.maxbytes, len(self.entries), self.nbytes,
+            self.hits, self.misses)
+
+
+class prefetcher(object):
+  """
+  prefetcher(maxpending=16)
+
+  Decompress chunks into the chunk cache from a background thread.
+
+  Consumers scanning a carray sequentially request the chunks coming
+  next, so that their decompression (which releases the GIL) overlaps
+  with the processing of the current chunk.  At most `maxpending` requests
+  are queued at any time.
+
+  """
+
+  def __init__(self, maxpending=16):
+    self.maxpending = maxpending
+    self.cond = threading.Condition()
+    self.queue = collections.deque()
+    self.pending = set()
+    self.thread = None
+
+
+  def request(self, carr, nchunk, key):
+    """Ask for chunk `nchunk` of `carr` to be cached with `key`."""
+    with self.cond:
+      if key in self.pending or len(self.pending) >= self.maxpending:
+        return
+      self.pending.add(key)
+      self.queue.append((carr, nchunk, key))
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run,
+                                       name="carray-prefetcher")
+        self.thread.daemon = True
+        self.thread.start()
+      self.cond.notify_all()
+
+
+  def wait(self, key):
+    """Wait until `key` is not pending anymore."""
+    with self.cond:
+      while key in self.pending:
+        self.cond.wait()
+
+
+  def run(self):
+    while True:
+      with self.cond:
+        while not self.queue:
+          self.cond.wait()
+        carr, nchunk, key = self.queue.popleft()
+      try:
+        if key not in chunk_cache:
+          chunk_cache.put(key, (<carray>carr).load_chunk(nchunk))
+      except Exception:
+        # Errors will be raised again (if any) when the consumer asks
+        # for the chunk
+        pass
+      finally:
+        with self.cond:
+          self.pending.discard(key)
+          self.cond.notify_all()
+
+
+class tierer(object):
+  """
+  tierer(interval=60)
+
+  Compress again the cold chunks of carrays from a background thread.
+
+  Every `interval` seconds, the carrays registered via
+  `carray.set_tiering()` are passed through `carray.tier()`.  Carrays
+  are referenced weakly, so registering them does not keep them alive.
+
+  """
+
+  def __init__(self, interval=60):
+    self.interval = interval
+    self.cond = threading.Condition()
+    self.carrays = {}
+    self.thread = None
+
+
+  def set_interval(self, interval):
+    """Set the number of seconds between rounds to `interval`."""
+    if interval <= 0:
+      raise ValueError, "`interval` must be a positive number"
+    with self.cond:
+      self.interval = interval
+      self.cond.notify_all()
+
+
+  def register(self, carr, clevel, age):
+    """Compress with `clevel` the chunks of `carr` older than `age`."""
+    with self.cond:
+      self.carrays[id(carr)] = (weakref.ref(carr), clevel, age)
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run,
+                                       name="carray-tierer")
+        self.thread.daemon = True
+        self.thread.start()
+      self.cond.notify_all()
+
+
+  def unregister(self, carr):
+    """Stop tiering the chunks of `carr`."""
+    with self.cond:
+      self.carrays.pop(id(carr), None)
+
+
+  def run(self):
+    while True:
+      with self.cond:
+        self.cond.wait(self.interval)
+        entries = self.carrays.items()
+      for key, (ref, clevel, age) in entries:
+        carr = ref()
+        if carr is None:
+          with self.cond:
+            if key in self.carrays and self.carrays[key][0] is ref:
+              del self.carrays[key]
+          continue
+        try:
+          carr.tier(clevel, age)
+        except Exception:
+          # Nothing to report to; the carray will be retried next round
+          pass
+        carr = None
+
+
+class pool(object):
+  """
+  pool(nthreads=1, name="carray-pool")
+
+  A pool of threads running tasks at the same time.
+
+  Tasks are meant to spend most of their time with the GIL released
+  (i.e. in Blosc).  Threads are started on first use and stay idle when
+  there is nothing to do; when the number of threads is lowered, the
+  ones in excess quit.  Every thread uses a serial Blosc context, as
+  the parallelism comes from the pool itself.
+
+  """
+
+  def __init__(self, nthreads=1, name="carray-pool"):
+    self.nthreads = nthreads
+    self.name = name
+    self.cond = threading.Condition()
+    self.queue = collections.deque()
+    self.threads = []
+
+
+  def set_nthreads(self, nthreads):
+    """Set the number of threads in the pool to `nthreads`."""
+    if not isinstance(nthreads, int) or nthreads < 1:
+      raise ValueError, "`nthreads` must be a positive int"
+    with self.cond:
+      self.nthreads = nthreads
+      # Retire the threads in excess: each one of them picks a None task
+      # (ahead of the pending ones) and quits
+      while len(self.threads) > nthreads:
+        self.threads.pop()
+        self.queue.appendleft(None)
+      self.cond.notify_all()
+
+
+  def map(self, func, args):
+    """Return the outcomes of `func(*a)` for every `a` in `args` (in order).
+
+    The first exception raised by a task (if any) is raised again here,
+    once all the tasks are done.
+    """
+    # The pending count, the results and the first error (if any)
+    job = [len(args), [None] * len(args), None]
+    if not args:
+      return job[1]
+    with self.cond:
+      while len(self.threads) < self.nthreads:
+        thread = threading.Thread(target=self.run, name=self.name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+      for i, a in enumerate(args):
+        self.queue.append((job, i, func, a))
+      self.cond.notify_all()
+      while job[0] > 0:
+        self.cond.wait()
+    if job[2] is not None:
+      raise job[2]
+    return job[1]
+
+
+  def run(self):
+    cdef context ctx = get_context()
+
+    ctx.serial = 1
+    ctx.set_nthreads(1)
+    while True:
+      with self.cond:
+        while not self.queue:
+          self.cond.wait()
+        task = self.queue.popleft()
+      if task is None:
+        return
+      job, i, func, a = task
+      error = None
+      try:
+        job[1][i] = func(*a)
+      except Exception, error:
+        pass
+      with self.cond:
+        if error is not None and job[2] is None:
+          job[2] = error
+        job[0] -= 1
+        if job[0] == 0:
+          self.cond.notify_all()
+
+
+def _compress_array(array, atom, cparams, dflt, trial):
+  """Return a chunk for `array`, compressed in the calling thread."""
+  # Pool threads have a serial context (see `pool.run()`)
+  return chunk(array, atom, cparams, dflt, _trial=trial)
+
+
+class compressor(pool):
+  """
+  compressor(nthreads=1)
+
+  Compress several chunks at the same time in a pool of threads.
+
+  Every thread compresses whole chunks with the re-entrant Blosc
+  compressor, releasing the GIL meanwhile, so that bulk loads scale with
+  the number of cores (Blosc threads only split a single chunk in
+  blocks).  With a single thread, chunks are compressed in the calling
+  thread as usual.
+
+  """
+
+  def __init__(self, nthreads=1):
+    pool.__init__(self, nthreads, "carray-compressor")
+
+
+  def compress(self, arrays, atom, cparams, dflt=None, trial=None,
+               nthreads=None):
+    """Return the chunks for the `arrays` (in the same order).
+
+    If `nthreads` is 1, chunks are compressed in the calling thread.
+    Else, every chunk gets its own copy of `trial`, which are merged
+    back in afterwards.
+    """
+    if nthreads is None:
+      nthreads = self.nthreads
+    if nthreads == 1 or len(arrays) < 2:
+      return [chunk(array, atom, cparams, dflt, _trial=trial)
+              for array in arrays]
+    if trial is None:
+      trials = [None] * len(arrays)
+    else:
+      trials = [trial.copy() for array in arrays]
+    chunks = self.map(_compress_array,
+                      [(array, atom, cparams, dflt, trials[i])
+                       for i, array in enumerate(arrays)])
+    if trial is not None:
+      trial.merge(trials)
+    return chunks
+
+
+def _read_range(carray carr, npy_intp nchunk, int startb, int stopb,
+                int step, ndarray out, npy_intp nwrow, npy_intp blen):
+  """Put the rows in [startb:stopb:step] of chunk `nchunk` in `out`."""
+  cdef ndarray tmp
+
+  if step == 1:
+    carr.read_chunk_range(nchunk, startb, stopb,
+                          out.data + nwrow * carr.atomsize)
+  else:
+    tmp = np.empty(shape=(stopb - startb,), dtype=carr._dtype)
+    carr.read_chunk_range(nchunk, startb, stopb, tmp.data)
+    out[nwrow:nwrow+blen] = tmp[::step]
+
+
+class decompressor(pool):
+  """
+  decompressor(nthreads=1)
+
+  Decompress several chunks at the same time in a pool of threads.
+
+  Large range reads of in-memory carrays (slices and `eval()`) are split
+  by chunk, and every thread decompresses its chunks straight into their
+  place in the output, releasing the GIL meanwhile.  With a single
+  thread, chunks are decompressed in the calling thread as usual.
+
+  """
+
+  def __init__(self, nthreads=1):
+    pool.__init__(self, nthreads, "carray-decompressor")
+
+
+  def read(self, carr, ranges, out):
+    """Fill `out` with the rows in `ranges` of `carr`.
+
+    Every range is a (nchunk, startb, stopb, step, nwrow, blen) tuple,
+    i.e. the `blen` rows in [startb:stopb:step] of chunk `nchunk` go to
+    ``out[nwrow:nwrow+blen]``.
+    """
+    args = [(carr,) + r[:4] + (out,) + r[4:] for r in ranges]
+    if self.nthreads == 1 or len(args) < 2:
+      for a in args:
+        _read_range(*a)
+    else:
+      self.map(_read_range, args)
+
+
+# The pool of threads for compressing chunks in bulk loads.  The number
+# of threads is set via `defaults.compress_threads`.
+chunk_compressor = compressor()
+
+# The pool of threads for decompressing chunks in large range reads.  The
+# number of threads is set via `defaults.decompress_threads`.
+chunk_decompressor = decompressor()
+
+# The cache for decompressed chunks of disk-based carrays.  Its budget is
+# set via `defaults.chunk_cache_size`.
+chunk_cache = chunkcache(0)
+
+# The cache for decompressed Blosc blocks of carrays, used by random
+# single-item lookups and fancy indexing.  Its budget is set via
+# `defaults.block_cache_size`.
+block_cache = chunkcache(0)
+
+# A source of unique identifiers for the chunk and block cache keys
+_cacheids = itertools.count()
+
+# The prefetcher of chunks for sequential scans.  The number of chunks to
+# read ahead is set via `defaults.prefetch_chunks`.
+chunk_prefetcher = prefetcher()
+
+# The thread compressing again the cold chunks of carrays.  The time
+# between rounds is set via `defaults.tiering_interval`.
+chunk_tierer = tierer()
+
+
+cdef class carray:
+  """
+  carray(array, cparams=None, dtype=None, dflt=None, expectedlen=None, chunklen=None, rootdir=None, mode='a')
+
+  A compressed and enlargeable data container either in-memory or on-disk.
+
+  `carray` exposes a series of methods for dealing with the compressed
+  container in a NumPy-like way.
+
+  Parameters
+  ----------
+  array : a NumPy-like object
+      This is taken as the input to create the carray.  It can be any Python
+      object that can be converted into a NumPy object.  The data type of
+      the resulting carray will be the same as this NumPy object.  If None,
+      an existing carray on-disk is opened from `rootdir`.
+  cparams : instance of the `cparams` class, optional
+      Parameters to the internal Blosc compressor.
+  dtype : NumPy dtype
+      Force this `dtype` for the carray (rather than the `array` one).
+  dflt : Python or NumPy scalar
+      The value to be used when enlarging the carray.  If None, the default is
+      filling with zeros.
+  expectedlen : int, optional
+      A guess on the expected length of this object.  This will serve to
+      decide the best `chunklen` used for compression and memory I/O
+      purposes.
+  chunklen : int, optional
+      The number of rows that fits into a chunk.  By specifying it you can
+      explicitely set the chunk size used for compression and memory I/O.
+      Only use it if you know what are you doing.
+  rootdir : str, optional
+      The directory where all the data and metadata will be stored.  If
+      specified, then the carray object will be disk-based (i.e. all chunks
+      will live on-disk, not in memory) and persistent (i.e. it can be
+      restored in other session, e.g. via the `open()` top-level function).
+  mode : str, optional
+      The mode that a *persistent* carray should be created/opened.  The
+      values can be:
+
+        * 'r' for read-only
+        * 'w' for read/write.  During carray creation, the `rootdir` will be
+          removed if it exists.  During carray opening, the carray will be
+          resized to 0.
+        * 'a' for append (possible data inside `rootdir` will not be
+          removed).
+
+  """
+
+  cdef int itemsize, atomsize, _chunksize, _chunklen, leftover
+  cdef int nrowsinbuf, _row
+  cdef int sss_mode, wheretrue_mode, where_mode
+  cdef npy_intp startb, stopb
+  cdef npy_intp start, stop, step, nextelement
+  cdef npy_intp _nrow, nrowsread
+  cdef npy_intp _nbytes, _cbytes
+  cdef npy_intp nhits, limit, skip
+  cdef char *lastchunk
+  cdef object lastchunkarr, where_arr, arr1
+  cdef object _cparams, _dflt
+  cdef object _dtype, chunks
+  cdef object _rootdir, _mode
+  cdef object _cacheid, _trial
+  cdef npy_intp _lastchunk
+  cdef int _sequential
+  cdef ndarray iobuf, where_buf
+  # The true rows of a sparse chunk of booleans being iterated (see
+  # `__next__()`), the next one and the first row of the chunk
+  cdef ndarray sphits
+  cdef npy_intp sphit, spbase
+  # For block cache
+  cdef int blocksize, idxcache, blocklencache
+  cdef ndarray blockcache
+  cdef char *datacache
+  # For being registered in the chunk tierer
+  cdef object __weakref__
+
+  property cbytes:
+    "The compressed size of this object (in bytes)."
+    def __get__(self):
+      return self._cbytes
+
+  property chunklen:
+    "The number of rows that fits into a chunk."
+    def __get__(self):
+      return self._chunklen
+
+  property cparams:
+    "The compression parameters for this object."
+    def __get__(self):
+      return self._cparams
+
+  property dflt:
+    "The default value of this object."
+    def __get__(self):
+      return self._dflt
+
+  property dtype:
+    "The dtype of this object."
+    def __get__(self):
+      return self._dtype.base
+
+  property len:
+    "The length (leading dimension) of this object."
+    def __get__(self):
+      # Important to do the cast in order to get a npy_intp result
+      return self._nbytes // <npy_intp>self.atomsize
+
+  property mode:
+    "The mode used to create/open this object."
+    def __get__(self):
+      return self._mode
+
+  property nbytes:
+    "The original (uncompressed) size of this object (in bytes)."
+    def __get__(self):
+      return self._nbytes
+
+  property ndim:
+    "The number of dimensions of this object."
+    def __get__(self):
+      return len(self.shape)
+
+  property rootdir:
+    "The on-disk directory used for persistency (None if in-memory)."
+    def __get__(self):
+      return self._rootdir
+
+  property shape:
+    "The shape of this object."
+    def __get__(self):
+      return (self.len,) + self._dtype.shape
+
+  def __cinit__(self, object array=None, object cparams=None,
+                object dtype=None, object dflt=None,
+                object expectedlen=None, object chunklen=None,
+                object rootdir=None, object mode='a'):
+
+    if mode not in ('r', 'w', 'a'):
+      raise ValueError, "`mode` can only be 'r', 'w' or 'a'"
+    self._rootdir = rootdir
+    self._mode = mode
+    # The identifier of self in the chunk cache
+    self._cacheid = _cacheids.next()
+    # Whether new chunks are worth compressing
+    self._trial = trial()
+    # For detecting sequential scans
+    self._lastchunk = -2
+    self._sequential = False
+
+    if array is None:
+      # Open an existing carray on-disk
+      if rootdir is None:
+        raise ValueError, "you need to pass either an `array` or a `rootdir`"
+      if os.path.isfile(rootdir):
+        self.open_packed(rootdir, mode)
+      else:
+        self.open_carray(rootdir, mode)
+    else:
+      if rootdir is not None and mode == 'r':
+        raise ValueError, "cannot create a carray in read-only mode"
+      self.create_carray(array, cparams, dtype, dflt, expectedlen, chunklen)
+
+    # Sentinels
+    self.sss_mode = False
+    self.wheretrue_mode = False
+    self.where_mode = False
+    self.idxcache = -1       # cache not initialized
+
+    # Cache a len-1 array for accelerating self[int] case
+    self.arr1 = np.empty(shape=(1,), dtype=self._dtype)
+
+
+  cdef create_carray(self, object array, object cparams, object dtype,
+                     object dflt, object expectedlen, object chunklen):
+    """Create a new carray out of `array`."""
+    cdef int i, itemsize, atomsize, chunksize, leftover, nchunks
+    cdef npy_intp nbytes, cbytes
+    cdef ndarray array_, remainder, lastchunkarr
+    cdef chunk chunk_
+    cdef object _dflt
+
+    # Check defaults for cparams
+    if cparams is None:
+      cparams = ca.cparams()
+
+    if not isinstance(cparams, ca.cparams):
+      raise ValueError, "`cparams` param must be an instance of `cparams` class"
+
+    # Convert input to an appropriate type
+    if type(dtype) is str:
+        dtype = np.dtype(dtype)
+    array_ = utils.to_ndarray(array, dtype)
+    if dtype is None:
+      if len(array_.shape) == 1:
+        self._dtype = dtype = array_.dtype
+      else:
+        # Multidimensional array.  The atom will have array_.shape[1:] dims.
+        # atom dimensions will be stored in `self._dtype`, which is different
+        # than `self.dtype` in that `self._dtype` dimensions are transferred
+        # to `self.shape`.  `self.dtype` will always be scalar (NumPy
+        # convention).
+        self._dtype = dtype = np.dtype((array_.dtype.base, array_.shape[1:]))
+    else:
+      self._dtype = dtype
+    # Checks for the dtype
+    if self._dtype.kind == 'O':
+      raise TypeError, "object dtypes are not supported in carray objects"
+    # Check that atom size is less than 2 GB
+    if dtype.itemsize >= 2**31:
+      raise ValueError, "atomic size is too large (>= 2 GB)"
+
+    # Check defaults for dflt
+    _dflt = np.zeros((), dtype=dtype)
+    if dflt is not None:
+      if dtype.shape == ():
+        _dflt[()] = dflt
+      else:
+        _dflt[:] = dflt
+    self._dflt = _dflt
+
+    self._cparams = cparams
+    self.atomsize = atomsize = dtype.itemsize
+    self.itemsize = itemsize = dtype.base.itemsize
+
+    # Compute the chunklen/chunksize
+    if expectedlen is None:
+      # Try a guess
+      expectedlen = len(array_)
+    if chunklen is None:
+      # Try a guess
+      chunksize = utils.calc_chunksize((expectedlen * atomsize) / float(_MB))
+      # Chunksize must be a multiple of atomsize
+      chunksize = (chunksize // atomsize) * atomsize
+      # Protection against large itemsizes
+      if chunksize < atomsize:
+        chunksize = atomsize
+    else:
+      if not isinstance(chunklen, int) or chunklen < 1:
+        raise ValueError, "chunklen must be a positive integer"
+      chunksize = chunklen * atomsize
+    chunklen = chunksize  // atomsize
+    self._chunksize = chunksize
+    self._chunklen = chunklen
+
+    # Decide where the chunks will live
+    if self._rootdir is None:
+      self.chunks = chunklist(dtype, cparams, chunksize)
+    else:
+      self.mkdirs(self._rootdir, self._mode)
+      self.chunks = chunks(self._rootdir, dtype, cparams, chunklen)
+
+    # Book memory for last chunk (uncompressed)
+    lastchunkarr = np.empty(dtype=dtype, shape=(chunklen,))
+    self.lastchunk = lastchunkarr.data
+    self.lastchunkarr = lastchunkarr
+
+    # The number of bytes in incoming array
+    nbytes = itemsize * array_.size
+    self._nbytes = nbytes
+
+    # Compress data in chunks
+    nchunks = nbytes // <npy_intp>chunksize
+    cbytes = self.append_chunks(array_, nchunks)
+    self.leftover = leftover = nbytes % chunksize
+    if leftover:
+      remainder = array_[nchunks*chunklen:]
+      memcpy(self.lastchunk, remainder.data, leftover)
+    cbytes += self._chunksize  # count the space in last chunk
+    self._cbytes = cbytes
+
+    # Make the data and metadata persistent
+    self.flush()
+
+
+  cdef mkdirs(self, object rootdir, object mode):
+    """Create the basic directory layout for persistent storage."""
+    if os.path.exists(rootdir):
+      if mode != "w":
+        raise IOError, \
+              "specified rootdir path '%s' already exists " \
+              "and creation mode is '%s'" % (rootdir, mode)
+      if os.path.isdir(rootdir):
+        shutil.rmtree(rootdir)
+      else:
+        os.remove(rootdir)
+    os.mkdir(rootdir)
+    os.mkdir(os.path.join(rootdir, DATA_DIR))
+
+
+  cdef get_meta(self):
+    """Return a JSON serializable dictionary with the metadata of self."""
+    return {'dtype': utils.encode_dtype(self._dtype),
+            'cparams': {'clevel': self._cparams.clevel,
+                        'shuffle': self._cparams.shuffle,
+                        'dedup': self._cparams.dedup},
+            'chunklen': self._chunklen,
+            'dflt': base64.b64encode(np.asarray(self._dflt).tostring()),
+            'len': self.len,
+            'leftover': self.leftover,
+            'cbytes': self._cbytes,
+            'stats': [self.chunk_stats(nchunk)
+                      for nchunk in range(len(self.chunks))],
+            }
+
+
+  cdef set_meta(self, object meta):
+    """Restore the metadata in `meta` (see `get_meta()`) into self."""
+    cdef ndarray lastchunkarr
+
+    self._dtype = dtype = utils.decode_dtype(meta['dtype'])
+    self._cparams = ca.cparams(clevel=meta['cparams']['clevel'],
+                               shuffle=meta['cparams']['shuffle'],
+                               dedup=meta['cparams'].get('dedup', False))
+    dflt = np.fromstring(base64.b64decode(meta['dflt']), dtype=dtype.base)
+    self._dflt = dflt.reshape(dtype.shape)
+    self.atomsize = dtype.itemsize
+    self.itemsize = dtype.base.itemsize
+    self._chunklen = meta['chunklen']
+    self._chunksize = self._chunklen * self.atomsize
+    self._nbytes = meta['len'] * self.atomsize
+    self._cbytes = meta['cbytes']
+    self.leftover = meta['leftover']
+
+    # Book memory for last chunk (uncompressed)
+    lastchunkarr = np.empty(dtype=dtype, shape=(self._chunklen,))
+    self.lastchunk = lastchunkarr.data
+    self.lastchunkarr = lastchunkarr
+
+
+  cdef open_carray(self, object rootdir, object mode):
+    """Open an existing carray on-disk in `rootdir`."""
+    cdef npy_intp nchunks
+    cdef chunk chunk_
+
+    metapath = os.path.join(rootdir, META_FILE)
+    if not os.path.exists(metapath):
+      raise IOError, "'%s' does not hold a carray object" % rootdir
+    with open(metapath, 'rb') as f:
+      meta = json.loads(f.read())
+    self.set_meta(meta)
+
+    # Chunks are not read until they are accessed
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    self.chunks = chunks(rootdir, self._dtype, self._cparams, self._chunklen,
+                         nchunks, mode)
+    self.chunks.stats = read_stats(meta, nchunks)
+
+    # Fill the last chunk
+    if self.leftover:
+      chunk_ = self.chunks.read_chunk(nchunks, self.leftover)
+      chunk_._getitem(0, self.leftover // self.atomsize, self.lastchunk)
+
+    if mode == "w":
+      self.resize(0)
+      self.flush()
+
+
+  cdef open_packed(self, object filename, object mode):
+    """Open a carray packed in `filename` (see `pack()`)."""
+    cdef npy_intp nchunks
+    cdef chunk chunk_
+
+    if mode != "r":
+      raise IOError, "packed carrays can only be opened in read-only mode"
+    self.chunks = packed_chunks(filename)
+    self.set_meta(self.chunks.meta)
+    self.chunks.setup(self._dtype, self._cparams, self._chunklen)
+
+    # Fill the last chunk
+    nchunks = len(self.chunks)
+    if self.leftover:
+      chunk_ = self.chunks.read_chunk(nchunks, self.leftover)
+      chunk_._getitem(0, self.leftover // self.atomsize, self.lastchunk)
+
+
+  def flush(self):
+    """
+    flush()
+
+    Flush data in internal buffers to disk.
+
+    This call should typically be done after performing modifications
+    (__settitem__(), append()) in persistence mode.  If you don't do this,
+    you risk losing part of your modifications.
+
+    """
+    cdef chunk chunk_
+    cdef npy_intp nchunks
+
+    if self._rootdir is None or self._mode == "r":
+      return
+
+    # Save the leftover as an additional (partial) chunk
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    leftoverpath = self.chunks.chunkpath(nchunks)
+    if self.leftover:
+      chunk_ = chunk(self.lastchunkarr[:self.leftover // self.atomsize],
+                     self._dtype, self._cparams)
+      self.chunks.write_chunk(nchunks, chunk_)
+    elif os.path.exists(leftoverpath):
+      os.remove(leftoverpath)
+
+    # Then the metadata
+    metapath = os.path.join(self._rootdir, META_FILE)
+    with open(metapath + ".tmp", 'wb') as f:
+      f.write(json.dumps(self.get_meta()))
+    # Atomically replace the previous metadata
+    os.rename(metapath + ".tmp", metapath)
+    (<chunks>self.chunks).stats_saved = True
+
+
+  def pack(self, object filename):
+    """
+    pack(filename)
+
+    Pack all the chunks of this object in a single file.
+
+    The resulting file holds the compressed chunks one after the other,
+    followed by an index with their offsets and sizes and the metadata.
+    It can be re-opened later (in read-only mode) via the `open()`
+    top-level function.  In this case, the file is memory mapped and the
+    chunks are decompressed straight from the mapped pages, so the OS page
+    cache is shared between all the processes using the same file.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file where the data will be stored.  If it exists,
+        it will be overwritten.
+
+    See Also
+    --------
+    save
+
+    """
+    with open(filename, 'wb') as f:
+      self.save(f)
+
+
+  def save(self, object fileobj):
+    """
+    save(fileobj)
+
+    Save this object into the `fileobj` file-like object.
+
+    The compressed chunks are written verbatim (i.e. without being
+    decompressed and compressed again), followed by the metadata.  The
+    outcome can be restored with the `load()` top-level function.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        The object where data will be written.  Only its `write()` method
+        is used.
+
+    Returns
+    -------
+    out : int
+        The number of bytes written.
+
+    See Also
+    --------
+    pack
+
+    """
+    cdef chunk chunk_
+    cdef npy_intp nchunk, nchunks, offset
+
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    offsets, sizes = [], []
+    fileobj.write(PACK_MAGIC)
+    offset = len(PACK_MAGIC)
+    for nchunk from 0 <= nchunk <= nchunks:
+      if nchunk < nchunks:
+        chunk_ = self.chunks[nchunk]
+      elif self.leftover:
+        chunk_ = chunk(self.lastchunkarr[:self.leftover // self.atomsize],
+                       self._dtype, self._cparams)
+      else:
+        break
+      data = chunk_.getdata()
+      fileobj.write(data)
+      offsets.append(offset)
+      sizes.append(len(data))
+      offset += len(data)
+    # The index and metadata go at the end
+    meta = self.get_meta()
+    meta['offsets'] = offsets
+    meta['sizes'] = sizes
+    return offset + write_pack_index(fileobj, meta, offset)
+
+
+  def share(self, object name=None):
+    """
+    share(name=None)
+
+    Copy the compressed chunks of this object into a shared memory segment.
+
+    The segment is a packed file (see `pack()`) living in the
+    `defaults.shm_dir` directory ('/dev/shm' by default).  Other processes
+    can attach to it in read-only mode by using the `rootdir` of the
+    returned object (e.g. ``open(rootdir, mode='r')``); as the segment is
+    memory mapped, all of them share the same physical memory.  Pickling
+    the returned object just sends this `rootdir`.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the segment.  If None, a unique name is chosen.
+
+    Returns
+    -------
+    out : carray object
+        A read-only carray attached to the segment.
+
+    Notes
+    -----
+    The segment is not removed automatically.  Use ``os.remove(rootdir)``
+    when it is not needed anymore (processes attached to it can still use
+    it until they close it).
+
+    """
+    if name is None:
+      fd, path = tempfile.mkstemp(prefix="carray-", dir=ca.defaults.shm_dir)
+      os.close(fd)
+    else:
+      path = os.path.join(ca.defaults.shm_dir, name)
+    self.pack(path)
+    return carray(rootdir=path, mode="r")
+
+
+  def tofile(self, object fileobj, object raw=False):
+    """
+    tofile(fileobj, raw=False)
+
+    Write the data of this object into a NumPy `.npy` file.
+
+    Chunks are decompressed one at a time into the same buffer, which is
+    written out straight away, so the memory used is independent of the
+    length of the object.
+
+    Parameters
+    ----------
+    fileobj : str or file-like object
+        The name of the file or an object supporting the `write()`
+        method.  If it is a name and the file exists, it will be
+        overwritten.
+    raw : bool
+        If True, no `.npy` header is written, so the outcome just holds
+        the bytes of the data (in C order).
+
+    See Also
+    --------
+    fromfile
+
+    """
+    cdef chunk chunk_
+    cdef ndarray buf
+    cdef npy_intp nchunk, nchunks
+
+    if isinstance(fileobj, basestring):
+      with open(fileobj, 'wb') as f:
+        self.tofile(f, raw)
+      return
+
+    if not raw:
+      header = {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                'fortran_order': False,
+                'shape': self.shape}
+      np.lib.format.write_array_header_1_0(fileobj, header)
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    buf = np.empty(shape=(self._chunklen,), dtype=self._dtype)
+    for nchunk from 0 <= nchunk < nchunks:
+      chunk_ = self.chunks[nchunk]
+      chunk_._getitem(0, self._chunklen, buf.data)
+      fileobj.write(buffer(buf))
+    if self.leftover:
+      fileobj.write(buffer(self.lastchunkarr, 0, self.leftover))
+
+
+  cdef check_writable(self):
+    """Raise an IOError if this object cannot be modified."""
+    if self._mode == "r":
+      raise IOError, "cannot modify data in read-only mode"
 
-  property cbytes:
-    "The compressed size of this object (in bytes)."
-    def __get__(self):
-      return self._cbytes
 
-  property chunklen:
-    "The number of rows that fits into a chunk."
-    def __get__(self):
-      return self._chunklen
+  cdef object cached_chunk(self, npy_intp nchunk):
+    """Return chunk `nchunk` decompressed, going through the chunk cache.
 
-  property cparams:
-    "The compression parameters for this object."
-    def __get__(self):
-      return self._cparams
+    Disk-based objects always use the cache.  In-memory ones only do it
+    during sequential scans, where the next chunks are decompressed ahead
+    of time by the prefetcher.  When the cache is not used (or it is
+    disabled) this returns None.
+    """
+    cdef ndarray arr
+
+    if chunk_cache.maxbytes == 0:
+      return None
+    # Detect sequential scans
+    if nchunk == self._lastchunk + 1:
+      self._sequential = True
+    elif nchunk != self._lastchunk:
+      self._sequential = False
+    self._lastchunk = nchunk
+    if self._rootdir is None and not (
+      self._sequential and ca.defaults.prefetch_chunks > 0):
+      return None
+
+    key = (self._cacheid, nchunk)
+    if self._sequential:
+      self.readahead(nchunk)
+    # The chunk may be in the works in the prefetcher
+    chunk_prefetcher.wait(key)
+    arr = chunk_cache.get(key)
+    if arr is None:
+      arr = self.load_chunk(nchunk)
+      chunk_cache.put(key, arr)
+    return arr
 
-  property dflt:
-    "The default value of this object."
-    def __get__(self):
-      return self._dflt
 
-  property dtype:
-    "The dtype of this object."
-    def __get__(self):
-      return self._dtype.base
+  cdef readahead(self, npy_intp nchunk):
+    """Request the chunks following `nchunk` to the prefetcher."""
+    cdef npy_intp i, nchunks
 
-  property len:
-    "The length (leading dimension) of this object."
-    def __get__(self):
-      # Important to do the cast in order to get a npy_intp result
-      return self._nbytes // <npy_intp>self.atomsize
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    for i from nchunk < i <= nchunk + ca.defaults.prefetch_chunks:
+      if i >= nchunks:
+        break
+      key = (self._cacheid, i)
+      if key not in chunk_cache:
+        chunk_prefetcher.request(self, i, key)
 
-  property nbytes:
-    "The original (uncompressed) size of this object (in bytes)."
-    def __get__(self):
-      return self._nbytes
 
-  property ndim:
-    "The number of dimensions of this object."
-    def __get__(self):
-      return len(self.shape)
+  cdef ndarray load_chunk(self, npy_intp nchunk):
+    """Return chunk `nchunk` decompressed in a new NumPy array."""
+    cdef ndarray arr
 
-  property shape:
-    "The shape of this object."
-    def __get__(self):
-      return (self.len,) + self._dtype.shape
+    arr = np.empty(shape=(self._chunklen,), dtype=self._dtype)
+    self.read_chunk_range(nchunk, 0, self._chunklen, arr.data)
+    return arr
 
-  def __cinit__(self, object array, object cparams=None,
-                object dtype=None, object dflt=None,
-                object expectedlen=None, object chunklen=None):
-    cdef int i, itemsize, atomsize, chunksize, leftover, nchunks
-    cdef npy_intp nbytes, cbytes
-    cdef ndarray array_, remainder, lastchunkarr
+
+  cdef read_chunk_range(self, npy_intp nchunk, int start, int stop,
+                        char *dest):
+    """Decompress the rows in [start, stop) of chunk `nchunk` into `dest`."""
     cdef chunk chunk_
-    cdef object _dflt
 
-    # Check defaults for cparams
-    if cparams is None:
-      cparams = ca.cparams()
+    if type(self.chunks) is chunklist:
+      # Go straight to the chunk table
+      (<chunklist>self.chunks)._getitem(nchunk, start, stop, dest)
+    else:
+      chunk_ = self.chunks[nchunk]
+      chunk_._getitem(start, stop, dest)
 
-    if not isinstance(cparams, ca.cparams):
-      raise ValueError, "`cparams` param must be an instance of `cparams` class"
 
-    # Convert input to an appropriate type
-    if type(dtype) is str:
-        dtype = np.dtype(dtype)
-    array_ = utils.to_ndarray(array, dtype)
-    if dtype is None:
-      if len(array_.shape) == 1:
-        self._dtype = dtype = array_.dtype
-      else:
-        # Multidimensional array.  The atom will have array_.shape[1:] dims.
-        # atom dimensions will be stored in `self._dtype`, which is different
-        # than `self.dtype` in that `self._dtype` dimensions are transferred
-        # to `self.shape`.  `self.dtype` will always be scalar (NumPy
-        # convention).
-        self._dtype = dtype = np.dtype((array_.dtype.base, array_.shape[1:]))
-    else:
-      self._dtype = dtype
-    # Checks for the dtype
-    if self._dtype.kind == 'O':
-      raise TypeError, "object dtypes are not supported in carray objects"
-    # Check that atom size is less than 2 GB
-    if dtype.itemsize >= 2**31:
-      raise ValueError, "atomic size is too large (>= 2 GB)"
+  cdef int parallel_read(self, npy_intp start, npy_intp stop):
+    """Return whether to decompress the rows in [start, stop) in parallel.
 
-    # Check defaults for dflt
-    _dflt = np.zeros((), dtype=dtype)
-    if dflt is not None:
-      if dtype.shape == ():
-        _dflt[()] = dflt
-      else:
-        _dflt[:] = dflt
-    self._dflt = _dflt
+    Only large reads of in-memory objects go to the `chunk_decompressor`.
+    Disk-based objects read their chunks through the chunk cache.
+    """
+    return (chunk_decompressor.nthreads > 1 and
+            type(self.chunks) is chunklist and
+            (stop - start) // self._chunklen >= PARALLEL_MINCHUNKS)
 
-    self._cparams = cparams
-    self.chunks = chunks = []
-    self.atomsize = atomsize = dtype.itemsize
-    self.itemsize = itemsize = dtype.base.itemsize
 
-    # Compute the chunklen/chunksize
-    if expectedlen is None:
-      # Try a guess
-      expectedlen = len(array_)
-    if chunklen is None:
-      # Try a guess
-      chunksize = utils.calc_chunksize((expectedlen * atomsize) / float(_MB))
-      # Chunksize must be a multiple of atomsize
-      chunksize = (chunksize // atomsize) * atomsize
-      # Protection against large itemsizes
-      if chunksize < atomsize:
-        chunksize = atomsize
-    else:
-      if not isinstance(chunklen, int) or chunklen < 1:
-        raise ValueError, "chunklen must be a positive integer"
-      chunksize = chunklen * atomsize
-    chunklen = chunksize  // atomsize
-    self._chunksize = chunksize
-    self._chunklen = chunklen
+  cdef object chunk_stats(self, npy_intp nchunk):
+    """Return the zone map of chunk `nchunk` without decompressing it."""
+    # All the chunk containers keep the zone maps apart
+    return self.chunks.stats[nchunk]
 
-    # Book memory for last chunk (uncompressed)
-    lastchunkarr = np.empty(dtype=dtype, shape=(chunklen,))
-    self.lastchunk = lastchunkarr.data
-    self.lastchunkarr = lastchunkarr
 
-    # The number of bytes in incoming array
-    nbytes = itemsize * array_.size
-    self._nbytes = nbytes
+  def _zonemap(self, npy_intp start, npy_intp stop):
+    """
+    _zonemap(start, stop)
 
-    # Compress data in chunks
-    cbytes = 0
-    nchunks = nbytes // <npy_intp>chunksize
-    for i from 0 <= i < nchunks:
-      chunk_ = chunk(array_[i*chunklen:(i+1)*chunklen], dtype, cparams)
-      chunks.append(chunk_)
-      cbytes += chunk_.cbytes
-    self.leftover = leftover = nbytes % chunksize
-    if leftover:
-      remainder = array_[nchunks*chunklen:]
-      memcpy(self.lastchunk, remainder.data, leftover)
-    cbytes += self._chunksize  # count the space in last chunk
-    self._cbytes = cbytes
+    Return the (min, max, nancount) stats for the rows in [start, stop).
 
-    # Sentinels
-    self.sss_mode = False
-    self.wheretrue_mode = False
-    self.where_mode = False
-    self.idxcache = -1       # cache not initialized
+    The stats come from the zone maps of the chunks covering the range,
+    so the actual values in the range are just bounded by them.  If they
+    are not known for any of these chunks, None is returned.
 
-    # Cache a len-1 array for accelerating self[int] case
-    self.arr1 = np.empty(shape=(1,), dtype=self._dtype)
+    """
+    cdef npy_intp nchunk, nchunks, first, last, nancount
+
+    if stop > self.len:
+      stop = self.len
+    if start >= stop:
+      return None
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    first = start // self._chunklen
+    last = (stop - 1) // self._chunklen
+    minval, maxval, nancount = None, None, 0
+    for nchunk from first <= nchunk <= last:
+      if nchunk < nchunks:
+        stats = self.chunk_stats(nchunk)
+      else:
+        # The leftover is not compressed yet, so compute its stats now
+        stats = compute_stats(
+          self.lastchunkarr[:self.leftover // self.atomsize])
+      if stats is None:
+        return None
+      nancount += stats[2]
+      if stats[0] is None:
+        continue
+      if minval is None or stats[0] < minval:
+        minval = stats[0]
+      if maxval is None or stats[1] > maxval:
+        maxval = stats[1]
+    return (minval, maxval, nancount)
+
+
+  cdef reset_chunk_cache(self):
+    """Invalidate the entries of self in the chunk and block caches."""
+    # Stale entries will be evicted eventually
+    self._cacheid = _cacheids.next()
 
 
   def append(self, object array):
@@ -574,6 +3091,7 @@ cdef class carray:
     cdef ndarray remainder, arrcpy, dflts
     cdef chunk chunk_
 
+    self.check_writable()
     arrcpy = utils.to_ndarray(array, self._dtype)
     if arrcpy.dtype != self._dtype.base:
       raise TypeError, "array dtype does not match with self"
@@ -586,7 +3104,7 @@ cdef class carray:
     atomsize = self.atomsize
     itemsize = self.itemsize
     chunksize = self._chunksize
-    chunks = self.chunks
+    chunks_ = self.chunks
     leftover = self.leftover
     bsize = arrcpy.size*itemsize
     cbytes = 0
@@ -612,8 +3130,9 @@ cdef class carray:
           start, stop = leftover // atomsize, (leftover+nbytesfirst) // atomsize
           self.lastchunkarr[start:stop] = arrcpy[start:stop]
         # Compress the last chunk and add it to the list
-        chunk_ = chunk(self.lastchunkarr, self._dtype, self._cparams)
-        chunks.append(chunk_)
+        chunk_ = chunk(self.lastchunkarr, self._dtype, self._cparams,
+                       self._dflt, _trial=self._trial)
+        chunks_.append(chunk_)
         cbytes = chunk_.cbytes
       else:
         nbytesfirst = 0
@@ -624,11 +3143,7 @@ cdef class carray:
       chunklen = self._chunklen
       # Get a new view skipping the elements that have been already copied
       remainder = arrcpy[nbytesfirst // atomsize:]
-      for i from 0 <= i < nchunks:
-        chunk_ = chunk(
-          remainder[i*chunklen:(i+1)*chunklen], self._dtype, self._cparams)
-        chunks.append(chunk_)
-        cbytes += chunk_.cbytes
+      cbytes += self.append_chunks(remainder, nchunks)
 
       # Finally, deal with the leftover
       leftover = nbytes % chunksize
@@ -645,6 +3160,26 @@ cdef class carray:
     self._nbytes += bsize
 
 
+  cdef npy_intp append_chunks(self, ndarray array, npy_intp nchunks) except -1:
+    """Compress the first `nchunks` chunks in `array` and append them.
+
+    The chunks are compressed at the same time by the `chunk_compressor`
+    threads.  Return the compressed bytes added.
+    """
+    cdef npy_intp i, chunklen, cbytes
+    cdef chunk chunk_
+
+    chunklen = self._chunklen
+    arrays = [array[i*chunklen:(i+1)*chunklen] for i in range(nchunks)]
+    cbytes = 0
+    for chunk_ in chunk_compressor.compress(arrays, self._dtype,
+                                            self._cparams, self._dflt,
+                                            self._trial):
+      self.chunks.append(chunk_)
+      cbytes += chunk_.cbytes
+    return cbytes
+
+
   def trim(self, object nitems):
     """
     trim(nitems)
@@ -662,8 +3197,10 @@ cdef class carray:
     cdef npy_intp cbytes, bsize, nchunk2
     cdef chunk chunk_
 
+    self.check_writable()
     if not isinstance(nitems, (int, long, float)):
       raise TypeError, "`nitems` must be an integer"
+    self.reset_chunk_cache()
 
     # Check that we don't run out of space
     if nitems > self.len:
@@ -674,7 +3211,7 @@ cdef class carray:
       return
 
     atomsize = self.atomsize
-    chunks = self.chunks
+    chunks_ = self.chunks
     leftover = self.leftover
     bsize = nitems * atomsize
     cbytes = 0
@@ -693,13 +3230,13 @@ cdef class carray:
       # Remove complete chunks
       nchunk2 = self._nbytes // <npy_intp>self._chunksize
       while nchunk2 > nchunk+1:
-        chunk_ = chunks.pop()
+        chunk_ = chunks_.pop()
         cbytes += chunk_.cbytes
         nchunk2 -= 1
 
       # Finally, deal with the leftover
       if leftover:
-        chunk_ = chunks.pop()
+        chunk_ = chunks_.pop()
         cbytes += chunk_.cbytes
         self.lastchunkarr[:leftover2] = chunk_[:leftover2]
 
@@ -845,10 +3382,219 @@ cdef class carray:
     chunklen = self._chunklen
     for i from 0 <= i < self.len by chunklen:
       ccopy.append(self[i:i+chunklen])
+    ccopy.flush()
 
     return ccopy
 
 
+  def recompress(self, object cparams, object nthreads=None):
+    """
+    recompress(cparams, nthreads=None)
+
+    Compress the data in this object again with new `cparams`.
+
+    Chunks are processed in batches of `nthreads`: they are decompressed
+    and compressed again at the same time in the `chunk_decompressor`
+    and `chunk_compressor` threads, and replaced in place (releasing
+    their old data) as soon as their batch is done.  So neither an
+    uncompressed nor a second compressed copy of the whole data is
+    made.  Persistent objects are updated on disk as well.
+
+    Parameters
+    ----------
+    cparams : instance of the `cparams` class
+        The new parameters for the compressor.
+    nthreads : int, optional
+        The number of chunks to be processed at the same time (up to the
+        number of threads in the pools).  If None, the
+        `defaults.compress_threads` setting is used.
+
+    Notes
+    -----
+    The number of threads of Blosc (see `blosc_set_nthreads()`) is not
+    changed, so other threads are not affected.
+
+    """
+    cdef npy_intp nchunk, nchunks, first, last, nbatch, chunklen
+    cdef int cbytes
+    cdef chunk newchunk
+    cdef ndarray buf
+
+    if not isinstance(cparams, ca.cparams):
+      raise ValueError, "`cparams` param must be an instance of `cparams` class"
+    if nthreads is None:
+      nthreads = chunk_compressor.nthreads
+    if not isinstance(nthreads, int) or nthreads < 1:
+      raise ValueError, "`nthreads` must be a positive int"
+    self.check_writable()
+    self.reset_chunk_cache()
+    # Blocksizes may change.  Mark block cache as dirty.
+    if self.idxcache >= 0:
+      self.idxcache = -2
+
+    # New entries take the new params
+    if type(self.chunks) is chunklist:
+      (<chunklist>self.chunks).set_cparams(cparams)
+    else:
+      (<chunks>self.chunks).cparams = cparams
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    chunklen = self._chunklen
+    nbatch = nthreads
+    for first from 0 <= first < nchunks by nbatch:
+      last = first + nbatch
+      if last > nchunks:
+        last = nchunks
+      # A new buffer for every batch, as chunks may keep views of it
+      buf = np.empty(shape=((last - first) * chunklen,), dtype=self._dtype)
+      ranges = [(nchunk, 0, chunklen, 1, (nchunk - first) * chunklen,
+                 chunklen) for nchunk in range(first, last)]
+      if type(self.chunks) is chunklist:
+        chunk_decompressor.read(self, ranges, buf)
+      else:
+        # Chunks of disk-based objects are read one after another
+        for r in ranges:
+          self.read_chunk_range(r[0], 0, chunklen,
+                                buf.data + r[4] * self.atomsize)
+      arrays = [buf[r[4]:r[4]+chunklen] for r in ranges]
+      newbatch = chunk_compressor.compress(arrays, self._dtype, cparams,
+                                           self._dflt, nthreads=nthreads)
+      # Replace the chunks of the batch, releasing their old data
+      for nchunk from first <= nchunk < last:
+        if type(self.chunks) is chunklist:
+          cbytes = (<chunklist>self.chunks).cbytes[nchunk]
+        else:
+          cbytes = self.chunks[nchunk].cbytes
+        newchunk = newbatch[nchunk - first]
+        self.chunks[nchunk] = newchunk
+        self._cbytes += newchunk.cbytes - cbytes
+      newchunk = newbatch = arrays = None
+    self._cparams = cparams
+
+    # Make the changes persistent
+    self.flush()
+
+
+  def tier(self, int clevel=9, double age=3600):
+    """
+    tier(clevel=9, age=3600)
+
+    Compress again the chunks that have not been accessed lately.
+
+    The chunks that have not been read during the last `age` seconds and
+    are compressed with a level lower than `clevel` are compressed again
+    with `clevel`.  Readers and writers can use this object while this
+    runs (e.g. from the `chunk_tierer` thread, see `set_tiering()`).
+    Chunks modified in the meanwhile are left alone.
+
+    Parameters
+    ----------
+    clevel : int
+        The compression level for the cold chunks.
+    age : float
+        The number of seconds since the last access to a chunk for it to
+        be considered cold.
+
+    Returns
+    -------
+    out : int
+        The number of chunks that have been compressed again.
+
+    Notes
+    -----
+    Only in-memory objects keep the access stats for their chunks, so an
+    IOError is raised for disk-based ones.
+
+    """
+    cdef chunklist table
+    cdef npy_intp nchunk
+    cdef int ret, cbytes, chunksize, count
+    cdef time_t now
+    cdef context ctx
+    cdef char *data
+    cdef ndarray buf
+    cdef chunk newchunk
+
+    if type(self.chunks) is not chunklist:
+      raise IOError, "tiering is only supported for in-memory carrays"
+    table = self.chunks
+    cparams = ca.cparams(clevel=clevel, shuffle=self._cparams.shuffle,
+                         dedup=self._cparams.dedup)
+    chunksize = self._chunksize
+    buf = np.empty(shape=(self._chunklen,), dtype=self._dtype)
+    ctx = get_context()
+    now = time(NULL)
+    count = 0
+    nchunk = 0
+    # The table may shrink while the GIL is released, so check it always
+    while nchunk < table.nchunks:
+      if (table.isobject[nchunk] or table.clevels[nchunk] >= clevel or
+          now - table.stamps[nchunk] < age):
+        nchunk += 1
+        continue
+      # Pin the slab, so that the data cannot be reused meanwhile (and
+      # `replace()` can tell whether the entry has been modified)
+      owner = <object>table.owners[nchunk]
+      data = table.data[nchunk]
+      (<slab>owner).pin()
+      try:
+        with nogil:
+          ret = blosc_decompress_ctx(ctx.ctx, data, buf.data, chunksize)
+        if ret < 0:
+          blosc_error(ret, "decompression")
+        newchunk = chunk(buf, self._dtype, cparams)
+        cbytes = table.cbytes[nchunk]
+        if table.replace(nchunk, data, newchunk, clevel):
+          self._cbytes += table.cbytes[nchunk] - cbytes
+          count += 1
+      finally:
+        (<slab>owner).unpin()
+      owner = None
+      nchunk += 1
+    if count > 0:
+      # Blocksizes change with clevel, so drop the cached blocks
+      self.reset_chunk_cache()
+    return count
+
+
+  def set_tiering(self, object clevel=9, double age=3600):
+    """
+    set_tiering(clevel=9, age=3600)
+
+    Compress again the cold chunks of this object in the background.
+
+    The `chunk_tierer` thread will call ``tier(clevel, age)`` on this
+    object every `defaults.tiering_interval` seconds.  Pass None as
+    `clevel` for disabling it.
+
+    """
+    if type(self.chunks) is not chunklist:
+      raise IOError, "tiering is only supported for in-memory carrays"
+    if clevel is None:
+      chunk_tierer.unregister(self)
+    else:
+      chunk_tierer.register(self, clevel, age)
+
+
+  def _chunkaccess(self, npy_intp nchunk):
+    """
+    _chunkaccess(nchunk)
+
+    Return the (stamp, hits, clevel) access stats for chunk `nchunk`.
+
+    `stamp` is the time of the last access (in seconds since the epoch)
+    and `hits` the number of accesses.  Only in-memory objects keep them.
+
+    """
+    cdef chunklist table
+
+    if type(self.chunks) is not chunklist:
+      return None
+    table = self.chunks
+    if nchunk < 0 or nchunk >= table.nchunks:
+      raise IndexError, "index out of range"
+    return (table.stamps[nchunk], table.hits[nchunk], table.clevels[nchunk])
+
+
   def sum(self, dtype=None):
     """
     sum(dtype=None)
@@ -870,7 +3616,9 @@ cdef class carray:
 
     """
     cdef chunk chunk_
+    cdef chunklist table
     cdef npy_intp nchunk, nchunks
+    cdef ndarray buf
     cdef object result
 
     if dtype is None:
@@ -887,13 +3635,33 @@ cdef class carray:
     # Get a container for the result
     result = np.zeros(1, dtype=dtype)[0]
 
+    table = None
+    if type(self.chunks) is chunklist:
+      table = self.chunks
+    buf = None
+    isbool = self._dtype.type == np.bool_
     nchunks = self._nbytes // <npy_intp>self._chunksize
     for nchunk from 0 <= nchunk < nchunks:
+      if table is not None and not table.isobject[nchunk]:
+        # A regular chunk.  Use the data in the table directly.
+        if isbool:
+          result += table.true_count[nchunk]
+        else:
+          if buf is None:
+            buf = np.empty(shape=(self._chunklen,), dtype=self._dtype)
+          table._getitem(nchunk, 0, self._chunklen, buf.data)
+          result += buf.sum(dtype=dtype)
+        continue
       chunk_ = self.chunks[nchunk]
       if chunk_.isconstant:
-        result += chunk_.constant * self._chunklen
+        result += np.asarray(chunk_.constant).sum(dtype=dtype) * \
+                  self._chunklen
       elif self._dtype.type == np.bool_:
         result += chunk_.true_count
+      elif chunk_.issparse:
+        dflt = np.fromstring(chunk_.dflt, dtype=self._dtype.base)
+        result += chunk_.spvals.sum(dtype=dtype) + dflt.sum(dtype=dtype) * \
+                  (self._chunklen - len(chunk_.spidx))
       else:
         result += chunk_[:].sum(dtype=dtype)
     if self.leftover:
@@ -910,19 +3678,34 @@ cdef class carray:
     return self._cbytes
 
 
+  def __reduce__(self):
+    # Read-only persistent carrays are pickled by reference
+    if self._rootdir is not None and self._mode == "r":
+      return (ca.open, (self._rootdir, "r"))
+    # The rest ship their compressed chunks as they are
+    fileobj = StringIO()
+    self.save(fileobj)
+    return (_unpickle_carray, (fileobj.getvalue(),))
+
+
   cdef int getitem_cache(self, npy_intp pos, char *dest):
     """Get a single item from self.  It can use an internal cache.
 
     It returns 1 if asked `pos` can be copied to `dest`.  Else, this returns
     0.
 
+    The last block read is kept apart, and the rest of the decompressed
+    blocks go to the `block_cache` (if enabled), so that random lookups
+    spread over several regions do not thrash.
+
     WARNING: Any update operation (e.g. __setitem__) *must* disable this
-    cache by setting self.idxcache = -2.
+    cache by setting self.idxcache = -2 and calling `reset_chunk_cache()`.
     """
     cdef int ret, atomsize, blocksize, offset
     cdef int idxcache, posinbytes, blocklen
     cdef npy_intp nchunk, nchunks, chunklen
     cdef chunk chunk_
+    cdef object cached
 
     atomsize = self.atomsize
     nchunks = self._nbytes // <npy_intp>self._chunksize
@@ -935,21 +3718,36 @@ cdef class carray:
       memcpy(dest, self.lastchunk + posinbytes, atomsize)
       return 1
 
-    chunk_ = self.chunks[nchunk]
-    blocksize = chunk_.blocksize
+    # Check whether the chunk cache is in use
+    cached = self.cached_chunk(nchunk)
+    if cached is not None:
+      posinbytes = (pos % chunklen) * atomsize
+      memcpy(dest, (<ndarray>cached).data + posinbytes, atomsize)
+      return 1
+
+    if type(self.chunks) is chunklist and \
+           not (<chunklist>self.chunks).isobject[nchunk]:
+      blocksize = (<chunklist>self.chunks).blocksize[nchunk]
+    else:
+      chunk_ = self.chunks[nchunk]
+      blocksize = chunk_.blocksize
     blocklen = blocksize // atomsize
 
     if atomsize > blocksize:
       # This request cannot be resolved here
       return 0
 
-    # Check whether the cache block has to be initialized
-    if self.idxcache < 0:
+    # Check whether the cache block has to be initialized.  Chunks
+    # compressed with different levels (see `tier()`) have different
+    # blocksizes, so its size has to be checked too.
+    if self.idxcache < 0 or blocklen != self.blocklencache:
       self.blockcache = np.empty(shape=(blocklen,), dtype=self._dtype)
       self.datacache = self.blockcache.data
+      self.blocklencache = blocklen
       if self.idxcache == -1:
         # Absolute first time.  Add the cache size to cbytes counter.
         self._cbytes += self.blocksize
+      self.idxcache = -2
 
     # Check if data is cached
     idxcache = (pos // <npy_intp>blocklen) * blocklen
@@ -959,9 +3757,13 @@ cdef class carray:
       memcpy(dest, self.datacache + posinbytes, atomsize)
       return 1
 
-    # No luck. Read a complete block.
+    # No luck.  Look for the block in the block cache, or else read it.
     offset = idxcache % chunklen
-    chunk_._getitem(offset, offset+blocklen, self.datacache)
+    if block_cache.maxbytes > 0:
+      self.blockcache = self.read_block(nchunk, offset, blocklen, None)
+      self.datacache = self.blockcache.data
+    else:
+      self.read_chunk_range(nchunk, offset, offset+blocklen, self.datacache)
     # Copy the interesting bits to dest
     posinbytes = (pos % blocklen) * atomsize
     memcpy(dest, self.datacache + posinbytes, atomsize)
@@ -970,6 +3772,37 @@ cdef class carray:
     return 1
 
 
+  cdef ndarray read_block(self, npy_intp nchunk, npy_intp offset,
+                          int blocklen, chunk chunk_):
+    """Return the block of `blocklen` rows at `offset` in chunk `nchunk`.
+
+    Blocks go through the `block_cache` (if enabled).  The cached blocks
+    are shared, so a new one is needed for each read.  The block length
+    goes in the key too, as chunks may be replaced by others with a
+    different blocksize at any time (see `tier()`).  If `chunk_` is not
+    None, blocks not in the cache are read from it.
+    """
+    cdef npy_intp stop
+    cdef ndarray block
+
+    key = (self._cacheid, nchunk, offset, blocklen)
+    if block_cache.maxbytes > 0:
+      block = block_cache.get(key)
+      if block is not None:
+        return block
+    stop = offset + blocklen
+    if stop > self._chunklen:
+      stop = self._chunklen
+    block = np.empty(shape=(stop - offset,), dtype=self._dtype)
+    if chunk_ is None:
+      self.read_chunk_range(nchunk, offset, stop, block.data)
+    else:
+      chunk_._getitem(offset, stop, block.data)
+    if block_cache.maxbytes > 0:
+      block_cache.put(key, block)
+    return block
+
+
   def __getitem__(self, object key):
     """
     x.__getitem__(key) <==> x[key]
@@ -997,7 +3830,7 @@ cdef class carray:
     cdef npy_intp nwrow, blen
     cdef ndarray arr1
     cdef object start, stop, step
-    cdef object arr
+    cdef object arr, cached
 
     chunklen = self._chunklen
 
@@ -1063,6 +3896,8 @@ cdef class carray:
         return np.fromiter(self.where(key), dtype=self._dtype, count=count)
       elif np.issubsctype(key, np.int_):
         # An integer array
+        if key.ndim == 1:
+          return self.gather(key)
         return np.array([self[i] for i in key], dtype=self._dtype)
       else:
         raise IndexError, \
@@ -1098,6 +3933,8 @@ cdef class carray:
     nchunks = self._nbytes // <npy_intp>self._chunksize
     if self.leftover > 0:
       nchunks += 1
+    parallel = self.parallel_read(start, stop)
+    ranges = []
     for nchunk from 0 <= nchunk < nchunks:
       # Compute start & stop for each block
       startb, stopb, blen = clip_chunk(nchunk, chunklen, start, stop, step)
@@ -1106,13 +3943,104 @@ cdef class carray:
       # Get the data chunk and assign it to result array
       if nchunk == nchunks-1 and self.leftover:
         arr[nwrow:nwrow+blen] = self.lastchunkarr[startb:stopb:step]
+      elif parallel:
+        ranges.append((nchunk, startb, stopb, step, nwrow, blen))
       else:
-        arr[nwrow:nwrow+blen] = self.chunks[nchunk][startb:stopb:step]
+        cached = self.cached_chunk(nchunk)
+        if cached is not None:
+          arr[nwrow:nwrow+blen] = cached[startb:stopb:step]
+        elif step == 1:
+          self.read_chunk_range(nchunk, startb, stopb,
+                                (<ndarray>arr).data+nwrow*self.atomsize)
+        else:
+          arr[nwrow:nwrow+blen] = self.chunks[nchunk][startb:stopb:step]
       nwrow += blen
+    if ranges:
+      chunk_decompressor.read(self, ranges, arr)
 
     return arr
 
 
+  cdef ndarray gather(self, object key):
+    """Return the rows at the positions in the 1-dim array `key`.
+
+    Positions are sorted and grouped by chunk and by block, so that every
+    block needed is decompressed only once (or the whole chunk, if most
+    of its blocks are needed).  Chunks go through the chunk cache and
+    blocks through the `block_cache`, like single items do.  Then, the
+    rows are put back in the order of `key`.
+    """
+    cdef npy_intp nrows, chunklen, nchunks, nchunk, lo, hi, blo, bhi
+    cdef npy_intp blocklen, bstart, nblocks
+    cdef int i, j, ngroups
+    cdef ndarray idx, order, sidx, out, buf, pos, block
+    cdef chunklist table
+    cdef chunk chunk_
+    cdef object bounds, bbounds, bids, cached
+
+    nrows = self.len
+    chunklen = self._chunklen
+    idx = np.array(key, dtype=np.int64)
+    # To support negative values
+    idx[idx < 0] += nrows
+    if len(idx) > 0 and (idx.min() < 0 or idx.max() >= nrows):
+      raise IndexError, "index out of range"
+    out = np.empty(shape=(len(idx),), dtype=self._dtype)
+    if len(idx) == 0:
+      return out
+
+    order = idx.argsort(kind="mergesort")
+    sidx = idx[order]
+    table = None
+    if type(self.chunks) is chunklist:
+      table = self.chunks
+    # The boundaries of the groups of positions in the same chunk
+    nchunks = self._nbytes // <npy_intp>self._chunksize
+    bounds = np.flatnonzero(np.diff(sidx // chunklen)) + 1
+    bounds = [0] + bounds.tolist() + [len(sidx)]
+    ngroups = len(bounds) - 1
+    buf = np.empty(shape=(chunklen,), dtype=self._dtype)
+    for i from 0 <= i < ngroups:
+      lo, hi = bounds[i], bounds[i+1]
+      nchunk = sidx[lo] // chunklen
+      pos = sidx[lo:hi] - nchunk * chunklen
+      if nchunk == nchunks:
+        # The rows are in the last (uncompressed) chunk
+        out[order[lo:hi]] = self.lastchunkarr[pos]
+        continue
+      cached = self.cached_chunk(nchunk)
+      if cached is not None:
+        out[order[lo:hi]] = cached[pos]
+        continue
+      # Get the chunk only once (this may read it from disk)
+      if table is not None and not table.isobject[nchunk]:
+        blocklen = table.blocksize[nchunk] // self.atomsize
+        chunk_ = None
+      else:
+        chunk_ = self.chunks[nchunk]
+        blocklen = chunk_.blocksize // self.atomsize
+      if blocklen == 0 or blocklen > chunklen:
+        blocklen = chunklen
+      bids = pos // blocklen
+      bbounds = np.flatnonzero(np.diff(bids)) + 1
+      nblocks = (chunklen + blocklen - 1) // blocklen
+      if 2 * (len(bbounds) + 1) > nblocks:
+        # Most of the blocks are needed; decompress the whole chunk
+        if chunk_ is None:
+          table._getitem(nchunk, 0, chunklen, buf.data)
+        else:
+          chunk_._getitem(0, chunklen, buf.data)
+        out[order[lo:hi]] = buf[pos]
+        continue
+      bbounds = [0] + bbounds.tolist() + [hi - lo]
+      for j from 0 <= j < len(bbounds) - 1:
+        blo, bhi = bbounds[j], bbounds[j+1]
+        bstart = (pos[blo] // blocklen) * blocklen
+        block = self.read_block(nchunk, bstart, blocklen, chunk_)
+        out[order[lo+blo:lo+bhi]] = block[pos[blo:bhi] - bstart]
+    return out
+
+
   def __setitem__(self, object key, object value):
     """
     x.__setitem__(key, value) <==> x[key] = value
@@ -1141,6 +4069,8 @@ cdef class carray:
     cdef object start, stop, step
     cdef object cdata, arr
 
+    self.check_writable()
+    self.reset_chunk_cache()
     # We are going to modify data.  Mark block cache as dirty.
     if self.idxcache >= 0:
       # -2 means that cbytes counter has not to be changed
@@ -1249,12 +4179,12 @@ cdef class carray:
         # Get the data chunk
         chunk_ = self.chunks[nchunk]
         self._cbytes -= chunk_.cbytes
-        # Get all the values there
-        cdata = chunk_[:]
-        # Overwrite it with data from value
-        cdata[startb:stopb:step] = value[nwrow:nwrow+blen]
+        # Get the values in the range to be modified
+        cdata = chunk_[startb:stopb]
+        # Overwrite them with data from value
+        cdata[::step] = value[nwrow:nwrow+blen]
         # Replace the chunk
-        chunk_ = chunk(cdata, self._dtype, self._cparams)
+        chunk_ = self.update_chunk(chunk_, startb, cdata)
         self.chunks[nchunk] = chunk_
         # Update cbytes counter
         self._cbytes += chunk_.cbytes
@@ -1271,6 +4201,7 @@ cdef class carray:
     cdef npy_intp nwrow, stop, cblen
     cdef npy_intp schunk, echunk, nchunk, nchunks
     cdef chunk chunk_
+    cdef object cached
 
     # Check that we are inside limits
     nrows = self._nbytes // <npy_intp>self.atomsize
@@ -1284,6 +4215,8 @@ cdef class carray:
     chunklen = self._chunksize // self.atomsize
     schunk = start // <npy_intp>chunklen
     echunk = (start+blen) // <npy_intp>chunklen
+    parallel = self.parallel_read(start, stop)
+    ranges = []
     for nchunk from schunk <= nchunk <= echunk:
       # Compute start & stop for each block
       startb = start % chunklen
@@ -1298,11 +4231,37 @@ cdef class carray:
       # Get the data chunk and assign it to result array
       if nchunk == nchunks and self.leftover:
         out[nwrow:nwrow+cblen] = self.lastchunkarr[startb:stopb]
+      elif parallel:
+        ranges.append((nchunk, startb, stopb, 1, nwrow, cblen))
       else:
-        chunk_ = self.chunks[nchunk]
-        chunk_._getitem(startb, stopb, out.data+nwrow*self.atomsize)
+        cached = self.cached_chunk(nchunk)
+        if cached is not None:
+          out[nwrow:nwrow+cblen] = cached[startb:stopb]
+        else:
+          self.read_chunk_range(nchunk, startb, stopb,
+                                out.data+nwrow*self.atomsize)
       nwrow += cblen
       start += cblen
+    if ranges:
+      chunk_decompressor.read(self, ranges, out)
+
+
+  cdef chunk update_chunk(self, chunk chunk_, npy_intp start, ndarray cdata):
+    """Return a new chunk out of `chunk_` with `cdata` put at `start`.
+
+    Only the compressed blocks touched by `cdata` are recompressed when
+    possible.  Else, the chunk is built again from scratch.
+    """
+    cdef object newchunk
+    cdef ndarray alldata
+
+    newchunk = chunk_.splice(start, cdata, self._cparams)
+    if newchunk is None:
+      alldata = chunk_[:]
+      alldata[start:start+len(cdata)] = cdata
+      newchunk = chunk(alldata, self._dtype, self._cparams, self._dflt,
+                       _trial=self._trial)
+    return newchunk
 
 
   cdef void bool_update(self, boolarr, value):
@@ -1340,12 +4299,14 @@ cdef class carray:
         # Get the data chunk
         chunk_ = self.chunks[nchunk]
         self._cbytes -= chunk_.cbytes
-        # Get all the values there
-        cdata = chunk_[:]
-        # Overwrite it with data from value
-        cdata[boolb] = value[nwrow:nwrow+blen]
+        # Get the values between the first and the last true positions
+        idx = boolb.nonzero()[0]
+        lo, hi = idx[0], idx[-1]+1
+        cdata = chunk_[lo:hi]
+        # Overwrite them with data from value
+        cdata[boolb[lo:hi]] = value[nwrow:nwrow+blen]
         # Replace the chunk
-        chunk_ = chunk(cdata, self._dtype, self._cparams)
+        chunk_ = self.update_chunk(chunk_, lo, cdata)
         self.chunks[nchunk] = chunk_
         # Update cbytes counter
         self._cbytes += chunk_.cbytes
@@ -1516,12 +4477,34 @@ cdef class carray:
   def __next__(self):
     cdef char *vbool
     cdef int nhits_buf
-    cdef npy_intp nchunk, nchunks
+    cdef npy_intp nchunk, nchunks, i
     cdef chunk chunk_
     cdef carray where_arr
 
     self.nextelement = self._nrow + self.step
     while (self.nextelement < self.stop) and (self.nhits < self.limit):
+      if self.sphits is not None:
+        # Visit the true rows of a sparse chunk only
+        if self.sphit == len(self.sphits):
+          self.sphits = None
+          self.nextelement = self.nrowsread
+          continue
+        i = self.sphit
+        self.sphit += 1
+        self._nrow = self.spbase + self.sphits[i]
+        self.nextelement = self._nrow + 1
+        self.nhits += 1
+        if self.nhits <= self.skip:
+          continue
+        if self.wheretrue_mode:
+          return self._nrow
+        # The values of the true rows have been gathered in the I/O buffer
+        if self.itemsize == self.atomsize:
+          return PyArray_GETITEM(
+            self.iobuf, self.iobuf.data + i * self.atomsize)
+        else:
+          return self.iobuf[i]
+
       if self.nextelement >= self.nrowsread:
         # Skip until there is interesting information
         while self.nextelement >= self.nrowsread + self.nrowsinbuf:
@@ -1561,6 +4544,16 @@ cdef class carray:
               self.nrowsread += self.nrowsinbuf
               self.nextelement += self.nrowsinbuf
               continue
+            # Sparse chunks with false as default have their true rows
+            # at hand, so the scan costs O(true rows), not O(chunklen)
+            elif chunk_.issparse and chunk_.dflt == '\x00':
+              self.spbase = self.nrowsread
+              self.sphits = chunk_.spidx
+              self.sphit = 0
+              if self.where_mode:
+                self.iobuf = self[self.spbase + chunk_.spidx.astype(np.intp)]
+              self.nrowsread += self.nrowsinbuf
+              continue
           # Skip last chunk if all zeros on it
           elif self.check_zeros(where_arr):
             self.nrowsread += self.nrowsinbuf
@@ -1621,6 +4614,7 @@ cdef class carray:
     self.wheretrue_mode = False
     self.where_mode = False
     self.where_arr = None
+    self.sphits = None
     self.nhits = 0
     self.limit = sys.maxint
     self.skip = 0
@@ -1725,8 +4719,10 @@ cdef class carray:
     cratio = self._nbytes / float(self._cbytes)
     fullrepr = """carray(%s, %s)  nbytes: %s; cbytes: %s; ratio: %.2f
   cparams := %r
-%s""" % (self.shape, self.dtype, snbytes, scbytes, cratio,
-         self.cparams, str(self))
+""" % (self.shape, self.dtype, snbytes, scbytes, cratio, self.cparams)
+    if self._rootdir:
+      fullrepr += "  rootdir := '%s'\n" % self._rootdir
+    fullrepr += str(self)
     return fullrepr
 
 
@@ -6,20 +6,88 @@
 #
 ########################################################################
 
-import sys, math
+import sys, os, os.path, shutil, tempfile, math
+import json
+from cStringIO import StringIO
 
 import numpy as np
 import carray as ca
 from carray import utils
+from carray.carrayExtension import PACK_MAGIC, write_pack_index
 import itertools as it
 from collections import namedtuple
 
 
+# The name of the manifest file for persistent ctables.  Column names
+# cannot start with an underscore, so it cannot collide with them.
+META_FILE = "__meta__"
+
+
+def _unpickle_ctable(data):
+    """Rebuild a ctable out of the `data` produced by `ctable.__reduce__()`."""
+    return ca.load(StringIO(data))
+
+
+class colsdict(dict):
+    """
+    colsdict(rootdir=None, mode='a')
+
+    A dictionary of ctable columns that can be opened lazily.
+
+    Columns living on-disk can be registered by name and dtype only.
+    They will be opened the first time they are accessed.
+
+    """
+
+    def __init__(self, rootdir=None, mode='a'):
+        dict.__init__(self)
+        self.rootdir = rootdir
+        self.mode = mode
+        self.dtypes = {}
+
+    def colpath(self, name):
+        """Return the directory hosting column `name`."""
+        return os.path.join(self.rootdir, name)
+
+    def register(self, name, dtype):
+        """Register column `name` with `dtype` without opening it."""
+        dict.__setitem__(self, name, None)
+        self.dtypes[name] = dtype
+
+    def isopen(self, name):
+        """Whether column `name` has been opened already or not."""
+        return dict.__getitem__(self, name) is not None
+
+    def dtypeof(self, name):
+        """Return the dtype of column `name` (without opening it)."""
+        if self.isopen(name):
+            return self[name].dtype
+        return self.dtypes[name]
+
+    def __getitem__(self, name):
+        column = dict.__getitem__(self, name)
+        if column is None:
+            column = ca.open(self.colpath(name), self.mode)
+            dict.__setitem__(self, name, column)
+        return column
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self.dtypes.pop(name, None)
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+
 class ctable(object):
     """
-    ctable(cols, names=None, **kwargs)
+    ctable(cols=None, names=None, **kwargs)
 
-    This class represents a compressed, column-wise, in-memory table.
+    This class represents a compressed, column-wise table either
+    in-memory or on-disk.
 
     Create a new ctable from `cols` with optional `names`.  The
     columns are carray objects.
@@ -28,7 +96,8 @@ class ctable(object):
     ----------
     cols : tuple or list of carray/ndarray objects, or structured ndarray
         The list of column data to build the ctable object.
-        This can also be a pure NumPy structured array.
+        This can also be a pure NumPy structured array.  If None, an
+        existing ctable on-disk is opened from `rootdir`.
     names : list of strings or string
         The list of names for the columns.  The names in this list must be
         valid Python identifiers, must not start with an underscore, and has
@@ -37,13 +106,20 @@ class ctable(object):
         and so on so forth (NumPy convention).
     kwargs : list of parameters or dictionary
         Allows to pass additional arguments supported by carray
-        constructors in case new carrays need to be built.
+        constructors in case new carrays need to be built.  The
+        `rootdir` and `mode` arguments have the same meaning than in
+        the carray constructor; every column will be stored in its own
+        sub-directory of `rootdir`.
 
     Notes
     -----
     Columns passed as carrays are not be copied, so their settings
     will stay the same, even if you pass additional arguments (cparams,
-    chunklen...).
+    chunklen...).  The exception is when a `rootdir` is passed; then
+    they are copied into it.
+
+    When a persistent ctable is opened, columns are not read until they
+    are accessed for the first time.
 
     """
 
@@ -54,7 +130,7 @@ class ctable(object):
     def dtype(self):
         "The data type of this ctable (numpy dtype)."
         names, cols = self.names, self.cols
-        l = [(name, cols[name].dtype) for name in names]
+        l = [(name, cols.dtypeof(name)) for name in names]
         return np.dtype(l)
 
     @property
@@ -102,14 +178,33 @@ class ctable(object):
         return (nbytes, cbytes, cratio)
 
 
-    def __init__(self, cols, names=None, **kwargs):
+    def __init__(self, cols=None, names=None, **kwargs):
 
         self.names = []
         """The names of the columns (list)."""
-        self.cols = {}
+        self.cols = colsdict()
         """The ctable columns (dict)."""
         self.len = 0
         """The number of rows (int)."""
+        self.rootdir = kwargs.pop('rootdir', None)
+        """The on-disk directory used for persistency (str or None)."""
+        self.mode = kwargs.pop('mode', 'a')
+        """The mode used to create/open this ctable (str)."""
+
+        if self.mode not in ('r', 'w', 'a'):
+            raise ValueError, "`mode` can only be 'r', 'w' or 'a'"
+        if cols is None:
+            # Open an existing ctable on-disk
+            if self.rootdir is None:
+                raise ValueError, \
+                      "you need to pass either `cols` or a `rootdir`"
+            self._open()
+            return
+        if self.rootdir is not None:
+            if self.mode == 'r':
+                raise ValueError, "cannot create a ctable in read-only mode"
+            self._mkdir()
+            self.cols = colsdict(self.rootdir, self.mode)
 
         # Get the names of the cols
         if names is None:
@@ -153,13 +248,15 @@ class ctable(object):
         for i, name in enumerate(names):
             if calist:
                 column = cols[i]
+                if self.rootdir is not None:
+                    column = column.copy(**self._colargs(name, kwargs))
             elif nalist:
                 column = cols[i]
                 if column.dtype == np.void:
                     raise ValueError, "`cols` elements cannot be of type void"
-                column = ca.carray(column, **kwargs)
+                column = ca.carray(column, **self._colargs(name, kwargs))
             elif ratype:
-                column = ca.carray(cols[name], **kwargs)
+                column = ca.carray(cols[name], **self._colargs(name, kwargs))
             self.cols[name] = column
             if clen >= 0 and clen != len(column):
                 raise ValueError, "all `cols` must have the same length"
@@ -169,6 +266,228 @@ class ctable(object):
         # Cache a structured array of len 1 for ctable[int] acceleration
         self._arr1 = np.empty(shape=(1,), dtype=self.dtype)
 
+        # Make the manifest persistent
+        self.flush()
+
+
+    def _colargs(self, name, kwargs):
+        """Return the carray constructor arguments for column `name`."""
+        if self.rootdir is None:
+            return kwargs
+        kwargs = kwargs.copy()
+        kwargs['rootdir'] = self.cols.colpath(name)
+        kwargs['mode'] = self.mode
+        return kwargs
+
+
+    def _mkdir(self):
+        """Create the `rootdir` directory for a new persistent ctable."""
+        rootdir = self.rootdir
+        if os.path.exists(rootdir):
+            if self.mode != "w":
+                raise IOError, \
+                      "specified rootdir path '%s' already exists " \
+                      "and creation mode is '%s'" % (rootdir, self.mode)
+            if os.path.isdir(rootdir):
+                shutil.rmtree(rootdir)
+            else:
+                os.remove(rootdir)
+        os.mkdir(rootdir)
+
+
+    def _open(self):
+        """Open an existing ctable on-disk without reading any column."""
+        metapath = os.path.join(self.rootdir, META_FILE)
+        if not os.path.exists(metapath):
+            raise IOError, "'%s' does not hold a ctable object" % self.rootdir
+        with open(metapath, 'rb') as f:
+            meta = json.loads(f.read())
+
+        self.names = [str(name) for name in meta['names']]
+        self.len = meta['len']
+        self._cparams = ca.cparams(
+            clevel=meta['cparams']['clevel'],
+            shuffle=meta['cparams']['shuffle'],
+            dedup=meta['cparams'].get('dedup', False))
+        self.cols = colsdict(self.rootdir, self.mode)
+        for name, dtype in zip(self.names, meta['dtypes']):
+            self.cols.register(name, utils.decode_dtype(dtype))
+
+        # Cache a structured array of len 1 for ctable[int] acceleration
+        self._arr1 = np.empty(shape=(1,), dtype=self.dtype)
+
+        if self.mode == "w":
+            self.resize(0)
+            self.flush()
+
+
+    def flush(self):
+        """
+        flush()
+
+        Flush data in internal buffers to disk.
+
+        This call should typically be done after performing modifications
+        (__settitem__(), append()) in persistence mode.  If you don't do
+        this, you risk losing part of your modifications.
+
+        """
+        if self.rootdir is None or self.mode == "r":
+            return
+
+        # Flush only the columns that have been opened
+        for name in self.names:
+            if self.cols.isopen(name):
+                self.cols[name].flush()
+
+        # Then the manifest
+        self._write_meta(self.rootdir)
+
+
+    def _write_meta(self, rootdir):
+        """Write the manifest of this ctable in `rootdir`."""
+        meta = {'names': self.names,
+                'dtypes': [utils.encode_dtype(self.cols.dtypeof(name))
+                           for name in self.names],
+                'len': self.len,
+                'cparams': {'clevel': self._cparams.clevel,
+                            'shuffle': self._cparams.shuffle,
+                            'dedup': self._cparams.dedup},
+                }
+        metapath = os.path.join(rootdir, META_FILE)
+        with open(metapath + ".tmp", 'wb') as f:
+            f.write(json.dumps(meta))
+        # Atomically replace the previous manifest
+        os.rename(metapath + ".tmp", metapath)
+
+
+    def share(self, name=None):
+        """
+        share(name=None)
+
+        Copy the compressed chunks of this ctable into shared memory.
+
+        A directory is created in `defaults.shm_dir` ('/dev/shm' by
+        default) with the manifest of the ctable and every column
+        packed in its own file (see `carray.share()`).  Other processes
+        can attach to it in read-only mode by using the `rootdir` of
+        the returned object (e.g. ``open(rootdir, mode='r')``).
+        Columns are memory mapped only when they are accessed.
+
+        Parameters
+        ----------
+        name : str, optional
+            The name of the segment directory.  If None, a unique name
+            is chosen.
+
+        Returns
+        -------
+        out : ctable object
+            A read-only ctable attached to the shared memory.
+
+        Notes
+        -----
+        The segment directory is not removed automatically.  Use
+        ``shutil.rmtree(rootdir)`` when it is not needed anymore.
+
+        """
+        if name is None:
+            rootdir = tempfile.mkdtemp(prefix="carray-",
+                                       dir=ca.defaults.shm_dir)
+        else:
+            rootdir = os.path.join(ca.defaults.shm_dir, name)
+            os.mkdir(rootdir)
+        for colname in self.names:
+            self.cols[colname].pack(os.path.join(rootdir, colname))
+        self._write_meta(rootdir)
+        return ctable(rootdir=rootdir, mode='r')
+
+
+    def save(self, fileobj):
+        """
+        save(fileobj)
+
+        Save this ctable into the `fileobj` file-like object.
+
+        The compressed chunks of every column are written verbatim (i.e.
+        without being decompressed and compressed again), followed by
+        the metadata.  The outcome can be restored with the `load()`
+        top-level function.
+
+        Parameters
+        ----------
+        fileobj : file-like object
+            The object where data will be written.  Only its `write()`
+            method is used.
+
+        Returns
+        -------
+        out : int
+            The number of bytes written.
+
+        """
+        offsets, sizes = [], []
+        fileobj.write(PACK_MAGIC)
+        offset = len(PACK_MAGIC)
+        for name in self.names:
+            size = self.cols[name].save(fileobj)
+            offsets.append(offset)
+            sizes.append(size)
+            offset += size
+        # The index and metadata go at the end
+        meta = {'names': self.names,
+                'len': self.len,
+                'cparams': {'clevel': self._cparams.clevel,
+                            'shuffle': self._cparams.shuffle,
+                            'dedup': self._cparams.dedup},
+                'offsets': offsets,
+                'sizes': sizes,
+                }
+        return offset + write_pack_index(fileobj, meta, offset)
+
+
+    def tofile(self, fileobj, raw=False):
+        """
+        tofile(fileobj, raw=False)
+
+        Write the rows of this ctable into a NumPy `.npy` file.
+
+        The rows are assembled and written one chunk at a time, so the
+        memory used is independent of the length of the ctable.
+
+        Parameters
+        ----------
+        fileobj : str or file-like object
+            The name of the file or an object supporting the `write()`
+            method.  If it is a name and the file exists, it will be
+            overwritten.
+        raw : bool
+            If True, no `.npy` header is written, so the outcome just
+            holds the bytes of the records (in C order).
+
+        See Also
+        --------
+        fromfile
+
+        """
+        if isinstance(fileobj, basestring):
+            with open(fileobj, 'wb') as f:
+                self.tofile(f, raw)
+            return
+
+        if not raw:
+            header = {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                      'fortran_order': False,
+                      'shape': (self.len,)}
+            np.lib.format.write_array_header_1_0(fileobj, header)
+        if not self.names:
+            # Without columns, there are no records to write
+            return
+        chunklen = sum(self.cols[name].chunklen
+                       for name in self.names) // len(self.names)
+        for i in xrange(0, self.len, chunklen):
+            fileobj.write(buffer(self[i:i+chunklen]))
+
 
     def append(self, rows):
         """
@@ -316,13 +635,16 @@ class ctable(object):
         if isinstance(newcol, np.ndarray):
             if 'cparams' not in kwargs:
                 kwargs['cparams'] = self.cparams
-            newcol = ca.carray(newcol, **kwargs)
+            newcol = ca.carray(newcol, **self._colargs(name, kwargs))
+        elif self.rootdir is not None:
+            newcol = newcol.copy(**self._colargs(name, kwargs))
 
         # Insert the column
         self.names.insert(pos, name)
         self.cols[name] = newcol
         # Update _arr1
         self._arr1 = np.empty(shape=(1,), dtype=self.dtype)
+        self.flush()
 
 
     def delcol(self, name=None, pos=None):
@@ -369,8 +691,11 @@ class ctable(object):
         # Remove the column
         self.names.pop(pos)
         del self.cols[name]
+        if self.rootdir is not None:
+            shutil.rmtree(self.cols.colpath(name))
         # Update _arr1
         self._arr1 = np.empty(shape=(1,), dtype=self.dtype)
+        self.flush()
 
 
     def copy(self, **kwargs):
@@ -393,13 +718,45 @@ class ctable(object):
 
         # Remove possible unsupported args for columns
         names = kwargs.pop('names', self.names)
+        rootdir = kwargs.pop('rootdir', None)
+        mode = kwargs.pop('mode', 'a')
         # Copy the columns
         cols = [ self.cols[name].copy(**kwargs) for name in self.names ]
         # Create the ctable
-        ccopy = ctable(cols, names, **kwargs)
+        ccopy = ctable(cols, names, rootdir=rootdir, mode=mode, **kwargs)
         return ccopy
 
 
+    def recompress(self, cparams, nthreads=None):
+        """
+        recompress(cparams, nthreads=None)
+
+        Compress the data in this ctable again with new `cparams`.
+
+        Columns are recompressed one after another, in batches of
+        chunks (see `carray.recompress()`), and the changes are made
+        persistent.
+
+        Parameters
+        ----------
+        cparams : instance of the `cparams` class
+            The new parameters for the compressor.
+        nthreads : int, optional
+            The number of chunks to be processed at the same time.  If
+            None, the `defaults.compress_threads` setting is used.
+
+        """
+        if self.mode == "r":
+            raise IOError, "cannot modify data in read-only mode"
+        if not isinstance(cparams, ca.cparams):
+            raise ValueError, "`cparams` param must be an instance of " \
+                  "`cparams` class"
+        for name in self.names:
+            self.cols[name].recompress(cparams, nthreads)
+        self._cparams = cparams
+        self.flush()
+
+
     def __len__(self):
         return self.len
 
@@ -408,6 +765,16 @@ class ctable(object):
         return self.cbytes
 
 
+    def __reduce__(self):
+        # Read-only persistent ctables are pickled by reference
+        if self.rootdir is not None and self.mode == "r":
+            return (ca.open, (self.rootdir, "r"))
+        # The rest ship their compressed chunks as they are
+        fileobj = StringIO()
+        self.save(fileobj)
+        return (_unpickle_ctable, (fileobj.getvalue(),))
+
+
     def where(self, expression, outcols=None, **kwargs):
         """
         where(expression, outcols=None, **kwargs)
@@ -629,14 +996,19 @@ class ctable(object):
             except:
                 raise IndexError, \
                       "key cannot be converted to an array of indices"
-            return np.fromiter((self[i] for i in key),
-                               dtype=self.dtype, count=len(key))
+            return self[key]
         # A boolean array (case of fancy indexing)
         elif hasattr(key, "dtype"):
             if key.dtype.type == np.bool_:
                 return self._where(key)
             elif np.issubsctype(key, np.int_):
                 # An integer array
+                if key.ndim == 1:
+                    # Gather the rows column by column
+                    ra = np.empty(len(key), dtype=self.dtype)
+                    for name in self.names:
+                        ra[name] = self.cols[name][key]
+                    return ra
                 return np.array([self[i] for i in key], dtype=self.dtype)
             else:
                 raise IndexError, \
@@ -766,8 +1138,10 @@ class ctable(object):
         scbytes = utils.human_readable_size(cbytes)
         fullrepr = """ctable(%s, %s) nbytes: %s; cbytes: %s; ratio: %.2f
   cparams := %r
-%s""" % (self.shape, self.dtype.str, snbytes, scbytes, cratio,
-         self.cparams, str(self))
+""" % (self.shape, self.dtype.str, snbytes, scbytes, cratio, self.cparams)
+        if self.rootdir:
+            fullrepr += "  rootdir := '%s'\n" % self.rootdir
+        fullrepr += str(self)
         return fullrepr
 
 
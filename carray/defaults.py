@@ -13,6 +13,8 @@ Feel free to change them for better adapting to your needs.
 
 """
 
+import os, os.path
+import tempfile
 import carray as ca
 
 
@@ -57,6 +59,85 @@ class Defaults(object):
         self.__eval_out_flavor = value
 
 
+    @property
+    def chunk_cache_size(self):
+        return ca.chunk_cache.maxbytes
+
+    @chunk_cache_size.setter
+    def chunk_cache_size(self, value):
+        ca.chunk_cache.set_maxbytes(value)
+
+    @property
+    def block_cache_size(self):
+        return ca.block_cache.maxbytes
+
+    @block_cache_size.setter
+    def block_cache_size(self, value):
+        ca.block_cache.set_maxbytes(value)
+
+    @property
+    def slab_size(self):
+        return ca.chunk_arena.slabsize
+
+    @slab_size.setter
+    def slab_size(self, value):
+        ca.chunk_arena.set_slabsize(value)
+
+    @property
+    def compress_threads(self):
+        return ca.chunk_compressor.nthreads
+
+    @compress_threads.setter
+    def compress_threads(self, value):
+        ca.chunk_compressor.set_nthreads(value)
+
+    @property
+    def decompress_threads(self):
+        return ca.chunk_decompressor.nthreads
+
+    @decompress_threads.setter
+    def decompress_threads(self, value):
+        ca.chunk_decompressor.set_nthreads(value)
+
+    @property
+    def min_cratio(self):
+        return self.__min_cratio
+
+    @min_cratio.setter
+    def min_cratio(self, value):
+        if not isinstance(value, (int, float)) or value < 0:
+            raise ValueError, "`min_cratio` must be a non-negative number"
+        self.__min_cratio = value
+
+    @property
+    def tiering_interval(self):
+        return ca.chunk_tierer.interval
+
+    @tiering_interval.setter
+    def tiering_interval(self, value):
+        ca.chunk_tierer.set_interval(value)
+
+    @property
+    def prefetch_chunks(self):
+        return self.__prefetch_chunks
+
+    @prefetch_chunks.setter
+    def prefetch_chunks(self, value):
+        if not isinstance(value, int) or value < 0:
+            raise ValueError, "`prefetch_chunks` must be a non-negative int"
+        self.__prefetch_chunks = value
+
+    @property
+    def shm_dir(self):
+        return self.__shm_dir
+
+    @shm_dir.setter
+    def shm_dir(self, value):
+        if not os.path.isdir(value):
+            raise ValueError, "`shm_dir` must be an existing directory"
+        self.__shm_dir = value
+
+
 defaults = Defaults()
 
 
@@ -81,3 +162,88 @@ not, then the default is 'python'.
 if ca.numexpr_here:
     defaults.eval_vm = "numexpr"
 
+# POSIX shared memory is exposed as a tmpfs in /dev/shm on Linux
+if os.path.isdir("/dev/shm"):
+    defaults.shm_dir = "/dev/shm"
+else:
+    defaults.shm_dir = tempfile.gettempdir()
+"""
+The directory where shared memory segments (see `carray.share()`) are
+created.  Default is '/dev/shm' if it exists.  If not, then the
+default is the temporary directory of the system.
+
+"""
+
+defaults.chunk_cache_size = 64*2**20
+"""
+The budget (in bytes) for the process-wide cache of decompressed chunks
+of disk-based carrays (see `chunk_cache`).  Set it to 0 for disabling
+the cache.  Default is 64 MB.
+
+"""
+
+defaults.block_cache_size = 8*2**20
+"""
+The budget (in bytes) for the process-wide cache of decompressed Blosc
+blocks used by single-item lookups (e.g. `carray[int]`, `ctable[int]`
+and fancy indexing), see `block_cache`.  Set it to 0 for disabling the
+cache (then only the last block read is kept).  Default is 8 MB.
+
+"""
+
+defaults.slab_size = 4*2**20
+"""
+The size (in bytes) of the slabs where the compressed data of chunks is
+allocated (see `chunk_arena`).  Chunks larger than a quarter of it get
+a slab of their own.  Set it to 0 for allocating a slab per chunk.
+Default is 4 MB.
+
+"""
+
+defaults.prefetch_chunks = 2
+"""
+The number of chunks to be decompressed ahead of time (in a background
+thread) during sequential scans (e.g. iterators or `eval()`).  The
+chunks are kept in the `chunk_cache`.  Set it to 0 for disabling the
+prefetching.  Default is 2.
+
+"""
+
+defaults.compress_threads = ca.detect_number_of_cores()
+"""
+The number of threads compressing chunks at the same time during bulk
+loads (i.e. the carray constructor, `carray.append()` and `fromiter()`),
+see `chunk_compressor`.  Set it to 1 for compressing chunks one after
+another (using the Blosc threads for each one).  Default is the number
+of detected cores.
+
+"""
+
+defaults.decompress_threads = ca.detect_number_of_cores()
+"""
+The number of threads decompressing chunks at the same time during
+large range reads of in-memory carrays (i.e. slices and `eval()`), see
+`chunk_decompressor`.  Set it to 1 for decompressing chunks one after
+another (using the Blosc threads for each one).  Default is the number
+of detected cores.
+
+"""
+
+defaults.min_cratio = 1.2
+"""
+The minimum compression ratio for the chunks of a carray to be worth
+compressing.  After a chunk compresses worse than this, the next ones
+are stored verbatim, and only a sample block of a chunk is tried from
+time to time.  This makes the ingestion of incompressible data (e.g.
+hashes or random floats) close to memcpy speed.  Set it to 0 for always
+compressing.  Default is 1.2.
+
+"""
+
+defaults.tiering_interval = 60
+"""
+The number of seconds between the rounds of the `chunk_tierer`, which
+compresses again the cold chunks of the carrays registered via
+`carray.set_tiering()`.  Default is 60.
+
+"""
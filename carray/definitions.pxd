@@ -27,10 +27,12 @@ cdef extern from "string.h":
   int strcmp(char *s1, char *s2)
   char *strdup(char *s)
   void *memcpy(void *dest, void *src, size_t n)
+  int memcmp(void *s1, void *s2, size_t n)
   void *memset(void *s, int c, size_t n)
 
 cdef extern from "time.h":
   ctypedef int time_t
+  time_t time(time_t *tloc)
 
 
 #-----------------------------------------------------------------------------
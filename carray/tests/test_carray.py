@@ -9,6 +9,12 @@
 
 import sys
 import struct
+import os, os.path
+import tempfile, shutil
+import time
+import threading
+from cStringIO import StringIO
+import cPickle
 
 import numpy as np
 from numpy.testing import assert_array_equal, assert_array_almost_equal
@@ -49,6 +55,180 @@ class chunkTest(unittest.TestCase):
         #print "b[1:8000]->", `b[1:8000]`
         assert_array_equal(a[1:8000], b[1:8000], "Arrays are not equal")
 
+    def test05(self):
+        """Testing `__getitem()__` method with constant (non-zero) values"""
+        a = np.ones((1000, 3), dtype='i4') * -1
+        b = chunk(a, atom=np.dtype(('i4', (3,))), cparams=ca.cparams())
+        assert_array_equal(a[10:900], b[10:900], "Arrays are not equal")
+        self.assert_(b.getdata() == chunk(
+            a[:1], atom=np.dtype(('i4', (3,))), cparams=ca.cparams()
+            ).getdata(), "only one atom should be stored")
+
+
+class constantTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `sum()` with constant chunks"""
+        a = np.ones(10003, dtype='i1')
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(b.sum() == a.sum(dtype=np.int_), "Sums are not equal")
+        a = np.ones((1000, 3))
+        b = ca.carray(a, chunklen=100)
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+
+    def test01(self):
+        """Testing `wheretrue()` with constant true chunks"""
+        a = np.zeros(10003, dtype='b1')
+        a[2000:5000] = True
+        a[-10:] = True
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+        self.assert_([i for i in b.wheretrue()] == list(a.nonzero()[0]),
+                     "wheretrue() does not work correctly")
+
+    def test02(self):
+        """Testing `where()` and `eval()` with constant chunks"""
+        a = np.arange(10003, dtype='f8') // 1000
+        b = ca.carray(a, chunklen=1000)
+        c = ca.eval("b == 3", out_flavor="numpy")
+        assert_array_equal(c, a == 3, "eval() does not work correctly")
+        self.assert_([v for v in b.where(c)] == list(a[a == 3]),
+                     "where() does not work correctly")
+
+
+class sparseTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `__getitem()__` with sparse chunks"""
+        a = np.zeros(10003)
+        a[::997] = np.arange(len(a[::997])) + 1
+        b = ca.carray(a, chunklen=1000)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        assert_array_equal(a[990:2995:3], b[990:2995:3],
+                           "Arrays are not equal")
+        self.assert_(a[1994] == b[1994], "Values are not equal")
+
+    def test01(self):
+        """Testing `sum()` and `where()` with sparse chunks (dflt != 0)"""
+        a = np.zeros(10003, dtype='i4') - 1
+        a[5::1001] = 3
+        b = ca.carray(a, dflt=-1, chunklen=1000)
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+        self.assert_([v for v in b.where(a > 0)] == list(a[a > 0]),
+                     "where() does not work correctly")
+
+    def test02(self):
+        """Testing `wheretrue()` and `__setitem__()` with sparse chunks"""
+        a = np.zeros(10003, dtype='b1')
+        a[7::1500] = True
+        b = ca.carray(a, chunklen=1000)
+        self.assert_([i for i in b.wheretrue()] == list(a.nonzero()[0]),
+                     "wheretrue() does not work correctly")
+        a[1500:1503] = True
+        b[1500:1503] = True
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+
+    def test03(self):
+        """Testing persistence of sparse chunks"""
+        a = np.zeros((10003, 3))
+        a[::1001] = 1
+        b = ca.carray(a, chunklen=1000)
+        f = StringIO()
+        b.save(f)
+        f.seek(0)
+        assert_array_equal(a, ca.load(f)[:], "Arrays are not equal")
+
+
+class chunklistTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing the chunk table with regular and constant chunks"""
+        a = np.arange(1e4)
+        a[2000:3000] = 7
+        b = ca.carray(a, chunklen=1000)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        assert_array_equal(a[1500:3500:3], b[1500:3500:3],
+                           "Arrays are not equal")
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+        self.assert_(b[2500] == a[2500], "Values are not equal")
+
+    def test01(self):
+        """Testing the chunk table with updates and trims"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000)
+        b[1000:2000] = 3
+        a[1000:2000] = 3
+        b[5555] = -1
+        a[5555] = -1
+        b.trim(2500)
+        a = a[:-2500]
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+        b.append(a)
+        assert_array_equal(np.concatenate((a, a)), b[:],
+                           "Arrays are not equal")
+
+    def test02(self):
+        """Testing the chunk table with boolean chunks"""
+        a = np.arange(1e4) % 3 == 0
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+        self.assert_([i for i in b.wheretrue()] == list(a.nonzero()[0]),
+                     "wheretrue() does not work correctly")
+
+
+class dedupTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing deduplication of chunks"""
+        a = np.tile(np.random.randint(0, 100, 1000), 20)
+        b = ca.carray(a, chunklen=1000, cparams=ca.cparams(dedup=True))
+        c = ca.carray(a, chunklen=1000)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(b.cbytes < c.cbytes / 2, "chunks are not deduplicated")
+
+    def test01(self):
+        """Testing deduplication of chunks (updates and trims)"""
+        a = np.tile(np.random.randint(0, 100, 1000), 10)
+        b = ca.carray(a, chunklen=1000, cparams=ca.cparams(dedup=True))
+        b[1500] = -1
+        a[1500] = -1
+        b[:1000] = a[3000:4000]
+        b.trim(1500)
+        a = a[:-1500]
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        b.append(a[:3000])
+        assert_array_equal(np.concatenate((a, a[:3000])), b[:],
+                           "Arrays are not equal")
+        self.assert_(b.sum() == a.sum() + a[:3000].sum(),
+                     "Sums are not equal")
+
+    def test02(self):
+        """Testing deduplication of chunks (persistence of the param)"""
+        a = np.tile(np.arange(1000), 5)
+        b = ca.carray(a, chunklen=1000, cparams=ca.cparams(dedup=True))
+        f = StringIO()
+        b.save(f)
+        f.seek(0)
+        c = ca.load(f)
+        self.assert_(c.cparams.dedup, "`dedup` param has not been kept")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test03(self):
+        """Testing deduplication of chunks (several Blosc threads)"""
+        a = np.random.randint(0, 100, 100000)
+        nthreads_old = ca.blosc_set_nthreads(4)
+        try:
+            b = ca.carray(a, chunklen=100000, cparams=ca.cparams(dedup=True))
+            cbytes = b.cbytes
+            for i in xrange(9):
+                b.append(a)
+        finally:
+            ca.blosc_set_nthreads(nthreads_old)
+        assert_array_equal(np.tile(a, 10), b[:], "Arrays are not equal")
+        self.assert_(b.cbytes < 2 * cbytes, "chunks are not deduplicated")
+
 
 class getitemTest(unittest.TestCase):
 
@@ -290,6 +470,37 @@ class setitemTest(unittest.TestCase):
         sl = slice(2, 99, -30)
         self.assertRaises(NotImplementedError, b.__setitem__, sl, 3.)
 
+    def test06(self):
+        """Testing `__setitem()__` method with scattered updates in chunks"""
+        a = np.arange(1e6)
+        b = ca.carray(a, chunklen=100*1000)
+        for i in xrange(5, len(a), 77777):
+            b[i] = -i
+            a[i] = -i
+        b[99990:100020] = 3.
+        a[99990:100020] = 3.
+        assert_array_equal(a, b[:], "__setitem__ not working correctly")
+        self.assert_(b.sum() == a.sum(), "Sums are not equal")
+
+    def test07(self):
+        """Testing `__setitem()__` method with steps and multidim data"""
+        a = np.arange(3e5).reshape(1e5, 3)
+        b = ca.carray(a, chunklen=10*1000)
+        b[15000:55000:7] = [1, 2, 3]
+        a[15000:55000:7] = [1, 2, 3]
+        assert_array_equal(a, b[:], "__setitem__ not working correctly")
+
+    def test08(self):
+        """Testing `__setitem()__` method with a boolean key (zone maps)"""
+        a = np.arange(1e6, dtype='i8')
+        b = ca.carray(a, chunklen=100*1000)
+        key = (a % 99991) == 3
+        b[key] = -5
+        a[key] = -5
+        assert_array_equal(a, b[:], "__setitem__ not working correctly")
+        self.assert_(b._zonemap(0, len(a))[0] == -5,
+                     "zone maps do not cover the new values")
+
 
 class appendTest(unittest.TestCase):
 
@@ -497,6 +708,316 @@ class copyTest(unittest.TestCase):
         self.assert_(b.cbytes < c.cbytes, "shuffle not changed")
 
 
+class recompressTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing recompress() with higher compression"""
+        a = np.linspace(-1., 1., 1e5)
+        b = ca.carray(a, chunklen=1000)
+        cbytes = b.cbytes
+        b.recompress(ca.cparams(clevel=9), nthreads=2)
+        self.assert_(b.cparams.clevel == 9, "cparams not changed")
+        self.assert_(b.cbytes < cbytes, "clevel not changed")
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+    def test01(self):
+        """Testing recompress() with persistent carrays"""
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            rootdir = os.path.join(tmpdir, "ca")
+            a = np.linspace(-1., 1., 1e4+3)
+            b = ca.carray(a, chunklen=1000, rootdir=rootdir)
+            b.recompress(ca.cparams(clevel=1, shuffle=False))
+            c = ca.open(rootdir, mode='r')
+            self.assert_(c.cparams.clevel == 1, "cparams not persisted")
+            self.assert_(c.cbytes == b.cbytes, "cbytes not persisted")
+            assert_array_equal(a, c[:], "Arrays are not equal")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test02(self):
+        """Testing recompress() in parallel batches"""
+        a = np.linspace(-1., 1., 1e5+7)
+        b = ca.carray(a, chunklen=1000)
+        c = ca.carray(a, chunklen=1000)
+        nthreads_old = ca.blosc_set_nthreads(2)
+        try:
+            b.recompress(ca.cparams(clevel=9), nthreads=1)
+            c.recompress(ca.cparams(clevel=9), nthreads=3)
+            self.assert_(ca.blosc_set_nthreads(nthreads_old) == 2,
+                         "Blosc threads changed")
+        finally:
+            ca.blosc_set_nthreads(nthreads_old)
+        self.assert_(b.cbytes == c.cbytes, "cbytes are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+
+    def test03(self):
+        """Testing that recompress() releases old data batch by batch"""
+        a = np.random.randint(0, 1000, 1e6)
+        b = ca.carray(a, chunklen=10000, cparams=ca.cparams(clevel=1))
+        live = ca.chunk_arena.live
+        peak = [live]
+        compress = ca.chunk_compressor.compress
+        def tracked(*args, **kwargs):
+            peak[0] = max(peak[0], ca.chunk_arena.live)
+            return compress(*args, **kwargs)
+        ca.chunk_compressor.compress = tracked
+        try:
+            b.recompress(ca.cparams(clevel=1, shuffle=False), nthreads=2)
+        finally:
+            del ca.chunk_compressor.compress
+        self.assert_(peak[0] - live < b.cbytes / 4,
+                     "old data is not released batch by batch")
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+
+class tierTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing tier() on cold chunks"""
+        a = np.linspace(-1., 1., 1e5)
+        b = ca.carray(a, chunklen=1000, cparams=ca.cparams(clevel=1))
+        cbytes = b.cbytes
+        self.assert_(b.tier(clevel=9, age=3600) == 0, "fresh chunks tiered")
+        self.assert_(b.tier(clevel=9, age=0) == 100, "cold chunks not tiered")
+        self.assert_(b.cbytes < cbytes, "cbytes not updated")
+        self.assert_(b._chunkaccess(0)[2] == 9, "clevel not recorded")
+        self.assert_(b.tier(clevel=9, age=0) == 0, "chunks tiered twice")
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        # Single items use the block cache with the new blocksizes
+        self.assert_(b[54321] == a[54321], "Values are not equal")
+
+    def test01(self):
+        """Testing the access stats of chunks"""
+        b = ca.carray(np.arange(1e4), chunklen=1000)
+        hits = b._chunkaccess(3)[1]
+        b[3000:3010]
+        b[3500]
+        self.assert_(b._chunkaccess(3)[1] > hits, "accesses not counted")
+        self.assert_(b._chunkaccess(4)[1] == hits, "wrong chunk counted")
+
+    def test02(self):
+        """Testing set_tiering() in the background"""
+        a = np.linspace(-1., 1., 1e5)
+        b = ca.carray(a, chunklen=1000, cparams=ca.cparams(clevel=1))
+        interval = ca.defaults.tiering_interval
+        ca.defaults.tiering_interval = .01
+        try:
+            b.set_tiering(clevel=9, age=0)
+            for i in xrange(500):
+                # Readers keep working meanwhile
+                assert_array_equal(a[:1000], b[:1000], "Arrays differ")
+                if b._chunkaccess(99)[2] == 9:
+                    break
+                time.sleep(.01)
+            b.set_tiering(None)
+        finally:
+            ca.defaults.tiering_interval = interval
+        self.assert_(b._chunkaccess(50)[2] == 9, "chunks not tiered")
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+    def test03(self):
+        """Testing single items before and after tier()"""
+        a = np.linspace(-1., 1., 1e5)
+        b = ca.carray(a, chunklen=10000, cparams=ca.cparams(clevel=1))
+        positions = [0, 3, 77777, 10000, 99999, 5]
+        for i in positions:
+            self.assert_(b[i] == a[i], "Values are not equal")
+        self.assert_(b.tier(clevel=9, age=0) > 0, "cold chunks not tiered")
+        for i in positions:
+            self.assert_(b[i] == a[i], "Values are not equal")
+        assert_array_equal(a[positions], b[positions], "Arrays are not equal")
+
+    def test04(self):
+        """Testing tier() and set_tiering() with persistent carrays"""
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            rootdir = os.path.join(tmpdir, "ca")
+            b = ca.carray(np.arange(1e4), chunklen=1000, rootdir=rootdir)
+            self.assertRaises(IOError, b.tier, 9, 0)
+            self.assertRaises(IOError, b.set_tiering, 9, 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class trialTest(unittest.TestCase):
+
+    def tearDown(self):
+        ca.defaults.min_cratio = 1.2
+
+    def test00(self):
+        """Testing that incompressible chunks are stored verbatim"""
+        a = np.random.rand(100000)
+        ca.defaults.min_cratio = 0
+        b = ca.carray(a, chunklen=10000)
+        ca.defaults.min_cratio = 1.2
+        c = ca.carray(a, chunklen=10000)
+        self.assert_(c.cbytes > b.cbytes, "chunks have been compressed")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test01(self):
+        """Testing compressible chunks after incompressible ones"""
+        a = np.random.rand(100000)
+        b = ca.carray(a, chunklen=10000)
+        c = np.arange(1e6)
+        b.append(c)
+        self.assert_(b.cbytes < a.nbytes + c.nbytes / 2,
+                     "chunks not compressed")
+        assert_array_equal(a, b[:100000], "Arrays are not equal")
+        assert_array_equal(c, b[100000:], "Arrays are not equal")
+
+
+class compressorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nthreads = ca.defaults.compress_threads
+
+    def tearDown(self):
+        ca.defaults.compress_threads = self.nthreads
+
+    def test00(self):
+        """Testing the constructor with several compressor threads"""
+        a = np.linspace(-1., 1., 1e5)
+        ca.defaults.compress_threads = 1
+        b = ca.carray(a, chunklen=1000)
+        ca.defaults.compress_threads = 4
+        c = ca.carray(a, chunklen=1000)
+        self.assert_(b.cbytes == c.cbytes, "cbytes are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test01(self):
+        """Testing append() with several compressor threads"""
+        a = np.arange(1e5)
+        ca.defaults.compress_threads = 3
+        b = ca.carray(a[:10], chunklen=1000)
+        b.append(a[10:50000])
+        b.append(a[50000:])
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+    def test02(self):
+        """Testing fromiter() with several compressor threads"""
+        ca.defaults.compress_threads = 2
+        b = ca.fromiter(xrange(10000), dtype='i4', count=-1, chunklen=100)
+        assert_array_equal(np.arange(10000), b[:], "Arrays are not equal")
+
+    def test03(self):
+        """Testing trials with several compressor threads"""
+        a = np.concatenate((np.random.rand(100000), np.arange(1e5)))
+        ca.defaults.compress_threads = 4
+        b = ca.carray(a, chunklen=10000)
+        for i in xrange(3):
+            c = ca.carray(a, chunklen=10000)
+            self.assert_(b.cbytes == c.cbytes, "cbytes are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test04(self):
+        """Testing fewer compressor threads after the pool has started"""
+        lock = threading.Lock()
+        running = [0, 0]    # the current and maximum number of tasks
+        def task():
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(.05)
+            with lock:
+                running[0] -= 1
+        ca.defaults.compress_threads = 6
+        ca.chunk_compressor.map(task, [()] * 12)
+        self.assert_(running[1] > 2, "tasks did not run concurrently")
+        ca.defaults.compress_threads = 2
+        running[1] = 0
+        ca.chunk_compressor.map(task, [()] * 12)
+        self.assert_(running[1] <= 2, "threads in excess are still running")
+        for i in xrange(100):
+            names = [t.name for t in threading.enumerate()]
+            if names.count("carray-compressor") == 2:
+                break
+            time.sleep(.01)
+        self.assert_(names.count("carray-compressor") == 2,
+                     "threads in excess have not quit")
+
+
+class decompressorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nthreads = ca.defaults.decompress_threads
+
+    def tearDown(self):
+        ca.defaults.decompress_threads = self.nthreads
+
+    def test00(self):
+        """Testing large slices with several decompressor threads"""
+        a = np.linspace(-1., 1., 1e5)
+        b = ca.carray(a, chunklen=1000)
+        ca.defaults.decompress_threads = 4
+        assert_array_equal(a[:], b[:], "Arrays are not equal")
+        assert_array_equal(a[1234:98765], b[1234:98765],
+                           "Arrays are not equal")
+        assert_array_equal(a[3:99999:7], b[3:99999:7],
+                           "Arrays are not equal")
+
+    def test01(self):
+        """Testing eval() with several decompressor threads"""
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=500)
+        ca.defaults.decompress_threads = 3
+        c = ca.eval("b * 2 + 1", vm="python")
+        assert_array_equal(a * 2 + 1, c[:], "Arrays are not equal")
+
+    def test02(self):
+        """Testing slices of a ctable with several decompressor threads"""
+        N = 10000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra, chunklen=100)
+        ca.defaults.decompress_threads = 2
+        assert_array_equal(ra[10:9000], t[10:9000], "ctables are not equal")
+
+
+class contextTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing several threads writing and reading different carrays"""
+        errors = []
+        def work(n):
+            try:
+                a = np.arange(n, n+1e5)
+                for i in xrange(5):
+                    b = ca.carray(a[:10], chunklen=1000)
+                    b.append(a[10:])
+                    assert_array_equal(a, b[:], "Arrays are not equal")
+                    assert_array_equal(a[3:5003:7], b[3:5003:7],
+                                       "Arrays are not equal")
+                    self.assert_(b[12345] == a[12345], "Values are not equal")
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assert_(errors == [], "Errors in threads: %s" % errors)
+
+    def test01(self):
+        """Testing several threads reading the same carray"""
+        a = np.linspace(-1., 1., 1e5)
+        b = ca.carray(a, chunklen=1000)
+        results = []
+        def work(start):
+            results.append(b[start::3].sum())
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assert_(len(results) == 3, "Some threads did not finish")
+        self.assert_(np.allclose(sorted(results),
+                                 sorted(a[i::3].sum() for i in range(3))),
+                     "Sums are not equal")
+
+
 class iterTest(unittest.TestCase):
 
     def test00(self):
@@ -724,6 +1245,18 @@ class wheretrueTest(unittest.TestCase):
         # print "where ->", [i for i in b.wheretrue(limit=1020,skip=1020)]
         self.assert_(wt == cwt, "wheretrue() does not work correctly")
 
+    def test08(self):
+        """Testing `wheretrue()` iterator with sparse chunks"""
+        a = np.zeros(1e5+3, dtype=np.bool_)
+        a[::4999] = True
+        a[50000:60000] = np.arange(10000) % 3 == 0   # a dense chunk
+        b = ca.carray(a, dflt=False, chunklen=10000)
+        wt = a.nonzero()[0].tolist()
+        cwt = [i for i in b.wheretrue()]
+        self.assert_(wt == cwt, "wheretrue() does not work correctly")
+        cwt = [i for i in b.wheretrue(skip=3, limit=5)]
+        self.assert_(wt[3:8] == cwt, "wheretrue() does not work correctly")
+
 
 class whereTest(unittest.TestCase):
 
@@ -830,6 +1363,20 @@ class whereTest(unittest.TestCase):
         #                                       limit=1010, skip=1010)]
         self.assert_(wt == cwt, "where() does not work correctly")
 
+    def test08(self):
+        """Testing `where()` iterator with sparse chunks"""
+        a = np.arange(1e5+3)
+        mask = np.zeros(len(a), dtype=np.bool_)
+        mask[::4999] = True
+        mask[50000:60000] = a[50000:60000] % 3 == 0   # a dense chunk
+        b = ca.carray(a, chunklen=1000)
+        c = ca.carray(mask, dflt=False, chunklen=10000)
+        wt = a[mask].tolist()
+        cwt = [v for v in b.where(c)]
+        self.assert_(wt == cwt, "where() does not work correctly")
+        cwt = [v for v in b.where(c, skip=3, limit=5)]
+        self.assert_(wt[3:8] == cwt, "where() does not work correctly")
+
 
 class fancy_indexing_getitemTest(unittest.TestCase):
 
@@ -894,6 +1441,29 @@ class fancy_indexing_getitemTest(unittest.TestCase):
         assert_array_equal(wt, cwt, "where() does not work correctly")
 
 
+    def test07(self):
+        """Testing fancy indexing (random positions over many chunks)"""
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=1000)
+        b.append(a[:500])
+        a = np.concatenate((a, a[:500]))
+        idx = np.random.randint(-len(a), len(a), size=10000)
+        assert_array_equal(b[idx], a[idx],
+                           "fancy indexing does not work correctly")
+        idx = np.array([5, 100400, 5, 99999, 0, -1, 5])
+        assert_array_equal(b[idx], a[idx],
+                           "fancy indexing does not work correctly")
+
+    def test08(self):
+        """Testing fancy indexing (dense positions and out of range)"""
+        a = np.linspace(-1., 1., 1e4)
+        b = ca.carray(a, chunklen=1000)
+        idx = np.arange(len(a))[::-3]
+        assert_array_equal(b[idx], a[idx],
+                           "fancy indexing does not work correctly")
+        self.assertRaises(IndexError, b.__getitem__, np.array([1, len(a)]))
+
+
 class fancy_indexing_setitemTest(unittest.TestCase):
 
     def test00(self):
@@ -1419,10 +1989,546 @@ class largeCarrayTest(unittest.TestCase):
         self.assert_(cn.sum() == 10)
 
 
+class persistentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="carray-")
+        self.rootdir = os.path.join(self.tmpdir, "ca")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test00(self):
+        """Testing persistent carray (create and open)"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000, rootdir=self.rootdir)
+        self.assert_(b.rootdir == self.rootdir)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        c = ca.open(self.rootdir)
+        self.assert_(c.chunklen == b.chunklen, "chunklens are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test01(self):
+        """Testing persistent carray (append and leftovers)"""
+        a = np.arange(1e4+3)
+        b = ca.carray(a[:1003], chunklen=1000, rootdir=self.rootdir)
+        b.append(a[1003:])
+        b.flush()
+        c = ca.open(self.rootdir)
+        self.assert_(len(c) == len(a), "Lengths are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test02(self):
+        """Testing persistent carray (multidimensional and dflt)"""
+        a = np.arange(3000, dtype='i4').reshape((1000,3))
+        b = ca.carray(a, dflt=1, chunklen=100, rootdir=self.rootdir)
+        c = ca.open(self.rootdir)
+        self.assert_(c.shape == a.shape, "Shapes are not equal")
+        self.assert_(c.dflt.tolist() == [1, 1, 1], "dflts are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test03(self):
+        """Testing persistent carray (constant chunks)"""
+        b = ca.zeros(1e4, dtype='i2', chunklen=1000, rootdir=self.rootdir)
+        c = ca.open(self.rootdir)
+        assert_array_equal(np.zeros(1e4, dtype='i2'), c[:],
+                           "Arrays are not equal")
+
+    def test04(self):
+        """Testing persistent carray (setitem and trim)"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000, rootdir=self.rootdir)
+        b[100:2500] = 3.
+        a[100:2500] = 3.
+        b.trim(1010)
+        b.flush()
+        c = ca.open(self.rootdir)
+        assert_array_equal(a[:-1010], c[:], "Arrays are not equal")
+
+    def test05(self):
+        """Testing persistent carray (read-only mode)"""
+        b = ca.arange(1e3, rootdir=self.rootdir)
+        c = ca.open(self.rootdir, mode='r')
+        self.assertRaises(IOError, c.append, 1)
+        self.assertRaises(IOError, c.__setitem__, 1, 1)
+        self.assertRaises(IOError, c.trim, 1)
+
+    def test06(self):
+        """Testing persistent carray (creation modes)"""
+        b = ca.arange(1e3, rootdir=self.rootdir)
+        self.assertRaises(IOError, ca.arange, 1e3, rootdir=self.rootdir)
+        c = ca.arange(10, rootdir=self.rootdir, mode='w')
+        assert_array_equal(np.arange(10), ca.open(self.rootdir)[:],
+                           "Arrays are not equal")
+        c = ca.open(self.rootdir, mode='w')
+        self.assert_(len(c) == 0, "carray has not been emptied")
+
+
+class chunkcacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="carray-")
+        self.rootdir = os.path.join(self.tmpdir, "ca")
+        self.cache_size = ca.defaults.chunk_cache_size
+
+    def tearDown(self):
+        ca.defaults.chunk_cache_size = self.cache_size
+        ca.chunk_cache.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test00(self):
+        """Testing the chunk cache (hits and misses)"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000, rootdir=self.rootdir)
+        c = ca.open(self.rootdir, mode='r')
+        ca.chunk_cache.reset_stats()
+        assert_array_equal(a[10:20], c[10:20], "Arrays are not equal")
+        self.assert_(ca.chunk_cache.misses == 1, "misses are not correct")
+        self.assert_(c[15] == a[15], "Values are not equal")
+        assert_array_equal(a[100:200], c[100:200], "Arrays are not equal")
+        self.assert_(ca.chunk_cache.hits == 2, "hits are not correct")
+
+    def test01(self):
+        """Testing the chunk cache (budget and eviction)"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000, rootdir=self.rootdir)
+        ca.chunk_cache.clear()
+        ca.defaults.chunk_cache_size = 3 * 1000 * a.itemsize
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(ca.chunk_cache.nentries == 3, "eviction does not work")
+        self.assert_(ca.chunk_cache.nbytes <= ca.chunk_cache.maxbytes)
+        ca.defaults.chunk_cache_size = 0
+        self.assert_(ca.chunk_cache.nentries == 0, "cache is not empty")
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+    def test02(self):
+        """Testing the chunk cache (invalidation after modifications)"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000, rootdir=self.rootdir)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        b[1000:3000] = 2
+        a[1000:3000] = 2
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        b.trim(5000)
+        b.append(a[5000:])
+        assert_array_equal(a, b[:], "Arrays are not equal")
+
+
+class blockcacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_size = ca.defaults.block_cache_size
+
+    def tearDown(self):
+        ca.defaults.block_cache_size = self.cache_size
+        ca.block_cache.clear()
+
+    def test00(self):
+        """Testing the block cache (alternating lookups)"""
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=10000)
+        ca.block_cache.clear()
+        ca.block_cache.reset_stats()
+        for i in xrange(10):
+            self.assert_(b[3] == a[3], "Values are not equal")
+            self.assert_(b[77777] == a[77777], "Values are not equal")
+        self.assert_(ca.block_cache.misses == 2, "misses are not correct")
+        self.assert_(ca.block_cache.hits == 18, "hits are not correct")
+
+    def test01(self):
+        """Testing the block cache (fancy indexing and ctables)"""
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=10000)
+        idx = np.random.randint(0, len(a), 1000)
+        assert_array_equal(a[idx], b[idx], "Arrays are not equal")
+        ra = np.fromiter(((i, i*2.) for i in xrange(10000)), dtype='i4,f8')
+        t = ca.ctable(ra, chunklen=1000)
+        for i in (5, 9000, 5, 9000):
+            self.assert_(t[i] == ra[i], "Rows are not equal")
+        ca.defaults.block_cache_size = 0
+        self.assert_(ca.block_cache.nentries == 0, "cache is not empty")
+        assert_array_equal(a[idx], b[idx], "Arrays are not equal")
+
+    def test02(self):
+        """Testing the block cache (invalidation after modifications)"""
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=10000)
+        self.assert_(b[3] == a[3], "Values are not equal")
+        self.assert_(b[77777] == a[77777], "Values are not equal")
+        b[:50000] = 1
+        a[:50000] = 1
+        self.assert_(b[77777] == a[77777], "Values are not equal")
+        self.assert_(b[3] == a[3], "Values are not equal")
+
+
+    def test03(self):
+        """Testing the block cache (repeated fancy indexing)"""
+        prefetch_chunks = ca.defaults.prefetch_chunks
+        ca.defaults.prefetch_chunks = 0
+        try:
+            a = np.arange(1e6)
+            b = ca.carray(a, chunklen=100000)
+            idx = np.array([3, 5, 777777, 4])
+            ca.block_cache.clear()
+            ca.block_cache.reset_stats()
+            for i in xrange(5):
+                assert_array_equal(a[idx], b[idx], "Arrays are not equal")
+            self.assert_(ca.block_cache.misses == 2,
+                         "misses are not correct")
+            self.assert_(ca.block_cache.hits == 8, "hits are not correct")
+        finally:
+            ca.defaults.prefetch_chunks = prefetch_chunks
+
+class arenaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.slab_size = ca.defaults.slab_size
+
+    def tearDown(self):
+        ca.defaults.slab_size = self.slab_size
+
+    def test00(self):
+        """Testing the chunk arena (slabs are shared and released)"""
+        ca.defaults.slab_size = 2**20
+        nslabs, live = ca.chunk_arena.nslabs, ca.chunk_arena.live
+        a = np.random.randint(0, 100, 100000)
+        b = ca.carray(a, chunklen=1000)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(ca.chunk_arena.nslabs - nslabs < 100 // 4,
+                     "chunks are not sharing slabs")
+        self.assert_(ca.chunk_arena.live > live, "live bytes not counted")
+        del b
+        # The slab in use for new chunks is kept
+        self.assert_(ca.chunk_arena.nslabs - nslabs <= 1,
+                     "slabs not released")
+        self.assert_(ca.chunk_arena.live == live, "live bytes not released")
+
+    def test01(self):
+        """Testing the chunk arena (fragmentation)"""
+        ca.defaults.slab_size = 2**20
+        a = np.random.randint(0, 100, 100000)
+        b = ca.carray(a, chunklen=1000)
+        fragmentation = ca.chunk_arena.fragmentation
+        b[10] = 1000    # replaces the first chunk
+        self.assert_(ca.chunk_arena.fragmentation > fragmentation,
+                     "fragmentation not counted")
+        self.assert_(ca.chunk_arena.slack >= 0, "slack is not correct")
+
+    def test02(self):
+        """Testing the chunk arena (a slab per chunk)"""
+        ca.defaults.slab_size = 0
+        nslabs = ca.chunk_arena.nslabs
+        a = np.random.randint(0, 100, 10000)
+        b = ca.carray(a, chunklen=1000)
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(ca.chunk_arena.nslabs - nslabs == 10,
+                     "there should be a slab per chunk")
+
+    def test03(self):
+        """Testing the chunk arena (released space is reused)"""
+        ca.defaults.slab_size = 2**20
+        a = np.random.randint(0, 100, 100000)
+        b = ca.carray(a, chunklen=1000)
+        nbytes = ca.chunk_arena.nbytes
+        for i in xrange(5000):
+            pos = (i * 37) % len(a)
+            a[pos] = b[pos] = i % 100
+        assert_array_equal(a, b[:], "Arrays are not equal")
+        self.assert_(ca.chunk_arena.nbytes - nbytes <= 2 * 2**20,
+                     "released space is not reused")
+
+
+class prefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefetch_chunks = ca.defaults.prefetch_chunks
+        ca.chunk_cache.clear()
+
+    def tearDown(self):
+        ca.defaults.prefetch_chunks = self.prefetch_chunks
+        ca.chunk_cache.clear()
+
+    def test00(self):
+        """Testing prefetching in sequential scans (iter)"""
+        ca.defaults.prefetch_chunks = 4
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(sum(b) == a.sum(), "Sums are not equal")
+        self.assert_(ca.chunk_cache.nentries > 0, "No chunk was prefetched")
+        self.assert_(sum(b.iter(2500, 50000, 3)) == a[2500:50000:3].sum())
+
+    def test01(self):
+        """Testing prefetching in sequential scans (eval)"""
+        ca.defaults.prefetch_chunks = 4
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=1000)
+        c = ca.eval("b * 2 + 1", out_flavor="numpy")
+        assert_array_equal(a * 2 + 1, c, "Arrays are not equal")
+
+    def test02(self):
+        """Testing disabled prefetching"""
+        ca.defaults.prefetch_chunks = 0
+        a = np.arange(1e5)
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(sum(b) == a.sum(), "Sums are not equal")
+        self.assert_(ca.chunk_cache.nentries == 0, "Chunks were cached")
+
+
+class packTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="carray-")
+        self.filename = os.path.join(self.tmpdir, "ca.pack")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test00(self):
+        """Testing `pack()` method (with leftover)"""
+        a = np.arange(1e4+3)
+        b = ca.carray(a, chunklen=1000)
+        b.pack(self.filename)
+        c = ca.open(self.filename, mode='r')
+        self.assert_(c.chunklen == b.chunklen, "chunklens are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+        assert_array_equal(a[999:2001], c[999:2001], "Arrays are not equal")
+        self.assert_(c[-1] == a[-1], "Values are not equal")
+
+    def test01(self):
+        """Testing `pack()` method (constant chunks, no leftover)"""
+        a = np.zeros((2000,2), dtype='i4')
+        b = ca.carray(a, chunklen=100)
+        b.pack(self.filename)
+        c = ca.open(self.filename, mode='r')
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test02(self):
+        """Testing `pack()` method (read-only access)"""
+        b = ca.arange(1e3)
+        b.pack(self.filename)
+        self.assertRaises(IOError, ca.open, self.filename)
+        c = ca.open(self.filename, mode='r')
+        self.assertRaises(IOError, c.append, 1)
+        self.assertRaises(IOError, c.__setitem__, 1, 1)
+
+    def test03(self):
+        """Testing `pack()` method (wheretrue on bool carrays)"""
+        a = np.arange(1e4) % 3 == 0
+        b = ca.carray(a, chunklen=1000)
+        b.pack(self.filename)
+        c = ca.open(self.filename, mode='r')
+        self.assert_(c.sum() == a.sum(), "Sums are not equal")
+        self.assert_([i for i in c.wheretrue()] == list(a.nonzero()[0]),
+                     "wheretrue() does not work correctly")
+
+
+class fromfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="carray-")
+        self.filename = os.path.join(self.tmpdir, "a.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test00(self):
+        """Testing fromfile (with leftover)"""
+        a = np.arange(1e4+3)
+        np.save(self.filename, a)
+        b = ca.fromfile(self.filename, chunklen=1000)
+        self.assert_(b.chunklen == 1000, "chunklen is not correct")
+        assert_array_equal(a, b[:], "fromfile does not work correctly")
+
+    def test01(self):
+        """Testing fromfile (multidim)"""
+        a = np.arange(3000, dtype='i4').reshape(1000, 3)
+        np.save(self.filename, a)
+        b = ca.fromfile(self.filename, chunklen=100)
+        self.assert_(b.shape == a.shape, "shapes are not equal")
+        assert_array_equal(a, b[:], "fromfile does not work correctly")
+
+    def test02(self):
+        """Testing fromfile (empty file)"""
+        a = np.array([], dtype='f4')
+        np.save(self.filename, a)
+        b = ca.fromfile(self.filename)
+        self.assert_(b.dtype == a.dtype, "dtypes are not equal")
+        assert_array_equal(a, b[:], "fromfile does not work correctly")
+
+    def test03(self):
+        """Testing tofile (with leftover)"""
+        a = np.arange(1e4+3)
+        b = ca.carray(a, chunklen=1000)
+        b.tofile(self.filename)
+        assert_array_equal(a, np.load(self.filename),
+                           "tofile does not work correctly")
+
+    def test04(self):
+        """Testing tofile (multidim, raw)"""
+        a = np.arange(3000, dtype='i4').reshape(1000, 3)
+        b = ca.carray(a, chunklen=300)
+        f = StringIO()
+        b.tofile(f, raw=True)
+        self.assert_(f.getvalue() == a.tostring(),
+                     "tofile does not work correctly")
+
+
+class zonemapTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing zone maps for ranges of chunks"""
+        a = np.arange(1e4)
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(b._zonemap(0, 1000) == (0, 999, 0))
+        self.assert_(b._zonemap(1500, 2500) == (1000, 2999, 0))
+        self.assert_(b._zonemap(0, len(a)) == (0, len(a)-1, 0))
+
+    def test01(self):
+        """Testing zone maps with NaNs and the leftover"""
+        a = np.arange(1e4+3)
+        a[:1000] = np.nan
+        a[1500] = np.nan
+        b = ca.carray(a, chunklen=1000)
+        self.assert_(b._zonemap(0, 1000) == (None, None, 1000))
+        self.assert_(b._zonemap(0, 2000) == (1000, 1999, 1001))
+        self.assert_(b._zonemap(10000, 10003) == (10000, 10002, 0))
+
+    def test02(self):
+        """Testing zone maps in persistent carrays"""
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            rootdir = os.path.join(tmpdir, "ca")
+            b = ca.carray(np.arange(1e4), chunklen=1000, rootdir=rootdir)
+            b.flush()
+            c = ca.open(rootdir, mode='r')
+            self.assert_(c._zonemap(1500, 2500) == (1000, 2999, 0))
+            f = StringIO()
+            c.save(f)
+            f.seek(0)
+            d = ca.load(f)
+            self.assert_(d._zonemap(1500, 2500) == (1000, 2999, 0))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test03(self):
+        """Testing that zone maps do not change query outcomes"""
+        N = 100*1000
+        a = np.arange(N, dtype='f8')
+        a[::7] = np.nan
+        b = ca.carray(a, chunklen=1000)
+        for expr in ("(b > 9e4) & (b < 9.5e4)", "(b < 10) | (b >= 99000)",
+                     "b == 5e4", "b != 3", "-1 < b"):
+            assert_array_equal(ca.eval(expr, out_flavor="numpy"),
+                               eval(expr.replace('b', 'a')),
+                               "zone maps spoiled the query")
+
+    def test04(self):
+        """Testing zone maps after updates on disk without a flush"""
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            rootdir = os.path.join(tmpdir, "ca")
+            a = np.arange(1e4)
+            b = ca.carray(a, chunklen=1000, rootdir=rootdir)
+            b.flush()
+            b[1000:2000] = -5
+            a[1000:2000] = -5
+            c = ca.open(rootdir, mode='r')
+            assert_array_equal(ca.eval("c < 0", out_flavor="numpy"), a < 0,
+                               "stale zone maps spoiled the query")
+            b.flush()
+            d = ca.open(rootdir, mode='r')
+            self.assert_(d._zonemap(1000, 2000) == (-5, -5, 0),
+                         "zone maps not saved again")
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class saveTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `save()` and `load()` (with leftover)"""
+        a = np.arange(1e4+3)
+        b = ca.carray(a, chunklen=1000)
+        f = StringIO()
+        nbytes = b.save(f)
+        self.assert_(nbytes == len(f.getvalue()), "nbytes is not correct")
+        f.seek(0)
+        c = ca.load(f)
+        self.assert_(c.chunklen == b.chunklen, "chunklens are not equal")
+        self.assert_(c.cbytes == b.cbytes, "cbytes are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+        # The loaded object must be able to grow
+        c.append(a)
+        assert_array_equal(np.concatenate((a, a)), c[:],
+                           "Arrays are not equal")
+
+    def test01(self):
+        """Testing `save()` and `load()` (multidim, dflt and constants)"""
+        a = np.zeros((1000,3), dtype='i4')
+        a[500:] = 1
+        b = ca.carray(a, dflt=2, chunklen=100)
+        f = StringIO()
+        f.write("prefix")
+        b.save(f)
+        f.seek(len("prefix"))
+        c = ca.load(f)
+        self.assert_(c.shape == a.shape, "Shapes are not equal")
+        self.assert_(c.dflt.tolist() == [2, 2, 2], "dflts are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+
+class shareTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `share()` method"""
+        a = np.arange(1e4+3)
+        b = ca.carray(a, chunklen=1000)
+        c = b.share()
+        try:
+            self.assert_(c.mode == 'r', "shared carray is not read-only")
+            assert_array_equal(a, c[:], "Arrays are not equal")
+            d = cPickle.loads(cPickle.dumps(c))
+            self.assert_(d.rootdir == c.rootdir, "rootdirs are not equal")
+            assert_array_equal(a, d[:], "Arrays are not equal")
+        finally:
+            os.remove(c.rootdir)
+
+
+class pickleTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing pickling of carrays"""
+        a = np.arange(1e4+3)
+        b = ca.carray(a, chunklen=1000)
+        s = cPickle.dumps(b, cPickle.HIGHEST_PROTOCOL)
+        self.assert_(len(s) < b.nbytes, "pickle is not compressed")
+        c = cPickle.loads(s)
+        self.assert_(c.cbytes == b.cbytes, "cbytes are not equal")
+        assert_array_equal(a, c[:], "Arrays are not equal")
+
+    def test01(self):
+        """Testing pickling of read-only persistent carrays"""
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            rootdir = os.path.join(tmpdir, "ca")
+            b = ca.arange(1e4, rootdir=rootdir)
+            s = cPickle.dumps(ca.open(rootdir, mode='r'))
+            self.assert_(len(s) < 200, "data has been pickled")
+            c = cPickle.loads(s)
+            self.assert_(c.rootdir == rootdir and c.mode == 'r')
+            assert_array_equal(b[:], c[:], "Arrays are not equal")
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 def suite():
     theSuite = unittest.TestSuite()
 
     theSuite.addTest(unittest.makeSuite(chunkTest))
+    theSuite.addTest(unittest.makeSuite(constantTest))
+    theSuite.addTest(unittest.makeSuite(sparseTest))
+    theSuite.addTest(unittest.makeSuite(chunklistTest))
+    theSuite.addTest(unittest.makeSuite(dedupTest))
     theSuite.addTest(unittest.makeSuite(getitemTest))
     theSuite.addTest(unittest.makeSuite(setitemTest))
     theSuite.addTest(unittest.makeSuite(appendTest))
@@ -1431,18 +2537,35 @@ def suite():
     theSuite.addTest(unittest.makeSuite(resize_largeTest))
     theSuite.addTest(unittest.makeSuite(miscTest))
     theSuite.addTest(unittest.makeSuite(copyTest))
+    theSuite.addTest(unittest.makeSuite(recompressTest))
+    theSuite.addTest(unittest.makeSuite(tierTest))
+    theSuite.addTest(unittest.makeSuite(trialTest))
+    theSuite.addTest(unittest.makeSuite(compressorTest))
+    theSuite.addTest(unittest.makeSuite(decompressorTest))
+    theSuite.addTest(unittest.makeSuite(contextTest))
     theSuite.addTest(unittest.makeSuite(iterTest))
     theSuite.addTest(unittest.makeSuite(wheretrueTest))
     theSuite.addTest(unittest.makeSuite(whereTest))
     theSuite.addTest(unittest.makeSuite(fancy_indexing_getitemTest))
     theSuite.addTest(unittest.makeSuite(fancy_indexing_setitemTest))
     theSuite.addTest(unittest.makeSuite(fromiterTest))
+    theSuite.addTest(unittest.makeSuite(fromfileTest))
+    theSuite.addTest(unittest.makeSuite(zonemapTest))
     theSuite.addTest(unittest.makeSuite(arange_smallTest))
     theSuite.addTest(unittest.makeSuite(arange_bigTest))
     theSuite.addTest(unittest.makeSuite(constructor_smallTest))
     theSuite.addTest(unittest.makeSuite(constructor_bigTest))
     theSuite.addTest(unittest.makeSuite(dtypesTest))
     theSuite.addTest(unittest.makeSuite(computeMethodsTest))
+    theSuite.addTest(unittest.makeSuite(persistentTest))
+    theSuite.addTest(unittest.makeSuite(chunkcacheTest))
+    theSuite.addTest(unittest.makeSuite(blockcacheTest))
+    theSuite.addTest(unittest.makeSuite(arenaTest))
+    theSuite.addTest(unittest.makeSuite(prefetchTest))
+    theSuite.addTest(unittest.makeSuite(packTest))
+    theSuite.addTest(unittest.makeSuite(saveTest))
+    theSuite.addTest(unittest.makeSuite(pickleTest))
+    theSuite.addTest(unittest.makeSuite(shareTest))
     theSuite.addTest(unittest.makeSuite(eval_small))
     theSuite.addTest(unittest.makeSuite(eval_big))
     if ca.numexpr_here:
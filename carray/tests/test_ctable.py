@@ -7,6 +7,10 @@
 ########################################################################
 
 import sys
+import os, os.path
+import tempfile, shutil
+from cStringIO import StringIO
+import cPickle
 
 import numpy as np
 from numpy.testing import assert_array_equal, assert_array_almost_equal
@@ -466,6 +470,21 @@ class copyTest(unittest.TestCase):
         self.assert_(t['f1'].cbytes < t2['f1'].cbytes, "clevel not changed")
 
 
+class recompressTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing recompress() with higher clevel"""
+        N = 10*1000
+        ra = np.fromiter(((i, i**2.2) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra)
+        cbytes = t['f1'].cbytes
+        t.recompress(ca.cparams(clevel=9))
+        self.assert_(t.cparams.clevel == 9)
+        self.assert_(t['f1'].cparams.clevel == 9)
+        self.assert_(t['f1'].cbytes < cbytes, "clevel not changed")
+        assert_array_equal(t[:], ra, "ctable values are not correct")
+
+
 class specialTest(unittest.TestCase):
 
     def test00(self):
@@ -662,6 +681,16 @@ class fancy_indexing_getitemTest(unittest.TestCase):
         idx = np.array([1.1, 3.3], dtype='f8')
         self.assertRaises(IndexError, b.__getitem__, idx)
 
+    def test05(self):
+        """Testing fancy indexing with random positions over many chunks"""
+        N = 10*1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)), dtype='i4,f8,i8')
+        t = ca.ctable(ra, chunklen=100)
+        idx = np.random.randint(-N, N, size=5000)
+        rt = t[idx]
+        rar = ra[idx]
+        assert_array_equal(rt, rar, "ctable values are not correct")
+
 
 class fancy_indexing_setitemTest(unittest.TestCase):
 
@@ -1244,6 +1273,174 @@ class where_largeTest(whereTest):
     N = 10*1000
 
 
+class persistentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="carray-")
+        self.rootdir = os.path.join(self.tmpdir, "ct")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test00(self):
+        """Testing persistent ctable (create and open)"""
+        N = 10000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra, rootdir=self.rootdir)
+        t2 = ca.open(self.rootdir)
+        self.assert_(t2.names == t.names, "names are not equal")
+        self.assert_(t2.dtype == ra.dtype, "dtypes are not equal")
+        assert_array_equal(t2[:], ra, "ctable values are not correct")
+
+    def test01(self):
+        """Testing persistent ctable (columns are opened lazily)"""
+        N = 1000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)),
+                         dtype='i4,f8,i8')
+        t = ca.ctable(ra, rootdir=self.rootdir)
+        t2 = ca.open(self.rootdir, mode='r')
+        self.assert_(not [n for n in t2.names if t2.cols.isopen(n)],
+                     "columns have been opened too early")
+        self.assert_(len(t2) == N and t2.dtype == ra.dtype)
+        r = t2.eval("f0 < 10")
+        self.assert_(t2.cols.isopen('f0'), "column has not been opened")
+        self.assert_(not t2.cols.isopen('f1'), "column has been opened")
+        assert_array_equal(r[:], ra['f0'] < 10, "eval() is not correct")
+
+    def test02(self):
+        """Testing persistent ctable (append, addcol and delcol)"""
+        N = 1000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra, rootdir=self.rootdir)
+        t.append(ra)
+        t.addcol(np.arange(2*N), 'f2')
+        t.delcol('f0')
+        t.flush()
+        t2 = ca.open(self.rootdir)
+        self.assert_(t2.names == ['f1', 'f2'], "names are not correct")
+        assert_array_equal(t2['f1'][:], np.concatenate((ra['f1'], ra['f1'])),
+                           "column values are not correct")
+        assert_array_equal(t2['f2'][:], np.arange(2*N),
+                           "column values are not correct")
+        self.assert_(not os.path.exists(os.path.join(self.rootdir, 'f0')))
+
+    def test03(self):
+        """Testing persistent ctable (copy to disk and read-only mode)"""
+        N = 1000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra)
+        t2 = t.copy(rootdir=self.rootdir)
+        t3 = ca.open(self.rootdir, mode='r')
+        assert_array_equal(t3[:], ra, "ctable values are not correct")
+        self.assertRaises(IOError, t3.append, ra)
+
+
+class saveTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `save()` and `load()` in ctables"""
+        N = 10000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)),
+                         dtype='i4,f8,i8')
+        t = ca.ctable(ra, chunklen=1000)
+        f = StringIO()
+        t.save(f)
+        f.seek(0)
+        t2 = ca.load(f)
+        self.assert_(t2.names == t.names, "names are not equal")
+        self.assert_(t2.cbytes == t.cbytes, "cbytes are not equal")
+        assert_array_equal(t2[:], ra, "ctable values are not correct")
+
+
+class pickleTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing pickling of ctables"""
+        N = 10000
+        ra = np.fromiter(((i, i*2., i*3) for i in xrange(N)),
+                         dtype='i4,f8,i8')
+        t = ca.ctable(ra)
+        t2 = cPickle.loads(cPickle.dumps(t, cPickle.HIGHEST_PROTOCOL))
+        self.assert_(t2.names == t.names, "names are not equal")
+        assert_array_equal(t2[:], ra, "ctable values are not correct")
+
+
+class shareTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `share()` method in ctables"""
+        N = 10000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra)
+        t2 = t.share()
+        try:
+            self.assert_(t2.mode == 'r', "shared ctable is not read-only")
+            t3 = ca.open(t2.rootdir, mode='r')
+            assert_array_equal(t3[:], ra, "ctable values are not correct")
+        finally:
+            shutil.rmtree(t2.rootdir)
+
+
+class fromfileTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing fromfile with a structured .npy file"""
+        N = 10000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            filename = os.path.join(tmpdir, "ra.npy")
+            np.save(filename, ra)
+            t = ca.fromfile(filename, chunklen=1000)
+            self.assert_(isinstance(t, ca.ctable), "not a ctable")
+            self.assert_(t.names == list(ra.dtype.names))
+            assert_array_equal(t[:], ra, "ctable values are not correct")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test01(self):
+        """Testing tofile with a ctable"""
+        N = 10003
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra, chunklen=1000)
+        f = StringIO()
+        t.tofile(f)
+        f.seek(0)
+        assert_array_equal(np.lib.format.read_array(f), ra,
+                           "ctable values are not correct")
+
+    def test02(self):
+        """Testing fromfile with a structured .npy file without fields"""
+        tmpdir = tempfile.mkdtemp(prefix="carray-")
+        try:
+            filename = os.path.join(tmpdir, "ra.npy")
+            np.save(filename, np.zeros(10, dtype=[]))
+            self.assertRaises(ValueError, ca.fromfile, filename)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test03(self):
+        """Testing tofile with a ctable without columns"""
+        t = ca.ctable([])
+        f = StringIO()
+        t.tofile(f)
+        f.seek(0)
+        self.assert_(len(np.lib.format.read_array(f)) == 0,
+                     "there should be no records")
+
+
+class zonemapTest(unittest.TestCase):
+
+    def test00(self):
+        """Testing `where()` with zone maps on time-ordered data"""
+        N = 100*1000
+        ra = np.fromiter(((i, i*2.) for i in xrange(N)), dtype='i4,f8')
+        t = ca.ctable(ra, chunklen=1000)
+        rt = [r.f0 for r in t.where("(f0 > 5e4) & (f1 < 100200)")]
+        rl = [i for i in xrange(N) if (i > 5e4) & (i*2. < 100200)]
+        self.assert_(rt == rl, "where() does not work correctly")
+
+
 def suite():
     theSuite = unittest.TestSuite()
 
@@ -1255,6 +1452,7 @@ def suite():
     theSuite.addTest(unittest.makeSuite(trimTest))
     theSuite.addTest(unittest.makeSuite(resizeTest))
     theSuite.addTest(unittest.makeSuite(copyTest))
+    theSuite.addTest(unittest.makeSuite(recompressTest))
     theSuite.addTest(unittest.makeSuite(specialTest))
     theSuite.addTest(unittest.makeSuite(fancy_indexing_getitemTest))
     theSuite.addTest(unittest.makeSuite(fancy_indexing_setitemTest))
@@ -1266,6 +1464,12 @@ def suite():
     theSuite.addTest(unittest.makeSuite(bool_getitemTest))
     theSuite.addTest(unittest.makeSuite(where_smallTest))
     theSuite.addTest(unittest.makeSuite(where_largeTest))
+    theSuite.addTest(unittest.makeSuite(persistentTest))
+    theSuite.addTest(unittest.makeSuite(saveTest))
+    theSuite.addTest(unittest.makeSuite(pickleTest))
+    theSuite.addTest(unittest.makeSuite(shareTest))
+    theSuite.addTest(unittest.makeSuite(fromfileTest))
+    theSuite.addTest(unittest.makeSuite(zonemapTest))
 
     return theSuite
 
@@ -10,9 +10,12 @@
 """
 
 import sys, os
+import ast
 import itertools as it
 import numpy as np
 import carray as ca
+from carray.ctable import META_FILE as CTABLE_META_FILE
+from carray.carrayExtension import read_pack_meta, load_carray
 import math
 
 if ca.numexpr_here:
@@ -49,8 +52,11 @@ def set_nthreads(nthreads):
 
     Sets the number of threads to be used during carray operation.
 
-    This affects to both Blosc and Numexpr (if available).  If you want to
-    change this number only for Blosc, use `blosc_set_nthreads` instead.
+    This affects to Blosc, the `chunk_compressor` and
+    `chunk_decompressor` threads (see `defaults.compress_threads` and
+    `defaults.decompress_threads`) and Numexpr (if available).  If you want
+    to change this number only for Blosc, use `blosc_set_nthreads`
+    instead.
 
     Parameters
     ----------
@@ -68,6 +74,8 @@ def set_nthreads(nthreads):
 
     """
     nthreads_old = ca.blosc_set_nthreads(nthreads)
+    ca.defaults.compress_threads = nthreads
+    ca.defaults.decompress_threads = nthreads
     if ca.numexpr_here:
         ca.numexpr.set_num_threads(nthreads)
     return nthreads_old
@@ -142,7 +150,9 @@ def fromiter(iterable, dtype, count, **kwargs):
                         **kwargs)
         chunklen = obj.chunklen
 
-    # Then fill it
+    # Then fill it.  Read several chunks at a time, so that they can be
+    # compressed in parallel.
+    chunklen *= ca.defaults.compress_threads
     nread, blen = 0, 0
     while nread < count:
         if nread + chunklen > count:
@@ -164,6 +174,137 @@ def fromiter(iterable, dtype, count, **kwargs):
         # Check the end of the iterable
         if len(chunk) < chunklen:
             break
+    obj.flush()
+    return obj
+
+
+def fromfile(filename, **kwargs):
+    """
+    fromfile(filename, **kwargs)
+
+    Create a carray/ctable from a NumPy `.npy` file.
+
+    The file is memory-mapped and compressed one chunk at a time, so
+    only a couple of chunks are kept in memory during the process,
+    whatever the size of the file is.
+
+    Parameters
+    ----------
+    filename : string
+        The name of the `.npy` file.  If it holds a structured array, a
+        ctable is returned; otherwise the outcome is a carray.
+    kwargs : list of parameters or dictionary
+        Any parameter supported by the carray/ctable constructors.
+
+    Returns
+    -------
+    out : a carray/ctable object
+
+    See Also
+    --------
+    carray.tofile, ctable.tofile
+
+    """
+    src = np.load(filename, mmap_mode='r')
+    if src.ndim == 0:
+        raise ValueError, "cannot create a carray/ctable out of a scalar"
+    if src.dtype.names is not None and len(src.dtype.names) == 0:
+        raise ValueError, "cannot create a ctable without columns"
+
+    # First, create the container
+    expectedlen = kwargs.pop("expectedlen", len(src))
+    if src.dtype.names is not None and src.ndim == 1:
+        # A ctable
+        obj = ca.ctable(np.empty(0, dtype=src.dtype),
+                        expectedlen=expectedlen,
+                        **kwargs)
+        chunklen = sum(obj.cols[name].chunklen
+                       for name in obj.names) // len(obj.names)
+    else:
+        # A carray (atoms take the trailing dimensions of the source)
+        obj = ca.carray(np.empty((0,)+src.shape[1:], dtype=src.dtype),
+                        expectedlen=expectedlen,
+                        **kwargs)
+        chunklen = obj.chunklen
+
+    # Then fill it, one chunk at a time
+    for i in xrange(0, len(src), chunklen):
+        obj.append(np.asarray(src[i:i+chunklen]))
+    obj.flush()
+    del src   # release the mapping as soon as possible
+    return obj
+
+
+def open(rootdir, mode='a'):
+    """
+    open(rootdir, mode='a')
+
+    Open a disk-based carray/ctable.
+
+    Parameters
+    ----------
+    rootdir : pathname (string)
+        The directory hosting the carray/ctable object.  It can also be a
+        file created with `carray.pack()`, which can only be opened in 'r'
+        mode.
+    mode : the open mode (string)
+        Specifies the mode in which the object is opened.  The supported
+        values are:
+
+          * 'r' for read-only
+          * 'w' for emptying the previous underlying data
+          * 'a' for allowing read/write on top of existing data
+
+    Returns
+    -------
+    out : a carray/ctable object
+
+    """
+    if os.path.exists(os.path.join(rootdir, CTABLE_META_FILE)):
+        return ca.ctable(rootdir=rootdir, mode=mode)
+    return ca.carray(rootdir=rootdir, mode=mode)
+
+
+def load(fileobj):
+    """
+    load(fileobj)
+
+    Load a carray/ctable saved with `carray.save()` or `ctable.save()`.
+
+    The compressed chunks are restored as they are, so no
+    recompression is done.  The resulting object lives in-memory.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        The object where data will be read from.  It must support the
+        `seek()`, `tell()` and `read()` methods.  The data is read from
+        the current position up to the end of `fileobj`.
+
+    Returns
+    -------
+    out : a carray/ctable object
+
+    """
+    start = fileobj.tell()
+    fileobj.seek(0, 2)
+    end = fileobj.tell()
+    meta = read_pack_meta(fileobj, start, end)
+    if 'names' in meta:
+        # A ctable.  Every column is a carray pack by itself.
+        cols = []
+        for offset, size in zip(meta['offsets'], meta['sizes']):
+            cstart = start + offset
+            cmeta = read_pack_meta(fileobj, cstart, cstart + size)
+            cols.append(load_carray(fileobj, cstart, cmeta))
+        names = [str(name) for name in meta['names']]
+        cparams_ = ca.cparams(clevel=meta['cparams']['clevel'],
+                              shuffle=meta['cparams']['shuffle'],
+                              dedup=meta['cparams'].get('dedup', False))
+        obj = ca.ctable(cols, names, cparams=cparams_)
+    else:
+        obj = load_carray(fileobj, start, meta)
+    fileobj.seek(end)
     return obj
 
 
@@ -224,6 +365,7 @@ def fill(shape, dflt=None, dtype=np.float, **kwargs):
     # without memory consumption
     chunk = np.ndarray(length, dtype=dtype, buffer=dflt, strides=(0,))
     obj.append(chunk)
+    obj.flush()
     return obj
 
 
@@ -366,6 +508,7 @@ def arange(start=None, stop=None, step=None, dtype=None, **kwargs):
         obj.append(chunk)
         bstart = bstop
         bstop += incr
+    obj.flush()
     return obj
 
 
@@ -544,28 +687,18 @@ def _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
             if len(var) > bsize and hasattr(var, "_getrange"):
                 vars_[name] = np.empty(bsize, dtype=var.dtype)
 
+    # Blocks where a predicate cannot be true are skipped via zone maps
+    predicate = None
+    if maxndims == 1:
+        predicate = _get_predicate(expression)
+
     for i in xrange(0, vlen, bsize):
-        # Get buffers for vars
-        for name in vars.iterkeys():
-            var = vars[name]
-            if hasattr(var, "__len__") and len(var) > bsize:
-                if hasattr(var, "_getrange"):
-                    if i+bsize < vlen:
-                        var._getrange(i, bsize, vars_[name])
-                    else:
-                        vars_[name] = var[i:]
-                else:
-                    vars_[name] = var[i:i+bsize]
-            else:
-                if hasattr(var, "__getitem__"):
-                    vars_[name] = var[:]
-                else:
-                    vars_[name] = var
-        # Perform the evaluation for this block
-        if vm == "python":
-            res_block = _eval(expression, vars_)
+        if (predicate is not None and
+            not _may_be_true(predicate, vars, i, i+bsize)):
+            res_block = np.zeros(min(bsize, vlen-i), dtype=np.bool_)
         else:
-            res_block = ca.numexpr.evaluate(expression, local_dict=vars_)
+            res_block = _eval_block(expression, vars, vars_, i, vlen, bsize,
+                                    vm)
         if i == 0:
             # Detection of reduction operations
             if len(res_block.shape) < maxndims:
@@ -587,9 +720,143 @@ def _eval_blocks(expression, vars, vlen, typesize, vm, out_flavor,
     return result
 
 
+def _eval_block(expression, vars, vars_, i, vlen, bsize, vm):
+    """Evaluate `expression` for the block starting at row `i`."""
+    # Get buffers for vars
+    for name in vars.iterkeys():
+        var = vars[name]
+        if hasattr(var, "__len__") and len(var) > bsize:
+            if hasattr(var, "_getrange"):
+                if i+bsize < vlen:
+                    var._getrange(i, bsize, vars_[name])
+                else:
+                    vars_[name] = var[i:]
+            else:
+                vars_[name] = var[i:i+bsize]
+        else:
+            if hasattr(var, "__getitem__"):
+                vars_[name] = var[:]
+            else:
+                vars_[name] = var
+    # Perform the evaluation for this block
+    if vm == "python":
+        return _eval(expression, vars_)
+    return ca.numexpr.evaluate(expression, local_dict=vars_)
+
+
+def _get_predicate(expression):
+    """Return the AST of `expression` if it is a predicate, else None.
+
+    Only comparisons, possibly combined with the ``&`` and ``|``
+    operators, are considered predicates here.
+    """
+    try:
+        node = ast.parse(expression, mode='eval').body
+    except SyntaxError:
+        return None
+    if _is_predicate(node):
+        return node
+    return None
+
+
+def _is_predicate(node):
+    """Check whether `node` is a predicate (see `_get_predicate()`)."""
+    if isinstance(node, ast.Compare):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op,
+                                                  (ast.BitAnd, ast.BitOr)):
+        return _is_predicate(node.left) and _is_predicate(node.right)
+    return False
+
+
+def _get_bounds(node, vars, start, stop):
+    """Return (min, max, nancount) bounds of `node` in [start, stop) rows.
+
+    For carrays, the bounds are taken from their zone maps.  Bounds are
+    returned as NumPy objects, so that comparisons with them follow the
+    same casting rules than the evaluation itself.  If they cannot be
+    known, None is returned.
+    """
+    if isinstance(node, ast.Num):
+        value = node.n
+    elif (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)
+          and isinstance(node.operand, ast.Num)):
+        # A negative constant
+        value = -node.operand.n
+    elif isinstance(node, ast.Name) and node.id in vars:
+        value = vars[node.id]
+    else:
+        return None
+    if isinstance(value, ca.carray):
+        if value.ndim != 1:
+            return None
+        stats = value._zonemap(start, stop)
+        if stats is None or stats[0] is None:
+            return stats
+        minval = np.array([stats[0]], dtype=value.dtype)
+        maxval = np.array([stats[1]], dtype=value.dtype)
+        return (minval, maxval, stats[2])
+    if isinstance(value, (int, long, float, np.integer, np.floating)):
+        if value != value:
+            return (None, None, 1)
+        return (value, value, 0)
+    return None
+
+
+def _may_compare(op, left, right):
+    """Check whether `left` `op` `right` may be true given their bounds."""
+    lmin, lmax, lnans = left
+    rmin, rmax, rnans = right
+    if isinstance(op, ast.NotEq):
+        if lnans or rnans:
+            return True
+        return not (lmin == lmax == rmin == rmax)
+    if lmin is None or rmin is None:
+        # Only NaNs, and comparisons with them are always false
+        return False
+    if isinstance(op, ast.Lt):
+        return bool(lmin < rmax)
+    if isinstance(op, ast.LtE):
+        return bool(lmin <= rmax)
+    if isinstance(op, ast.Gt):
+        return bool(lmax > rmin)
+    if isinstance(op, ast.GtE):
+        return bool(lmax >= rmin)
+    if isinstance(op, ast.Eq):
+        return bool(lmin <= rmax) and bool(rmin <= lmax)
+    return True
+
+
+def _may_be_true(node, vars, start, stop):
+    """Check whether `node` predicate may be true in [start, stop) rows.
+
+    The zone maps of the carrays in the predicate are used for this.  If
+    in doubt, True is returned.
+    """
+    if isinstance(node, ast.BinOp):
+        if isinstance(node.op, ast.BitAnd):
+            return (_may_be_true(node.left, vars, start, stop) and
+                    _may_be_true(node.right, vars, start, stop))
+        if isinstance(node.op, ast.BitOr):
+            return (_may_be_true(node.left, vars, start, stop) or
+                    _may_be_true(node.right, vars, start, stop))
+        return True
+    if isinstance(node, ast.Compare):
+        operands = [node.left] + node.comparators
+        for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+            lbounds = _get_bounds(left, vars, start, stop)
+            rbounds = _get_bounds(right, vars, start, stop)
+            if lbounds is None or rbounds is None:
+                continue
+            if not _may_compare(op, lbounds, rbounds):
+                return False
+        return True
+    return True
+
+
 class cparams(object):
     """
-    cparams(clevel=5, shuffle=True)
+    cparams(clevel=5, shuffle=True, dedup=False)
 
     Class to host parameters for compression and other filters.
 
@@ -599,6 +866,10 @@ class cparams(object):
         The compression level.
     shuffle : bool
         Whether the shuffle filter is active or not.
+    dedup : bool
+        Whether identical compressed chunks of in-memory carrays have to
+        share a single copy of the data.  Chunks are compressed with a
+        single Blosc thread then, so that equal data gives equal bytes.
 
     Notes
     -----
@@ -617,19 +888,29 @@ class cparams(object):
         """Shuffle filter is active?"""
         return self._shuffle
 
-    def __init__(self, clevel=5, shuffle=True):
+    @property
+    def dedup(self):
+        """Chunk deduplication is active?"""
+        return self._dedup
+
+    def __init__(self, clevel=5, shuffle=True, dedup=False):
         if not isinstance(clevel, int):
             raise ValueError, "`clevel` must an int."
         if not isinstance(shuffle, (bool, int)):
             raise ValueError, "`shuffle` must a boolean."
+        if not isinstance(dedup, (bool, int)):
+            raise ValueError, "`dedup` must a boolean."
         shuffle = bool(shuffle)
         if clevel < 0:
             raise ValueError, "clevel must be a positive integer"
         self._clevel = clevel
         self._shuffle = shuffle
+        self._dedup = bool(dedup)
 
     def __repr__(self):
         args = ["clevel=%d"%self._clevel, "shuffle=%s"%self._shuffle]
+        if self._dedup:
+            args.append("dedup=True")
         return '%s(%s)' % (self.__class__.__name__, ', '.join(args))
 
 
@@ -129,6 +129,38 @@ def to_ndarray(array, dtype, arrlen=None):
     return array
 
 
+def encode_dtype(dtype):
+    """Return a JSON serializable object describing `dtype`."""
+    base = dtype.base
+    if base.fields is None:
+        descr = base.str
+    else:
+        descr = base.descr
+    return {'descr': descr, 'shape': list(dtype.shape)}
+
+
+def _decode_descr(descr):
+    """Convert a JSON decoded `descr` into something that NumPy groks."""
+    if isinstance(descr, basestring):
+        return str(descr)
+    fields = []
+    for field in descr:
+        name, fmt = str(field[0]), _decode_descr(field[1])
+        if len(field) > 2:
+            fields.append((name, fmt, tuple(field[2])))
+        else:
+            fields.append((name, fmt))
+    return fields
+
+
+def decode_dtype(obj):
+    """Return the dtype described by `obj` (see `encode_dtype()`)."""
+    dtype = np.dtype(_decode_descr(obj['descr']))
+    if obj['shape']:
+        dtype = np.dtype((dtype, tuple(obj['shape'])))
+    return dtype
+
+
 def human_readable_size(size):
     """Return a string for better assessing large number of bytes."""
     if size < 2**10: